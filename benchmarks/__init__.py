@@ -0,0 +1,113 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Benchmarks of the hot paths of thymiodirect
+
+Usage
+-----
+
+python3 -m benchmarks [--quick] [--output results.json] [--compare previous.json] [name_prefix ...]
+"""
+
+import gc
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+
+def percentiles(samples: List[float], ps=(50, 90, 99)) -> Dict[str, float]:
+    """Get percentiles of samples (nearest rank), keys "p50" etc.
+    """
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    return {
+        f"p{p}": ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+        for p in ps
+    }
+
+
+def measure_allocations(fun: Callable[[], None], count: int) -> Dict[str, float]:
+    """Run fun count times with tracemalloc and get the peak of memory
+    allocated during the run and the memory still allocated afterwards per
+    call, in bytes.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for _ in range(count):
+            fun()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "alloc_peak_bytes": peak - before,
+        "alloc_retained_bytes": (after - before) / count,
+    }
+
+
+def measure(fun: Callable[[], None], ops_per_call: int = 1,
+            min_time: float = 0.2, repeat: int = 5, samples: int = 1000) -> Dict[str, float]:
+    """Benchmark fun: throughput (best and median of repeat runs of at
+    least min_time / repeat seconds), latency percentiles of single calls in
+    microseconds, and allocations.
+    """
+    # calibrate
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fun()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time / repeat / 4:
+            break
+        number *= 4
+    number = max(1, int(number * (min_time / repeat) / max(elapsed, 1e-9)))
+
+    rates = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fun()
+        rates.append(number * ops_per_call / (time.perf_counter() - t0))
+
+    latencies = []
+    for _ in range(min(samples, number * repeat)):
+        t0 = time.perf_counter_ns()
+        fun()
+        latencies.append((time.perf_counter_ns() - t0) / 1000)
+
+    result = {
+        "ops_per_s": max(rates),
+        "ops_per_s_median": statistics.median(rates),
+        "calls": number * repeat,
+    }
+    result.update({f"latency_us_{k}": v for k, v in percentiles(latencies).items()})
+    result.update(measure_allocations(fun, min(number, 1000)))
+    return result
+
+
+def environment() -> Dict[str, Optional[str]]:
+    """Describe the environment of a benchmark run.
+    """
+    try:
+        from importlib.metadata import version
+        thymiodirect_version = version("thymiodirect")
+    except Exception:
+        thymiodirect_version = None
+    return {
+        "thymiodirect": thymiodirect_version,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
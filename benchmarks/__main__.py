@@ -0,0 +1,70 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+# Run the benchmarks, print the results and store them as JSON
+
+import json
+import sys
+
+from . import environment, measure
+from . import end_to_end, micro
+
+if __name__ == "__main__":
+
+    quick = False
+    output = None
+    compare = None
+    prefixes = []
+    args = sys.argv[1:]
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--quick":
+                quick = True
+            elif arg == "--output":
+                output = args.pop(0)
+            elif arg == "--compare":
+                compare = args.pop(0)
+            elif arg[0:2] == "--":
+                raise ValueError(arg)
+            else:
+                prefixes.append(arg)
+    except (IndexError, ValueError):
+        print("Usage: python3 -m benchmarks [--quick] [--output results.json] [--compare previous.json] "
+              "[name_prefix ...]")
+        exit(1)
+
+    def selected(name):
+        return not prefixes or any(name.startswith(prefix) for prefix in prefixes)
+
+    results = {}
+    for name, fun, ops_per_call in micro.benchmarks():
+        if selected(name):
+            results[name] = measure(fun, ops_per_call,
+                                    min_time=0.05 if quick else 0.5,
+                                    samples=200 if quick else 2000)
+            print(f"{name:40} {results[name]['ops_per_s']:14,.0f} ops/s"
+                  f"  p50 {results[name]['latency_us_p50']:9.2f} us"
+                  f"  p99 {results[name]['latency_us_p99']:9.2f} us"
+                  f"  peak {results[name]['alloc_peak_bytes']:8,.0f} B")
+    if selected("e2e."):
+        for name, result in end_to_end.benchmarks(quick).items():
+            if selected(name):
+                results[name] = result
+                print(f"{name:40} " + "  ".join(f"{k} {v:,.3f}" for k, v in result.items()))
+
+    if compare:
+        with open(compare) as file:
+            previous = json.load(file)["results"]
+        print(f"\nCompared to {compare} (ratio of throughput, > 1 is faster):")
+        for name, result in results.items():
+            for key in ("ops_per_s", "messages_per_s", "handshakes_per_s"):
+                if key in result and key in previous.get(name, {}):
+                    print(f"{name:40} {result[key] / previous[name][key]:6.2f}")
+
+    if output:
+        with open(output, "w") as file:
+            json.dump({"environment": environment(), "results": results}, file, indent=2)
@@ -0,0 +1,123 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+End-to-end benchmarks against simulated nodes
+"""
+
+import asyncio
+import math
+import time
+from typing import Dict
+
+from thymiodirect.connection import Connection
+from thymiodirect.message import Message
+from thymiodirect.simulator import MAX_REPLY_SIZE, Simulator
+
+from . import percentiles
+from .micro import thymio_node
+
+
+def handshake(address, asyncio_input: bool = False, runs: int = 20) -> Dict[str, float]:
+    """Time from LIST_NODES to the end of the description of a node.
+    """
+    durations = []
+    for _ in range(runs):
+        connection = Connection.tcp(*address, asyncio_input=asyncio_input)
+        connected = connection.loop.create_future()
+
+        async def on_connection_changed(node_id, connect):
+            if connect and not connected.done():
+                connected.set_result(node_id)
+
+        connection.on_connection_changed = on_connection_changed
+        t0 = time.perf_counter()
+        connection.handshake()
+        connection.loop.run_until_complete(asyncio.wait_for(connected, 5))
+        durations.append((time.perf_counter() - t0) * 1000)
+        connection.shutdown()
+        connection.run_tasks()
+    result = {f"latency_ms_{k}": v for k, v in percentiles(durations).items()}
+    result["handshakes_per_s"] = 1000 * len(durations) / sum(durations)
+    return result
+
+
+def refresh_round_trip(address, asyncio_input: bool = False, count: int = 500) -> Dict[str, float]:
+    """Round-trip time of GET_VARIABLES requests for all the variables.
+    """
+    connection = Connection.tcp(*address, asyncio_input=asyncio_input)
+    loop = connection.loop
+    state = {"future": loop.create_future()}
+
+    async def on_connection_changed(node_id, connect):
+        if connect and not state["future"].done():
+            state["future"].set_result(node_id)
+
+    async def on_variables_received(node_id):
+        if not state["future"].done():
+            state["future"].set_result(node_id)
+
+    connection.on_connection_changed = on_connection_changed
+    connection.on_variables_received = on_variables_received
+    connection.handshake()
+    node_id = loop.run_until_complete(asyncio.wait_for(state["future"], 5))
+
+    async def run():
+        durations = []
+        t_start = time.perf_counter()
+        for _ in range(count):
+            state["future"] = loop.create_future()
+            t0 = time.perf_counter()
+            connection.get_variables(node_id)
+            await asyncio.wait_for(state["future"], 5)
+            durations.append((time.perf_counter() - t0) * 1000)
+        return durations, time.perf_counter() - t_start
+
+    durations, elapsed = loop.run_until_complete(run())
+    # request and reply split into VARIABLES messages of MAX_REPLY_SIZE words
+    messages = 1 + math.ceil(connection.remote_nodes[node_id].var_total_size / MAX_REPLY_SIZE)
+    connection.shutdown()
+    connection.run_tasks()
+    result = {f"latency_ms_{k}": v for k, v in percentiles(durations).items()}
+    result["messages_per_s"] = messages * count / elapsed
+    return result
+
+
+def receive_path(batch_size: int = 64, batches: int = 200) -> Dict[str, float]:
+    """Throughput of Connection.handle_messages with VARIABLES messages,
+    without any io.
+    """
+    simulated_node, remote_node = thymio_node()
+    connection = Connection.null()
+    connection.remote_nodes[remote_node.node_id] = remote_node
+    payload = Message.uint16array_to_bytes([0], simulated_node.var_data[:remote_node.var_total_size])
+    batch = [Message(Message.ID_VARIABLES, remote_node.node_id, payload) for _ in range(batch_size)]
+
+    async def run():
+        t0 = time.perf_counter()
+        for _ in range(batches):
+            await connection.handle_messages([Message(msg.id, msg.source_node, msg.payload) for msg in batch])
+        return time.perf_counter() - t0
+
+    elapsed = connection.loop.run_until_complete(run())
+    connection.shutdown()
+    connection.run_tasks()
+    return {"messages_per_s": batch_size * batches / elapsed}
+
+
+def benchmarks(quick: bool = False):
+    """Run the end-to-end benchmarks and get their results by name.
+    """
+    simulator = Simulator(node_count=1, seed=0)
+    address = simulator.start_in_thread()
+    runs = 5 if quick else 20
+    count = 100 if quick else 500
+    results = {"e2e.receive_path": receive_path(batches=50 if quick else 200)}
+    for asyncio_input in (False, True):
+        suffix = ".asyncio" if asyncio_input else ".thread"
+        results["e2e.handshake" + suffix] = handshake(address, asyncio_input, runs)
+        results["e2e.refresh_round_trip" + suffix] = refresh_round_trip(address, asyncio_input, count)
+    return results
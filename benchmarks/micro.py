@@ -0,0 +1,138 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Benchmarks of message coding, variable storage and assembly
+"""
+
+from array import array
+from typing import Callable, Dict, List, Tuple
+
+from thymiodirect.assembler import Assembler
+from thymiodirect.connection import RemoteNode
+from thymiodirect.message import FrameReader, Message
+from thymiodirect.simulator import SimulatedNode
+
+
+def thymio_node() -> Tuple[SimulatedNode, RemoteNode]:
+    """Get a simulated Thymio and a RemoteNode with its description.
+    """
+    simulated_node = SimulatedNode(2)
+    remote_node = RemoteNode(2, simulated_node.version)
+    for msg in simulated_node.description_messages():
+        if msg.id == Message.ID_DESCRIPTION:
+            remote_node.name = msg.node_name
+            remote_node.max_var_size = msg.max_var_size
+        elif msg.id == Message.ID_NAMED_VARIABLE_DESCRIPTION:
+            remote_node.add_var(msg.var_name, msg.var_size)
+        elif msg.id == Message.ID_LOCAL_EVENT_DESCRIPTION:
+            remote_node.local_events.append(msg.event_name)
+        elif msg.id == Message.ID_NATIVE_FUNCTION_DESCRIPTION:
+            remote_node.native_functions.append(msg.fun_name)
+            remote_node.native_functions_arg_sizes[msg.fun_name] = msg.param_sizes
+    remote_node.reset_var_data()
+    return simulated_node, remote_node
+
+
+def sample_messages() -> Dict[str, Message]:
+    """Get a typical message of each type received from a Thymio.
+    """
+    simulated_node, remote_node = thymio_node()
+    description = simulated_node.description_messages()
+    simulated_node.update(0)
+    size = remote_node.var_total_size
+    return {
+        "description": description[0],
+        "named_variable_description": next(m for m in description
+                                           if m.id == Message.ID_NAMED_VARIABLE_DESCRIPTION),
+        "native_function_description": next(m for m in description
+                                            if m.id == Message.ID_NATIVE_FUNCTION_DESCRIPTION
+                                            and m.fun_name == "leds.circle"),
+        "variables": simulated_node.message(Message.ID_VARIABLES,
+                                            Message.uint16array_to_bytes([0], simulated_node.var_data[:size])),
+        "changed_variables": simulated_node.changed_variables_message(),
+        "execution_state_changed": simulated_node.execution_state_message(),
+        "user_event": Message(0, 2, Message.uint16array_to_bytes(range(8))),
+    }
+
+
+def large_program(handlers: int = 100) -> str:
+    """Get the source code of an assembly program with an init event and
+    handlers which set LEDs and motors.
+    """
+    lines = [
+        "    dc end_toc",
+        "    dc _ev.init, init",
+    ]
+    for i in range(handlers):
+        lines.append(f"    dc _ev.timer0, handler{i}" if i == 0 else f"    dc _ev.prox, handler{i}")
+    lines += [
+        "end_toc:",
+        "init:",
+        "    push.s 0",
+        "    store motor.left.target",
+        "    push.s 0",
+        "    store motor.right.target",
+        "    stop",
+    ]
+    for i in range(handlers):
+        lines += [
+            f"handler{i}:",
+            "    load prox.horizontal+2",
+            "    push.s 1000",
+            f"    jump.if.not gt, skip{i}",
+            "    push.s 0",
+            "    store motor.left.target",
+            f"skip{i}:",
+            "    push.s 32",
+            "    store _userdata",
+            "    push.s _userdata",
+            "    push.s _userdata",
+            "    push.s _userdata",
+            "    callnat _nf.leds.top",
+            "    stop",
+        ]
+    return "\n".join(lines)
+
+
+def benchmarks() -> List[Tuple[str, Callable[[], None], int]]:
+    """Get the micro benchmarks as (name, function, operations per call).
+    """
+    result = []
+    messages = sample_messages()
+
+    for name, msg in messages.items():
+        def decode(msg=msg):
+            Message(msg.id, msg.source_node, msg.payload).decode()
+        result.append((f"decode.{name}", decode, 1))
+
+    variables = messages["variables"]
+    # both through a lambda, for the same call overhead
+    result.append(("serialize.variables", lambda: variables.serialize(), 1))
+    buffer = bytearray(2048)
+    result.append(("serialize_into.variables", lambda: variables.serialize_into(buffer), 1))
+
+    words = list(range(128))
+    result.append(("uint16array_to_bytes.128", lambda: Message.uint16array_to_bytes(words), 1))
+    words_array = array("H", words)
+    result.append(("uint16array_to_bytes.array128", lambda: Message.uint16array_to_bytes(words_array), 1))
+
+    stream = b"".join(msg.serialize() for msg in messages.values()) * 16
+    frame_reader = FrameReader()
+    result.append(("frame_reader.feed", lambda: frame_reader.feed(stream), 16 * len(messages)))
+
+    _, remote_node = thymio_node()
+    data = list(range(remote_node.var_total_size))
+    result.append(("remote_node.set_var_data", lambda: remote_node.set_var_data(0, data), 1))
+    offset, view = variables.get_variables_view()
+    result.append(("remote_node.set_var_bytes", lambda: remote_node.set_var_bytes(offset, view), 1))
+    result.append(("remote_node.get_var_array", lambda: remote_node.get_var_array("prox.horizontal"), 1))
+    result.append(("remote_node.get_var", lambda: remote_node.get_var("temperature"), 1))
+
+    src = large_program()
+    result.append(("assembler.assemble.100_handlers", lambda: Assembler(remote_node, src).assemble(), 1))
+
+    return result
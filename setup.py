@@ -22,6 +22,9 @@ setup(
     install_requires=[
         'pyserial'
     ],
+    extras_require={
+        'numpy': ['numpy'],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: BSD License",
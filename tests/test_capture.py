@@ -0,0 +1,52 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tests of the capture of frames
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+from thymiodirect import capture
+from thymiodirect.connection import Connection
+from thymiodirect.message import Message
+
+
+class TestCapture(unittest.TestCase):
+
+    def test_stop_while_sending(self):
+        connection = Connection.null()
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, "session.cap")
+            connection.start_capture(filename)
+            msg = Message(Message.ID_LIST_NODES, 1, Message.uint16array_to_bytes([Message.PROTOCOL_VERSION]))
+            errors = []
+
+            def send():
+                try:
+                    for _ in range(2000):
+                        connection.send(msg)
+                except Exception as error:
+                    errors.append(error)
+
+            thread = threading.Thread(target=send)
+            thread.start()
+            connection.stop_capture()
+            thread.join()
+            self.assertEqual(errors, [])
+            with capture.CaptureReader(filename) as reader:
+                records = list(reader)
+            self.assertTrue(all(direction == capture.OUTPUT and frame.id == Message.ID_LIST_NODES
+                                for _, direction, frame in records))
+        connection.shutdown()
+        connection.run_tasks()
+
+
+if __name__ == "__main__":
+    unittest.main()
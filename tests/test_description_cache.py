@@ -0,0 +1,69 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tests of the cache of node descriptions
+"""
+
+import json
+import tempfile
+import time
+import unittest
+
+from thymiodirect.connection import Connection
+from thymiodirect.description_cache import DescriptionCache
+from thymiodirect.simulator import Simulator
+
+
+class TestDescriptionCache(unittest.TestCase):
+
+    def connect(self, address, cache_path):
+        """Connect with a refresh which doesn't cover _fwversion and get
+        the description of the node once ready.
+        """
+        connection = Connection.tcp(*address, description_cache=cache_path,
+                                    refreshing_rate=0.05, refreshing_coverage={"prox.horizontal"})
+        try:
+            node_id = connection.wait_ready(1, stage=Connection.READY_VARIABLES, timeout=5)[0]
+            remote_node = connection.remote_nodes[node_id]
+            return (remote_node.description_from_cache, dict(remote_node.var_offset),
+                    DescriptionCache.key(remote_node))
+        finally:
+            connection.shutdown()
+            connection.run_tasks()
+
+    def test_firmware_change_without_fwversion_refresh(self):
+        simulator = Simulator(node_count=1, seed=0)
+        address = simulator.start_in_thread()
+        with tempfile.TemporaryDirectory() as cache_path:
+            cache = DescriptionCache(cache_path)
+            from_cache, var_offset, key = self.connect(address, cache_path)
+            self.assertFalse(from_cache)
+            # firmware version recorded although not refreshed
+            for _ in range(50):
+                entry = cache.load(key)
+                if entry is not None and entry["fwversion"] is not None:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(entry["fwversion"], [14, 0])
+
+            from_cache, cached_var_offset, _ = self.connect(address, cache_path)
+            self.assertTrue(from_cache)
+            self.assertEqual(cached_var_offset, var_offset)
+
+            # stale entry of an older firmware with another layout
+            entry["fwversion"] = [13, 0]
+            entry["variables"].insert(1, ["removed", 3])
+            with open(cache.filename(key), "w") as file:
+                json.dump(entry, file)
+            from_cache, actual_var_offset, _ = self.connect(address, cache_path)
+            self.assertFalse(from_cache)
+            self.assertEqual(actual_var_offset, var_offset)
+            self.assertEqual(cache.load(key)["fwversion"], [14, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
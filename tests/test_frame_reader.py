@@ -0,0 +1,55 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tests of FrameReader
+"""
+
+import unittest
+
+from thymiodirect.message import FrameReader, Message
+
+
+def variables_frame(source_node: int, offset: int, values) -> bytes:
+    return Message(Message.ID_VARIABLES, source_node,
+                   Message.uint16array_to_bytes([offset], values)).serialize()
+
+
+class TestFrameReader(unittest.TestCase):
+
+    def test_frame_from_unknown_node_does_not_drop_previous_frame(self):
+        known = variables_frame(2, 0, range(10))
+        # GET_VARIABLES sent by another client of a switch
+        unknown = Message(Message.ID_GET_VARIABLES, 5, Message.uint16array_to_bytes([2, 0, 10])).serialize()
+        frame_reader = FrameReader()
+        frame_reader.sources = {2}
+        messages = frame_reader.feed(known + unknown)
+        self.assertEqual([(msg.id, msg.source_node, msg.payload) for msg in messages],
+                         [(Message.ID_VARIABLES, 2, known[Message.HEADER_SIZE:])])
+        self.assertEqual(frame_reader.discarded_bytes, 0)
+        self.assertEqual(frame_reader.filtered_count, 1)
+        self.assertEqual(len(frame_reader.buffer), 0)
+
+    def test_independent_of_chunking(self):
+        stream = (variables_frame(2, 0, range(10))
+                  + variables_frame(7, 0, range(3))
+                  + Message(Message.ID_NODE_PRESENT, 9, Message.uint16array_to_bytes([8])).serialize()
+                  + variables_frame(2, 10, range(4)))
+        results = []
+        for chunk_size in (len(stream), 1, 5, 16):
+            frame_reader = FrameReader(partial_timeout=None)
+            frame_reader.sources = {2}
+            messages = []
+            for i in range(0, len(stream), chunk_size):
+                messages += frame_reader.feed(stream[i:i + chunk_size])
+            self.assertEqual(frame_reader.discarded_bytes, 0)
+            results.append([(msg.id, msg.source_node, msg.payload) for msg in messages])
+        self.assertEqual([len(r) for r in results], [3] * 4)
+        self.assertTrue(all(r == results[0] for r in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tests of the refresh of variables
+"""
+
+import asyncio
+import unittest
+
+from thymiodirect.connection import Connection
+from thymiodirect.message import Message
+from thymiodirect.refresh import RefreshPacer
+from thymiodirect.simulator import SimulatedNode, Simulator
+
+
+class TestRefreshPacer(unittest.TestCase):
+
+    def test_cycle_complete_at_end_of_spans(self):
+        pacer = RefreshPacer()
+        pacer.configure((0.01, 0.5))
+        pacer.sent(0, [64, 128])
+        pacer.received(0.01, 32)  # first part of the reply to the first span
+        self.assertEqual(pacer.in_flight, 2)
+        pacer.received(0.02, 64)
+        pacer.received(0.03, 96)
+        self.assertEqual(pacer.in_flight, 1)
+        self.assertIsNone(pacer.rtt)
+        pacer.received(0.04, 128)
+        self.assertEqual(pacer.in_flight, 0)
+        self.assertAlmostEqual(pacer.rtt, 0.04)
+
+
+class TestRefresh(unittest.TestCase):
+
+    def test_simulator_splits_replies(self):
+        node = SimulatedNode(2, max_reply_size=50)
+        msg = Message(Message.ID_GET_VARIABLES, 1, Message.uint16array_to_bytes([2, 10, 120]))
+        replies = node.handle(msg, 0)
+        self.assertEqual([reply.var_offset for reply in replies], [10, 60, 110])
+        self.assertEqual([len(reply.var_data) for reply in replies], [50, 50, 18])
+
+    def test_paced_refresh_with_split_replies(self):
+        simulator = Simulator(node_count=1, latency=0.005, max_reply_size=32, seed=0)
+        address = simulator.start_in_thread()
+        connection = Connection.tcp(*address, refreshing_rate=0.02, refreshing_pacing=(0.02, 0.5))
+        try:
+            node_id = connection.wait_ready(1, stage=Connection.READY_VARIABLES, timeout=5)[0]
+            connection.loop.run_until_complete(asyncio.sleep(1))
+            pacer = connection.remote_nodes[node_id].refresh_pacer
+            self.assertIsNotNone(pacer.rtt)
+            self.assertEqual(pacer.lost_cycles, 0)
+            # the rate has increased from its initial backoff
+            self.assertLess(pacer.period, 0.5)
+        finally:
+            connection.shutdown()
+            connection.run_tasks()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tests of the shared memory mirror of variables
+"""
+
+import os
+import struct
+import subprocess
+import sys
+import unittest
+
+from thymiodirect.connection import RemoteNode
+from thymiodirect.shared_mirror import (OWNER_PID_OFFSET, STATE_CLOSED, STATE_OFFSET, SharedMirror,
+                                       SharedMirrorReader)
+
+
+def remote_node() -> RemoteNode:
+    node = RemoteNode(2, 7)
+    node.name = "thymio-II"
+    node.add_var("a", 3)
+    node.add_var("b", 1)
+    node.reset_var_data()
+    node.set_var_data(0, [1, 2, 3, 4])
+    return node
+
+
+@unittest.skipIf(sys.version_info < (3, 8), "requires Python 3.8")
+class TestSharedMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.name = f"thymio-test-{os.getpid()}"
+
+    def test_live_block_not_replaced(self):
+        mirror = SharedMirror(self.name, remote_node())
+        try:
+            with self.assertRaises(FileExistsError):
+                SharedMirror(self.name, remote_node())
+            with SharedMirrorReader(self.name) as reader:
+                self.assertFalse(reader.closed)
+                self.assertEqual(reader.get_var_array("a"), [1, 2, 3])
+        finally:
+            mirror.close()
+
+    @unittest.skipIf(sys.platform == "win32", "blocks freed with their processes")
+    def test_stale_block_replaced(self):
+        stale = SharedMirror(self.name, remote_node())
+        # left by a process which has exited
+        struct.pack_into("<I", stale.shm.buf, OWNER_PID_OFFSET, self.dead_pid())
+        mirror = SharedMirror(self.name, remote_node())
+        try:
+            self.assertEqual(struct.unpack_from("<H", stale.shm.buf, STATE_OFFSET)[0], STATE_CLOSED)
+            with SharedMirrorReader(self.name) as reader:
+                self.assertFalse(reader.closed)
+        finally:
+            mirror.close()
+            from multiprocessing import resource_tracker
+            stale.generation_view.release()
+            stale.words.release()
+            stale.shm.close()
+            resource_tracker.unregister(stale.shm._name, "shared_memory")
+
+    @staticmethod
+    def dead_pid() -> int:
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        return process.pid
+
+
+if __name__ == "__main__":
+    unittest.main()
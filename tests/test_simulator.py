@@ -0,0 +1,42 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Tests of the simulator
+"""
+
+import asyncio
+import sys
+import threading
+import unittest
+
+from thymiodirect.connection import Connection
+from thymiodirect.simulator import Simulator
+
+
+@unittest.skipIf(sys.platform == "win32", "no pseudo-terminal")
+class TestSimulatorPty(unittest.TestCase):
+
+    def test_many_nodes(self):
+        simulator = Simulator(node_count=20, seed=0)
+        loop = asyncio.new_event_loop()
+        device = loop.run_until_complete(simulator.start_pty())
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        connection = Connection.serial(device)
+        try:
+            nodes = connection.wait_ready(20, timeout=10)
+            self.assertEqual(sorted(nodes), sorted(simulator.nodes))
+            for node_id in nodes:
+                self.assertEqual(len(connection.remote_nodes[node_id].native_functions), 49)
+            self.assertEqual(connection.input_thread.frame_reader.discarded_bytes, 0)
+        finally:
+            connection.shutdown()
+            connection.run_tasks()
+            loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == "__main__":
+    unittest.main()
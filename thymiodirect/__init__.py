@@ -103,3 +103,4 @@ from .connection import Connection
 from .thymio import Thymio
 from .thymio_observer import ThymioObserver
 from .single_serial_thymio_runner import SingleSerialThymioRunner
+from .fleet import FleetManager
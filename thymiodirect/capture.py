@@ -0,0 +1,181 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Capture of Aseba frames to a binary file, and replay
+
+File format (little-endian): header with magic b"ASEBACAP", format version
+(uint16) and capture start time (float64, time.time()), followed by records
+with the time relative to the start (float64, seconds), the direction (uint8,
+INPUT or OUTPUT) and the frame as produced by Message.serialize, whose size
+is given by its own header.
+
+Usage
+-----
+
+connection.start_capture("session.cap")
+...
+connection.stop_capture()
+
+connection = Connection.null()
+connection.loop.run_until_complete(replay(connection, "session.cap"))
+"""
+
+from __future__ import annotations
+
+import asyncio
+import mmap
+import struct
+import threading
+import time
+from typing import Iterator, Optional, Tuple
+
+from .message import Message
+
+INPUT = 0  # frame received from a node
+OUTPUT = 1  # frame sent by the host
+
+MAGIC = b"ASEBACAP"
+FORMAT_VERSION = 1
+
+_file_header = struct.Struct("<8sHd")
+_record_header = struct.Struct("<dB")
+_frame_header = struct.Struct("<HHH")
+
+
+class CaptureWriter:
+    """Writer of frames to a capture file, safe to use from several threads.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.start_time = time.time()
+        self.start_monotonic = time.monotonic()
+        self.lock = threading.Lock()
+        self.count = 0  # number of frames written
+        self.file.write(_file_header.pack(MAGIC, FORMAT_VERSION, self.start_time))
+
+    def write(self, direction: int, msg: Message) -> None:
+        """Append a message.
+        """
+        record = _record_header.pack(time.monotonic() - self.start_monotonic, direction) + msg.serialize()
+        with self.lock:
+            if self.file is not None:
+                self.file.write(record)
+                self.count += 1
+
+    def write_batch(self, direction: int, messages) -> None:
+        """Append a batch of messages received or sent at the same time.
+        """
+        t = time.monotonic() - self.start_monotonic
+        records = b"".join(_record_header.pack(t, direction) + msg.serialize() for msg in messages)
+        with self.lock:
+            if self.file is not None:
+                self.file.write(records)
+                self.count += len(messages)
+
+    def close(self) -> None:
+        """Close the file. Messages written afterwards are ignored.
+        """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class CaptureReader:
+    """Reader of a capture file, memory-mapped.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.start_time = _file_header.unpack_from(self.mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Not a capture file (version {FORMAT_VERSION}): {path}")
+
+    def __enter__(self) -> CaptureReader:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.mmap.close()
+        self.file.close()
+
+    def __iter__(self) -> Iterator[Tuple[float, int, Message]]:
+        """Iterate over the records as (time, direction, message), where time
+        is relative to the start of the capture. A truncated last record is
+        ignored.
+        """
+        data = self.mmap
+        size = len(data)
+        offset = _file_header.size
+        frame_offset = offset + _record_header.size
+        while frame_offset + Message.HEADER_SIZE <= size:
+            t, direction = _record_header.unpack_from(data, offset)
+            payload_size, source_node, id = _frame_header.unpack_from(data, frame_offset)
+            end = frame_offset + Message.HEADER_SIZE + payload_size
+            if end > size:
+                break
+            yield t, direction, Message(id, source_node, data[frame_offset + Message.HEADER_SIZE:end])
+            offset = end
+            frame_offset = offset + _record_header.size
+
+    def messages(self, direction: Optional[int] = INPUT) -> Iterator[Tuple[float, Message]]:
+        """Iterate over the (time, message) records of a direction (default:
+        input), or of both if direction is None.
+        """
+        for t, record_direction, msg in self:
+            if direction is None or record_direction == direction:
+                yield t, msg
+
+
+async def replay(connection, source, speed: Optional[float] = None, batch_size: int = 64) -> int:
+    """Feed the input frames of a capture (CaptureReader or path) to a
+    connection's handle_messages, as fast as possible in batches of
+    batch_size messages if speed is None, or at speed times the recorded
+    speed. Return the number of messages replayed.
+    """
+    reader = CaptureReader(source) if isinstance(source, str) else source
+    try:
+        count = 0
+        if speed is None:
+            batch = []
+            for _, msg in reader.messages(INPUT):
+                batch.append(msg)
+                if len(batch) >= batch_size:
+                    await connection.handle_messages(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                await connection.handle_messages(batch)
+                count += len(batch)
+        else:
+            start = time.monotonic()
+            batch = []
+            batch_time = None
+            for t, msg in reader.messages(INPUT):
+                if batch and t != batch_time:
+                    await connection.handle_messages(batch)
+                    count += len(batch)
+                    batch = []
+                if not batch:
+                    # messages recorded at the same time are handled together
+                    delay = start + t / speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    batch_time = t
+                batch.append(msg)
+            if batch:
+                await connection.handle_messages(batch)
+                count += len(batch)
+        return count
+    finally:
+        if reader is not source:
+            reader.close()
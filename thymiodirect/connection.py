@@ -12,75 +12,241 @@ Author: Yves Piguet, EPFL
 from __future__ import annotations
 
 import asyncio
+import numbers
+import operator
+import os
+import sys
 import threading
 import time
+from array import array
 from asyncio import AbstractEventLoop
-from typing import Awaitable, Callable, List, Optional, Set, Tuple
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
 
 from serial import PortNotOpenError
 
-from .message import Message
+from . import capture
+from .description_cache import DescriptionCache
+from .description_fragments import FragmentedDescription
+from .message import FrameReader, Message
+from .shared_mirror import SharedMirror
+from .refresh import RefreshPacer, RefreshPlan, RefreshScheduler, variable_periods
+
+T = TypeVar("T")
+
+
+def to_int16(val: int) -> int:
+    """Convert an integer to a signed 16-bit integer (two's complement).
+    """
+    return (operator.index(val) + 0x8000 & 0xffff) - 0x8000
+
+
+def is_array_value(val) -> bool:
+    """Check whether a value to assign to a variable is an array (list,
+    tuple, array, NumPy array etc.) rather than a scalar.
+    """
+    return not isinstance(val, numbers.Number) and hasattr(val, "__len__")
 
 
 class InputThread(threading.Thread):
     """Thread which reads messages asynchronously.
     """
 
-    def __init__(self, io, loop=None, handle_msg=None):
+    READ_SIZE = 4096  # max number of bytes read at once if unknown
+
+    def __init__(self, io, loop=None, handle_messages=None):
         threading.Thread.__init__(self)
         self.running = True
         self.io = io
         self.loop = loop
-        self.handle_msg = handle_msg
+        self.handle_messages = handle_messages
         self.comm_error = None
+        self.frame_reader = FrameReader()
 
     def terminate(self, on_terminated=None) -> None:
         self.on_terminated = on_terminated
         self.running = False
 
-    def read_uint16(self) -> int:
-        """Read an unsigned 16-bit number.
+    def read_available(self) -> Optional[bytes]:
+        """Read the bytes available, waiting for at least one.
         """
-        b = self.io.read(2)
-        if len(b) == 0:
-            raise TimeoutError()
-        elif len(b) == 1:
-            b1 = self.io.read(1)
-            if len(b1) == 0:
-                raise TimeoutError()
-            return b[0] + 256 * b1[0]
-        else:
-            return b[0] + 256 * b[1]
-
-    def read_message(self) -> Message:
-        """Read a complete message.
+        in_waiting = getattr(self.io, "in_waiting", None)
+        if in_waiting is None:
+            # socket-like io: read returns what has already been received
+            return self.io.read(self.READ_SIZE)
+        return self.io.read(max(in_waiting, 1))
+
+    def read_messages(self) -> List[Message]:
+        """Read all the complete messages available.
         """
         try:
-            payload_len = self.read_uint16()
-            source_node = self.read_uint16()
-            id = self.read_uint16()
-            payload = self.io.read(payload_len)
-            msg = Message(id, source_node, payload)
-            return msg
+            data = self.read_available()
         except Exception as error:
             self.comm_error = error
             raise error
+        if data is None:
+            # nonblocking io without data
+            time.sleep(0.01)
+            return []
+        if len(data) == 0:
+            # timeout: a pending partial frame has been truncated
+            self.frame_reader.discard_partial()
+            raise TimeoutError()
+        return self.frame_reader.feed(data)
+
+    def create_task(self, messages: List[Message]) -> None:
+        self.loop.create_task(self.handle_messages(messages))
 
     def run(self) -> None:
         """Input thread code.
         """
         while self.running:
             try:
-                msg = self.read_message()
-                msg.decode()
-                if self.loop and self.handle_msg:
-                    self.loop.create_task(self.handle_msg(msg))
+                messages = self.read_messages()  # decoded lazily
+                if messages and self.loop and self.handle_messages:
+                    # one task per batch, created in the loop thread
+                    self.loop.call_soon_threadsafe(self.create_task, messages)
             except TimeoutError:
                 pass
         if self.on_terminated:
             self.on_terminated()
 
 
+class LoopInput:
+    """Input which reads messages in the asyncio event loop without any
+    thread: data is pushed by an asyncio protocol for TCP connections or
+    read by a file descriptor reader for serial ports.
+    """
+
+    READ_SIZE = 4096  # max number of bytes read at once
+
+    def __init__(self, io, loop, handle_messages=None):
+        self.io = io
+        self.loop = loop
+        self.handle_messages = handle_messages
+        self.comm_error = None
+        self.frame_reader = FrameReader()
+        self.fd = None
+        self.partial_timer = None  # asyncio.TimerHandle while an incomplete frame is buffered
+
+    def start(self) -> None:
+        """Start receiving data.
+        """
+        if isinstance(self.io, TCPProtocolIO):
+            self.io.on_data = self.data_received
+            self.io.on_connection_lost = self.connection_lost
+            self.loop.create_task(self.io.open(self.loop))
+        else:
+            self.fd = self.io.fileno()
+            self.loop.add_reader(self.fd, self.read_ready)
+
+    def terminate(self, on_terminated=None) -> None:
+        if self.partial_timer is not None:
+            self.partial_timer.cancel()
+            self.partial_timer = None
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+        if on_terminated:
+            on_terminated()
+
+    def read_ready(self) -> None:
+        """Read the data available on the file descriptor.
+        """
+        try:
+            data = self.io.read(self.READ_SIZE)
+        except Exception as error:
+            self.connection_lost(error)
+            return
+        self.data_received(data)
+
+    def connection_lost(self, error: Optional[Exception]) -> None:
+        self.comm_error = error
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            self.fd = None
+
+    def data_received(self, data: bytes) -> None:
+        """Handle all the complete messages received.
+        """
+        messages = self.frame_reader.feed(data)  # decoded lazily
+        if self.partial_timer is not None:
+            self.partial_timer.cancel()
+            self.partial_timer = None
+        if self.frame_reader.buffer:
+            # drop the incomplete frame if the input stays idle (truncated frame)
+            self.partial_timer = self.loop.call_later(self.frame_reader.partial_timeout,
+                                                      self.frame_reader.discard_partial)
+        if messages and self.handle_messages:
+            self.loop.create_task(self.handle_messages(messages))
+
+
+class TCPProtocolIO(asyncio.Protocol):
+    """TCP client as an asyncio protocol with the io methods used by
+    Connection. Data written before the connection is made, or from another
+    thread than the event loop's, is forwarded to the transport in the loop.
+    """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.loop = None
+        self.transport = None
+        self.pending = bytearray()  # written before the connection is made
+        self.closed = False
+        self.on_data = None
+        self.on_connection_lost = None
+
+    async def open(self, loop: AbstractEventLoop) -> None:
+        """Hand the connected socket over to the event loop.
+        """
+        self.loop = loop
+        await loop.create_connection(lambda: self, sock=self.socket)
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        if self.pending:
+            transport.write(bytes(self.pending))
+            self.pending.clear()
+
+    def data_received(self, data: bytes) -> None:
+        if self.on_data:
+            self.on_data(data)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self.closed = True
+        if self.on_connection_lost:
+            self.on_connection_lost(exc)
+
+    def write(self, b: bytes) -> None:
+        if self.closed:
+            raise ConnectionError("TCP connection closed")
+        if self.loop is not None and not self.in_loop_thread():
+            self.loop.call_soon_threadsafe(self.write_in_loop, bytes(b))
+        else:
+            self.write_in_loop(b)
+
+    def write_in_loop(self, b: bytes) -> None:
+        if self.transport is None:
+            self.pending += b
+        elif not self.transport.is_closing():
+            self.transport.write(b)
+
+    def in_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def close(self) -> None:
+        self.closed = True
+        if self.transport is not None:
+            if self.in_loop_thread() or not self.loop.is_running():
+                self.transport.close()
+            else:
+                self.loop.call_soon_threadsafe(self.transport.close)
+        else:
+            self.socket.close()
+
+
 class RemoteNode:
     """Remote node description and state.
     """
@@ -95,6 +261,13 @@ class RemoteNode:
         self.rf_channel = None
         self.last_msg_time = 0  # time.time()
         self.handshake_done = False
+        self.ready = 0  # Connection.READY_PRESENT, READY_DESCRIBED or READY_VARIABLES once reached
+        self.description_requested = False  # True once GET_NODE_DESCRIPTION sent or description from cache
+        self.description_from_cache = False
+        self.description_cache_key = None  # key while _fwversion has to be checked or recorded
+        self.fwversion_check = None  # future of _fwversion while a cached description is checked
+        self.fragmented_description = None  # FragmentedDescription if received by fragments
+        self.shared_mirror = None  # SharedMirror of var_data once described, if enabled
         self.name = None
         self.bytecode_size = None
         self.stack_size = None
@@ -106,9 +279,18 @@ class RemoteNode:
         self.named_variables = []  # names
         self.var_offset = {}  # indexed by name
         self.var_size = {}  # indexed by name
-        self.var_data = []
+        self.var_data = array("h")
         self.expected_var_end = 0  # beyond last var requested by ID_GET_VARIABLES
         self.var_received = False  # True if last set_var_data reached expected_var_end
+        self.baseline_request_time = None  # time.monotonic() when all the variables were last requested
+        self.baseline_end = 0  # end of the variable data received contiguously since then
+        self.baseline_time = None  # time.monotonic() when all the variables were last received
+        self.var_time = None  # time.time() when variable data was last received
+        self.generation = 0  # incremented before and after each change of var_data (odd while changing)
+        self.refresh_scheduler = None  # RefreshScheduler based on the node's refreshing settings
+        self.refresh_pacer = RefreshPacer()  # requests in flight, round-trip time and pacing
+        self.refreshing = False  # True once its variables are refreshed (start_refreshing)
+        self.refresh_due = None  # time.monotonic() of the next refresh, or None if not scheduled
         self.local_events = []  # names
         self.native_functions = []  # names
         self.native_functions_arg_sizes = {}  # indexed by name
@@ -127,40 +309,157 @@ class RemoteNode:
         self.var_size[name] = size
         self.var_total_size += size
 
+    def begin_write(self) -> None:
+        """Mark the start of a change of var_data (generation becomes odd).
+        Writers must be serialized (e.g. with Connection.input_lock).
+        """
+        self.generation += 1
+
+    def end_write(self) -> None:
+        """Mark the end of a change of var_data (generation becomes even).
+        """
+        self.generation += 1
+
+    def read(self, fun: Callable[[], T]) -> Tuple[T, int]:
+        """Call fun until it has run without any concurrent change of
+        var_data (sequence lock), without blocking the writer. Return its
+        result and the generation of the data it has read.
+        """
+        retries = 0
+        while True:
+            generation = self.generation
+            if generation & 1 == 0:
+                result = fun()
+                if self.generation == generation:
+                    return result, generation
+            retries += 1
+            if retries % 4 == 0:
+                # let the writer finish
+                time.sleep(0)
+
+    def changed_since(self, generation: int) -> bool:
+        """Check whether var_data has changed since the generation returned
+        by read.
+        """
+        return self.generation != generation
+
     def reset_var_data(self) -> None:
         """Reset the variable data to 0.
         """
-        self.var_data = [0 for i in range(self.var_total_size)]
+        self.begin_write()
+        try:
+            self.var_data = array("h", bytes(2 * self.var_total_size))
+        finally:
+            self.end_write()
 
     def get_var(self, name: str, index: int = 0) -> int:
         """Get the value of a scalar variable or an item in an array variable.
         """
-        return self.var_data[self.var_offset[name] + index]
+        offset = self.var_offset[name] + index
+        return self.read(lambda: self.var_data[offset])[0]
 
     def get_var_array(self, name: str) -> List[int]:
-        """Get the value of an array variable.
+        """Get a copy of the value of an array variable.
         """
         if name not in self.var_offset:
             raise KeyError(name)
         offset = self.var_offset[name]
-        return self.var_data[offset:offset + self.var_size[name]]
+        end = offset + self.var_size[name]
+        return self.read(lambda: self.var_data[offset:end].tolist())[0]
+
+    def get_var_view(self, name: str) -> memoryview:
+        """Get a view of the value of an array variable, without copy. It
+        reflects subsequent changes, hence is not protected against
+        concurrent refreshes.
+        """
+        if name not in self.var_offset:
+            raise KeyError(name)
+        offset = self.var_offset[name]
+        return memoryview(self.var_data)[offset:offset + self.var_size[name]]
 
     def set_var(self, name: str, val: int, index: Optional[int] = 0) -> None:
         """Set the value of a scalar variable or an item in an array variable.
         """
-        self.var_data[self.var_offset[name] + index] = val
+        offset = self.var_offset[name] + index
+        val = to_int16(val)
+        self.begin_write()
+        try:
+            self.var_data[offset] = val
+        finally:
+            self.end_write()
 
     def set_var_array(self, name: str, val: List[int]) -> None:
         """Set the value of an array variable.
         """
         offset = self.var_offset[name]
-        self.var_data[offset:offset + len(val)] = val
+        self.set_var_data(offset, val, update_received=False)
 
-    def set_var_data(self, offset: int, data: List[int]) -> None:
+    def set_var_data(self, offset: int, data: List[int], update_received: bool = True) -> None:
         """Set values in the variable data array.
         """
-        self.var_data[offset:offset + len(data)] = data
-        self.var_received = offset + len(data) >= self.expected_var_end
+        if not isinstance(data, array) or data.typecode != "h":
+            data = array("h", [to_int16(val) for val in data])
+        self.begin_write()
+        try:
+            self.store_var_data(offset, data)
+        finally:
+            self.end_write()
+        if update_received:
+            self.var_received = offset + len(data) >= self.expected_var_end
+
+    def store_var_data(self, offset: int, data: array) -> None:
+        # never resize var_data, whose memory may be exported by views
+        end = min(offset + len(data), len(self.var_data))
+        if offset < end:
+            self.var_data[offset:end] = data[:end - offset]
+
+    def set_var_bytes(self, offset: int, data: memoryview) -> None:
+        """Set values in the variable data array from raw data, little-endian
+        16-bit words as received in ID_VARIABLES messages.
+        """
+        count = len(data) // 2
+        end = min(offset + count, len(self.var_data))
+        if offset < end:
+            self.begin_write()
+            try:
+                if sys.byteorder == "little":
+                    memoryview(self.var_data).cast("B")[2 * offset:2 * end] = data[:2 * (end - offset)]
+                else:
+                    words = array("h")
+                    words.frombytes(data[:2 * (end - offset)])
+                    words.byteswap()
+                    self.var_data[offset:end] = words
+            finally:
+                self.end_write()
+        self.var_received = offset + count >= self.expected_var_end
+        self.var_time = time.time()
+
+    def update_baseline(self, offset: int, count: int) -> None:
+        """Record that variable data has been received, for the baseline of
+        changed variables.
+        """
+        if offset <= self.baseline_end < offset + count:
+            self.baseline_end = offset + count
+            if self.baseline_end >= self.var_total_size:
+                self.baseline_time = time.monotonic()
+
+    def set_changed_var_data(self, areas: List[Tuple[int, List[int]]]) -> None:
+        """Set the values of the variables which have changed, as a list of
+        (offset, data) areas, all visible at once to readers.
+        """
+        areas = [
+            (offset, data if isinstance(data, array) and data.typecode == "h"
+             else array("h", [to_int16(val) for val in data]))
+            for offset, data in areas
+        ]
+        self.begin_write()
+        try:
+            for offset, data in areas:
+                self.store_var_data(offset, data)
+        finally:
+            self.end_write()
+        self.var_received = True
+        self.var_time = time.time()
 
     def data_span_for_variables(self, variables: Set[str]) -> Tuple[int, int]:
         """Find the offset and length of the span covering the set of variables.
@@ -181,6 +480,20 @@ class RemoteNode:
                 length = max(length, self.var_offset[name] + self.var_size[name] - offset)
         return offset, length
 
+    def refresh_plan_for_variables(self, variables: Optional[Set[str]] = None) -> RefreshPlan:
+        """Plan the spans covering the set of variables (default: all),
+        merging spans only when fetching the gap is cheaper than another
+        GET_VARIABLES request.
+        """
+        if variables is None:
+            return RefreshPlan.for_intervals([(0, self.var_total_size)])
+        intervals = []
+        for name in variables:
+            if name not in self.var_offset:
+                raise KeyError(name)
+            intervals.append((self.var_offset[name], self.var_size[name]))
+        return RefreshPlan.for_intervals(intervals)
+
 
 class Connection:
     """Connection to one or multiple devices.
@@ -189,12 +502,24 @@ class Connection:
     class ThymioConnectionError(OSError):
         pass
 
+    # readiness stages of a node, in order
+    READY_PRESENT = 1  # node present
+    READY_DESCRIBED = 2  # description complete, on_connection_changed called
+    READY_VARIABLES = 3  # first full variable data received after description
+
     def __init__(self,
                  io,
                  host_node_id=1,
                  refreshing_rate=None, refreshing_coverage=None, discover_rate=None,
+                 refreshing_changed_only=False,
+                 refreshing_rates=None,
+                 refreshing_pacing=None,
                  debug=False,
-                 loop: AbstractEventLoop = None):
+                 loop: AbstractEventLoop = None,
+                 asyncio_input=False,
+                 description_cache=None,
+                 description_window=None,
+                 shared_mirror=None):
         self.has_own_loop = loop is None
         if self.has_own_loop:
             self.loop = asyncio.new_event_loop()
@@ -206,26 +531,83 @@ class Connection:
         self.comm_error = None
         self.host_node_id = host_node_id
         self.auto_handshake = False
+        if description_cache is True:
+            description_cache = DescriptionCache()
+        elif isinstance(description_cache, str):
+            description_cache = DescriptionCache(description_cache)
+        self.description_cache = description_cache  # DescriptionCache or None
+        self.description_cache_timeout = 0.5  # max wait for device uuid before GET_NODE_DESCRIPTION
+        self.description_window = description_window  # fragments requested at once (protocol version 8), or None
+        self.description_fragment_timeout = 0.5  # max wait for the fragments of a round
+        if shared_mirror is True:
+            # unique among the processes, as node ids are unique only per connection
+            shared_mirror = f"thymio-{os.getpid()}"
+        self.shared_mirror_prefix = shared_mirror  # prefix of the names of shared memory blocks, or None
         self.remote_node_set = set()  # set of id of nodes with handshake done
         self.remote_nodes = {}  # key: node_id
+        self.ready_condition = threading.Condition()  # notified when a node reaches a new readiness stage
+        self.ready_waiters = []  # (n, stage, future) of ready() calls
+
+        # async handler of input messages, key: message id
+        self.message_handlers = {
+            Message.ID_NODE_PRESENT: self.handle_node_present,
+            Message.ID_DEVICE_INFO: self.handle_device_info,
+            Message.ID_DESCRIPTION: self.handle_description,
+            Message.ID_NAMED_VARIABLE_DESCRIPTION: self.handle_named_variable_description,
+            Message.ID_LOCAL_EVENT_DESCRIPTION: self.handle_local_event_description,
+            Message.ID_NATIVE_FUNCTION_DESCRIPTION: self.handle_native_function_description,
+            Message.ID_VARIABLES: self.handle_variables,
+            Message.ID_CHANGED_VARIABLES: self.handle_changed_variables,
+            Message.ID_EXECUTION_STATE_CHANGED: self.handle_execution_state_changed,
+        }
+        # synchronous part of message handlers, called with input_lock held once
+        # for runs of messages in a batch, key: handler in message_handlers;
+        # fun(msg) returns the awaitable notification to run afterwards, or None
+        self.message_stores = {
+            self.handle_variables: self.store_variables,
+            self.handle_changed_variables: self.store_changed_variables,
+        }
 
         self.input_lock = threading.Lock()
-        self.input_thread = InputThread(self.io,
+        if asyncio_input:
+            # messages are read and handled in the event loop
+            self.input_thread = None
+            self.loop_input = LoopInput(self.io,
                                         loop=self.loop,
-                                        handle_msg=self.handle_message)
-        self.input_thread.start()
+                                        handle_messages=self.handle_messages)
+            # frames from unknown nodes are dropped
+            self.loop_input.frame_reader.sources = self.remote_nodes
+            self.loop_input.start()
+        else:
+            self.loop_input = None
+            self.input_thread = InputThread(self.io,
+                                            loop=self.loop,
+                                            handle_messages=self.handle_messages)
+            self.input_thread.frame_reader.sources = self.remote_nodes
+            self.input_thread.start()
 
         self.output_lock = threading.Lock()
         self.shutting_down = False
         self.tasks = set()
         self.refreshing_timeout = None
         self.refreshing_data_coverage = None  # or set of variables to fetch
-        self.refreshing_data_span = None  # or (offset, length) (based on refreshing_data_coverage)
+        self.refreshing_rates = None  # or dict of periods indexed by variable name or pattern
+        self.node_refreshing_overrides = {}  # settings specific to nodes, key: node_id
         self.refreshing_triggers = []  # threading.Event
+        self.refreshing_changed_only = refreshing_changed_only  # with GET_CHANGED_VARIABLES if supported
+        self.refreshing_resync_period = 5  # period of full refresh with refreshing_changed_only in seconds
+        self.refreshing_pacing = refreshing_pacing  # or (min period, max period) for adaptive pacing
+        # function called when refreshing has to be (re)scheduled, if the
+        # refresh of all the nodes and liveness checks are driven by a
+        # supervisor calling refresh_step and check_liveness (e.g. FleetManager)
+        # rather than by a task per node
+        self.refresh_supervisor: Optional[Callable[[], None]] = None
         if refreshing_rate is not None:
             self.set_refreshing_rate(refreshing_rate)
         if refreshing_coverage is not None:
             self.set_refreshing_coverage(refreshing_coverage)
+        if refreshing_rates is not None:
+            self.set_refreshing_rates(refreshing_rates)
 
         # callback for (dis)connection
         # async fun(node_id, connect)
@@ -247,6 +629,16 @@ class Connection:
         # fun(error)
         self.on_comm_error = None
 
+        # functions called with input_lock held when variable data has been received
+        # fun(remote_node, offset, count)
+        self.variable_listeners = []
+
+        # CaptureWriter of all the frames sent and received, or None
+        self.capture = None
+
+        if self.shared_mirror_prefix is not None:
+            self.add_variable_listener(self.update_shared_mirror)
+
         # discover coroutine
         if discover_rate is not None:
             async def discover():
@@ -273,11 +665,18 @@ class Connection:
             return
 
         self.shutting_down = True
+        self.stop_capture()
+        with self.input_lock:
+            for remote_node in self.remote_nodes.values():
+                self.close_shared_mirror(remote_node)
 
         def on_terminated():
             self.close()
 
-        self.input_thread.terminate(on_terminated)
+        if self.input_thread is not None:
+            self.input_thread.terminate(on_terminated)
+        else:
+            self.loop_input.terminate(on_terminated)
 
     def run_tasks(self) -> None:
         """Run asyncio loop until all the tasks have finished.
@@ -346,30 +745,48 @@ class Connection:
             return devices[0]
 
     @staticmethod
-    def serial(port: Optional[str] = None, **kwargs) -> Connection:
-        """Create Thymio object with a serial connection.
+    def serial(port: Optional[str] = None, asyncio_input=False, **kwargs) -> Connection:
+        """Create Thymio object with a serial connection. With asyncio_input,
+        the serial port is read by the event loop (not supported on Windows).
         """
         import serial  # pip3 install pyserial
+        import sys
         if port is None:
             port = Connection.serial_default_port()
-        th = Connection(serial.Serial(port, timeout=1), **kwargs)
+        if asyncio_input:
+            if sys.platform == "win32":
+                raise Connection.ThymioConnectionError("asyncio input not supported for serial ports on Windows")
+            th = Connection(serial.Serial(port, timeout=0), asyncio_input=True, **kwargs)
+        else:
+            th = Connection(serial.Serial(port, timeout=1), **kwargs)
         return th
 
     @staticmethod
-    def tcp(host: Optional[str] = "127.0.0.1", port: Optional[int] = 33333, **kwargs) -> Connection:
-        """Create Thymio object with a TCP connection.
+    def tcp(host: Optional[str] = "127.0.0.1", port: Optional[int] = 33333, asyncio_input=False,
+            **kwargs) -> Connection:
+        """Create Thymio object with a TCP connection. With asyncio_input,
+        the socket is handled by an asyncio protocol in the event loop.
         """
         import socket
         import io
 
+        if asyncio_input:
+            s = TCPProtocolIO(socket.create_connection((host, port)))
+            return Connection(s, asyncio_input=True, **kwargs)
+
         class TCPClientIO(io.RawIOBase):
 
             def __init__(self, host, port):
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.socket.connect((host, port))
+                # like serial ports, time out to let the input thread terminate
+                self.socket.settimeout(1)
 
             def read(self, n):
-                return self.socket.recv(n)
+                try:
+                    return self.socket.recv(n)
+                except socket.timeout:
+                    return b""
 
             def write(self, b):
                 self.socket.sendall(b)
@@ -392,7 +809,22 @@ class Connection:
             def write(self, b):
                 pass
 
-        return Connection(NullIO(), host_node_id)
+        return Connection(NullIO(), host_node_id, **kwargs)
+
+    def start_capture(self, path: str) -> None:
+        """Start appending all the frames sent and received to a new capture
+        file (see capture.py).
+        """
+        self.stop_capture()
+        self.capture = capture.CaptureWriter(path)
+
+    def stop_capture(self) -> None:
+        """Stop capturing frames and close the capture file.
+        """
+        capture_writer = self.capture
+        self.capture = None
+        if capture_writer is not None:
+            capture_writer.close()
 
     def handshake(self) -> None:
         self.auto_handshake = True
@@ -401,14 +833,64 @@ class Connection:
     def wait_for_handshake(self, n: Optional[int] = 1, timeout: Optional[int] = 5) -> None:
         """Wait until n remote nodes have finished handshake
         """
-        if len(self.remote_node_set) < n and not self.auto_handshake:
+        self.wait_ready(n, Connection.READY_DESCRIBED, timeout)
+
+    def ready_nodes(self, stage: int = READY_DESCRIBED) -> List[int]:
+        """Get the id of the nodes which have reached a readiness stage.
+        """
+        return [
+            node_id
+            for node_id, remote_node in list(self.remote_nodes.items())
+            if remote_node.ready >= stage
+        ]
+
+    def set_ready(self, remote_node: RemoteNode, stage: int) -> None:
+        """Record that a node has reached a readiness stage and wake up the
+        waiters which are satisfied.
+        """
+        if remote_node.ready >= stage:
+            return
+        remote_node.ready = stage
+        with self.ready_condition:
+            self.ready_condition.notify_all()
+        for waiter in list(self.ready_waiters):
+            n, waiter_stage, future = waiter
+            if not future.done():
+                nodes = self.ready_nodes(waiter_stage)
+                if len(nodes) >= n:
+                    future.set_result(nodes)
+            if future.done():
+                self.ready_waiters.remove(waiter)
+
+    async def ready(self, n: int = 1, stage: int = READY_DESCRIBED) -> List[int]:
+        """Wait until n remote nodes have reached a readiness stage and get
+        their id.
+        """
+        nodes = self.ready_nodes(stage)
+        if len(nodes) >= n:
+            return nodes
+        if not self.auto_handshake:
             self.handshake()
-        count = timeout // 0.1
-        while len(self.remote_node_set) < n:
-            time.sleep(0.1)
-            count -= 1
-            if count < 0:
+        future = self.loop.create_future()
+        self.ready_waiters.append((n, stage, future))
+        return await future
+
+    def wait_ready(self, n: int = 1, stage: int = READY_DESCRIBED, timeout: Optional[float] = 5) -> List[int]:
+        """Wait until n remote nodes have reached a readiness stage and get
+        their id, running the event loop if it isn't running yet or blocking
+        until it reaches it in its own thread.
+        """
+        if not self.loop.is_running():
+            try:
+                return self.loop.run_until_complete(asyncio.wait_for(self.ready(n, stage), timeout))
+            except asyncio.TimeoutError:
                 raise TimeoutError()
+        if len(self.ready_nodes(stage)) < n and not self.auto_handshake:
+            self.handshake()
+        with self.ready_condition:
+            if not self.ready_condition.wait_for(lambda: len(self.ready_nodes(stage)) >= n, timeout):
+                raise TimeoutError()
+        return self.ready_nodes(stage)
 
     def one_remote_node_id(self) -> int:
         """Get the node id of one of the connected nodes.
@@ -419,6 +901,7 @@ class Connection:
         """Change the auto-refresh rate to update variables.
         """
         self.refreshing_timeout = rate
+        self.invalidate_refreshing()
         if rate is not None:
             # refresh now
             for event in self.refreshing_triggers:
@@ -429,132 +912,619 @@ class Connection:
         (default: all).
         """
         self.refreshing_data_coverage = variables
-        self.refreshing_data_span = None
+        self.invalidate_refreshing()
 
-    async def handle_message(self, msg: Message) -> None:
-        """Handle an input message.
+    def set_refreshing_rates(self, rates: Optional[Dict[str, float]] = None) -> None:
+        """Set the auto-refresh period of specific variables, in seconds,
+        indexed by variable name or pattern with wildcards such as
+        "motor.*.speed". Other variables of the coverage are refreshed with
+        the rate set by set_refreshing_rate.
         """
-        if self.debug:
-            print("<", msg)
-        source_node = msg.source_node
-        if msg.id == Message.ID_NODE_PRESENT:
-            will_do_handshake = False
-            with self.input_lock:
-                if source_node not in self.remote_nodes:
-                    self.remote_nodes[source_node] = RemoteNode(source_node,
-                                                                msg.version)
-                    will_do_handshake = self.auto_handshake
-            if will_do_handshake:
-                if msg.version >= 6:
-                    self.get_device_info(source_node)
-                self.get_node_description(source_node)
-        elif msg.id == Message.ID_DEVICE_INFO:
-            change = False
-            with self.input_lock:
-                remote_node = self.remote_nodes[source_node]
-                if msg.device_info == Message.DEVICE_INFO_NAME:
-                    if remote_node.device_name != msg.device_name:
-                        remote_node.device_name = msg.device_name
-                        change = True
-                elif msg.device_info == Message.DEVICE_INFO_UUID:
-                    if remote_node.device_uuid != msg.device_uuid:
-                        remote_node.device_uuid = msg.device_uuid
-                        change = True
-                elif msg.device_info == Message.DEVICE_INFO_THYMIO2_RF_SETTINGS:
-                    if (remote_node.rf_network_id != msg.network_id
-                            or remote_node.rf_node_id != msg.node_id
-                            or remote_node.rf_channel != msg.channel):
-                        remote_node.rf_network_id = msg.network_id
-                        remote_node.rf_node_id = msg.node_id
-                        remote_node.rf_channel = msg.channel
-                        change = True
-        elif msg.id == Message.ID_DESCRIPTION:
-            with self.input_lock:
-                self.remote_nodes[source_node].name = msg.node_name
-                self.remote_nodes[source_node].bytecode_size = msg.bytecode_size
-                self.remote_nodes[source_node].stack_size = msg.stack_size
-                self.remote_nodes[source_node].max_var_size = msg.max_var_size
-                self.remote_nodes[source_node].num_named_var = msg.num_named_var
-                self.remote_nodes[source_node].num_local_events = msg.num_local_events
-                self.remote_nodes[source_node].num_native_fun = msg.num_native_fun
-        elif msg.id == Message.ID_NAMED_VARIABLE_DESCRIPTION:
+        self.refreshing_rates = rates
+        self.invalidate_refreshing()
+
+    def refreshing_settings(self, node_id: Optional[int] = None) -> dict:
+        """Get the auto-refresh settings of a node (default: connection-wide
+        settings), as a dict with keys "rate", "coverage", "rates",
+        "changed_only" and "pacing".
+        """
+        settings = {
+            "rate": self.refreshing_timeout,
+            "coverage": self.refreshing_data_coverage,
+            "rates": self.refreshing_rates,
+            "changed_only": self.refreshing_changed_only,
+            "pacing": self.refreshing_pacing,
+        }
+        if node_id is not None:
+            settings.update(self.node_refreshing_overrides.get(node_id, {}))
+        return settings
+
+    def set_node_refreshing(self, node_id: int, **settings) -> None:
+        """Override auto-refresh settings for a node, whether it is connected
+        or not, with keyword arguments rate, coverage, rates, changed_only or
+        pacing (see set_refreshing_rate, set_refreshing_coverage,
+        set_refreshing_rates, set_refreshing_changed_only and
+        set_refreshing_pacing).
+        """
+        for key in settings:
+            if key not in ("rate", "coverage", "rates", "changed_only", "pacing"):
+                raise KeyError(key)
+        self.node_refreshing_overrides.setdefault(node_id, {}).update(settings)
+        self.invalidate_refreshing(node_id)
+
+    def reset_node_refreshing(self, node_id: int) -> None:
+        """Remove the auto-refresh settings specific to a node.
+        """
+        self.node_refreshing_overrides.pop(node_id, None)
+        self.invalidate_refreshing(node_id)
+
+    def invalidate_refreshing(self, node_id: Optional[int] = None) -> None:
+        """Discard the refresh scheduler of a node (default: all nodes) after
+        its settings have changed.
+        """
+        for remote_node in list(self.remote_nodes.values()):
+            if node_id is None or remote_node.node_id == node_id:
+                remote_node.refresh_scheduler = None
+        if self.refresh_supervisor is not None:
+            self.refresh_supervisor()
+
+    def refreshing_scheduler(self, remote_node: RemoteNode) -> RefreshScheduler:
+        """Get the refresh scheduler of a node, created from its current
+        settings if needed.
+        """
+        scheduler = remote_node.refresh_scheduler
+        if scheduler is None:
+            settings = self.refreshing_settings(remote_node.node_id)
+            periods = variable_periods(remote_node.named_variables,
+                                       settings["rates"],
+                                       settings["coverage"],
+                                       settings["rate"])
+            scheduler = RefreshScheduler(remote_node, periods, time.monotonic())
+            remote_node.refresh_scheduler = scheduler
+            remote_node.refresh_pacer.configure(settings["pacing"])
+        return scheduler
+
+    def set_refreshing_pacing(self, pacing: Optional[Tuple[float, float]] = None) -> None:
+        """Enable adaptive pacing of auto-refresh with (min period, max period)
+        in seconds, or disable it with None. With pacing, a refresh cycle is
+        not sent while the previous one is in flight; the period doubles upon
+        congestion and decreases again while replies arrive in time.
+        """
+        self.refreshing_pacing = pacing
+        self.invalidate_refreshing()
+
+    def set_refreshing_changed_only(self, changed_only: bool) -> None:
+        """Set whether auto-refresh should fetch only the variables which have
+        changed, for nodes which support it (protocol version 7 or higher).
+        Other nodes are refreshed with the variables of the coverage.
+        """
+        self.refreshing_changed_only = changed_only
+        self.invalidate_refreshing()
+
+    async def refresh_node(self, remote_node: RemoteNode) -> None:
+        """Refresh the variables of a node until it is disconnected, checking
+        the other nodes for disconnection after each refresh, unless a
+        supervisor does it.
+        """
+        source_node = remote_node.node_id
+        while not self.shutting_down:
+            try:
+                if self.remote_nodes.get(source_node) is not remote_node or self.refresh_supervisor is not None:
+                    # node disconnected or replaced, or refreshed by the supervisor
+                    break
+                next_time = self.refresh_step(remote_node, time.monotonic())
+                await asyncio.sleep(max(next_time - time.monotonic(), 0))
+                if self.shutting_down:
+                    break
+                await self.check_liveness()
+            except asyncio.CancelledError:
+                break
+            except PortNotOpenError as error:
+                if not self.shutting_down:
+                    raise error  # do not care about closed serial port during disconnect
+
+    def refresh_step(self, remote_node: RemoteNode, now: float) -> float:
+        """Send the refresh requests of a node which are due at time now
+        (time.monotonic()) and get the time of the next step.
+        """
+        source_node = remote_node.node_id
+        settings = self.refreshing_settings(source_node)
+        changed_only = settings["changed_only"] and remote_node.version >= 7
+        pacer = remote_node.refresh_pacer
+        if changed_only:
+            pacer.configure(settings["pacing"])
+        else:
+            scheduler = self.refreshing_scheduler(remote_node)
+        if remote_node.refresh_due is not None and now >= remote_node.refresh_due:
+            lost_cycles = pacer.lost_cycles
+            if pacer.may_send(now):
+                if changed_only:
+                    if self.baseline_due(remote_node, now, pacer.lost_cycles != lost_cycles):
+                        remote_node.baseline_request_time = now
+                        remote_node.baseline_end = 0
+                        self.get_variables(source_node)
+                        # replies identified by the end of the span of variables
+                        pacer.sent(now, [remote_node.var_total_size])
+                    else:
+                        self.get_changed_variables(source_node)
+                        pacer.sent(now, [None])
+                else:
+                    plan = scheduler.pop_due(now)
+                    for span_offset, span_length in plan:
+                        self.get_variables(source_node, span_offset, span_length)
+                    pacer.sent(now, [span_offset + span_length for span_offset, span_length in plan])
+        delay = settings["rate"] if changed_only else scheduler.time_to_next(now)
+        if delay is None:
+            # not refreshed: check the settings again later
+            remote_node.refresh_due = None
+            return now + 0.1
+        remote_node.refresh_due = now + max(delay, pacer.delay(now))
+        return remote_node.refresh_due
+
+    def baseline_due(self, remote_node: RemoteNode, now: float, lost: bool) -> bool:
+        """Check whether all the variables should be requested as the
+        baseline of changed variables: first request, previous request
+        unanswered after the loss timeout, changes lost, or periodic resync.
+        """
+        if remote_node.baseline_request_time is None:
+            return True
+        if remote_node.baseline_time is None or remote_node.baseline_time < remote_node.baseline_request_time:
+            # baseline in flight
+            return now - remote_node.baseline_request_time >= remote_node.refresh_pacer.loss_timeout
+        return lost or now - remote_node.baseline_time >= self.refreshing_resync_period
+
+    async def check_liveness(self) -> None:
+        """Assume disconnection of the nodes which have been silent for more
+        than the timeout.
+        """
+        current_time = time.time()
+        terminating_nodes = set()
+        with self.input_lock:
+            for node_id in self.remote_node_set:
+                terminated_node = self.remote_nodes[node_id]
+                if current_time - terminated_node.last_msg_time > self.timeout:
+                    terminating_nodes.add(node_id)
+        for node_id in terminating_nodes:
+            self.remote_node_set.remove(node_id)
             with self.input_lock:
-                remote_node = self.remote_nodes[source_node]
-                remote_node.add_var(msg.var_name, msg.var_size)
-                if len(remote_node.named_variables) >= remote_node.num_named_var:
-                    # all variables are known, can start refreshing
-                    remote_node.reset_var_data()
-
-                    async def do_refresh():
-                        while not self.shutting_down:
-                            try:
-                                if self.refreshing_timeout is None:
-                                    await asyncio.sleep(0.1)
-                                else:
-                                    await asyncio.sleep(self.refreshing_timeout)
-                                    if self.refreshing_data_coverage is None:
-                                        self.get_variables(source_node)
-                                    else:
-                                        if self.refreshing_data_span is None:
-                                            # update now that remote_node's variables are known
-                                            self.refreshing_data_span = remote_node.data_span_for_variables(
-                                                self.refreshing_data_coverage)
-                                        if self.refreshing_data_span[1] > 0:
-                                            self.get_variables(source_node, self.refreshing_data_span[0],
-                                                               self.refreshing_data_span[1])
-                                if self.shutting_down:
-                                    break
-                                # assume disconnection upon timeout
-                                current_time = time.time()
-                                terminating_nodes = set()
-                                for node_id in self.remote_node_set:
-                                    with self.input_lock:
-                                        terminated_node = self.remote_nodes[node_id]
-                                        if current_time - terminated_node.last_msg_time > self.timeout:
-                                            terminating_nodes.add(node_id)
-                                for node_id in terminating_nodes:
-                                    self.remote_node_set.remove(node_id)
-                                    if self.on_connection_changed:
-                                        await self.on_connection_changed(node_id, False)
-                                    del self.remote_nodes[node_id]
-                            except asyncio.CancelledError:
-                                break
-                            except PortNotOpenError as error:
-                                if not self.shutting_down:
-                                    raise error  # do not care about closed serial port during disconnect
-
-                    self.tasks.add(self.loop.create_task(do_refresh()))
-        elif msg.id == Message.ID_VARIABLES:
+                self.close_shared_mirror(self.remote_nodes[node_id])
+            if self.on_connection_changed:
+                await self.on_connection_changed(node_id, False)
+            del self.remote_nodes[node_id]
+
+    async def handle_messages(self, messages: List[Message]) -> None:
+        """Handle a batch of input messages in a single task.
+        """
+        capture_writer = self.capture  # read once, stop_capture may be called from another thread
+        if capture_writer is not None:
+            capture_writer.write_batch(capture.INPUT, messages)
+        i = 0
+        while i < len(messages):
+            if self.message_stores.get(self.message_handlers.get(messages[i].id)) is None:
+                try:
+                    await self.handle_message(messages[i], update_time=False)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    self.report_message_error(messages[i], error)
+                i += 1
+                continue
+            # run of messages whose data is stored with a single acquisition of
+            # input_lock, notified once it has been released
+            notifications = []
             with self.input_lock:
-                remote_node = self.remote_nodes[source_node]
-                remote_node.set_var_data(msg.var_offset, msg.var_data)
-            if self.on_variables_received and remote_node.var_received:
-                await self.on_variables_received(source_node)
-        elif msg.id == Message.ID_NATIVE_FUNCTION_DESCRIPTION:
+                while i < len(messages):
+                    msg = messages[i]
+                    store = self.message_stores.get(self.message_handlers.get(msg.id))
+                    if store is None:
+                        break
+                    if self.debug:
+                        print("<", msg)
+                    try:
+                        notification = store(msg)
+                        if notification is not None:
+                            notifications.append((msg, notification))
+                    except Exception as error:
+                        self.report_message_error(msg, error)
+                    i += 1
+            for msg, notification in notifications:
+                try:
+                    await notification
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    self.report_message_error(msg, error)
+        # liveness, once per batch
+        current_time = time.time()
+        with self.input_lock:
+            for source_node in {msg.source_node for msg in messages}:
+                remote_node = self.remote_nodes.get(source_node)
+                if remote_node is not None:
+                    remote_node.last_msg_time = current_time
+
+    def report_message_error(self, msg: Message, error: Exception) -> None:
+        # e.g. message from a node which has not been announced yet
+        self.loop.call_exception_handler({
+            "message": f"Error while handling {Message.id_to_str(msg.id)}",
+            "exception": error,
+        })
+
+    async def handle_message(self, msg: Message, update_time: bool = True) -> None:
+        """Handle an input message with the handler registered for its id in
+        message_handlers.
+        """
+        if self.debug:
+            print("<", msg)
+        handler = self.message_handlers.get(msg.id)
+        if handler is None and msg.id < Message.ID_FIRST_ASEBA_ID:
+            handler = self.handle_user_event
+        if handler is not None:
+            await handler(msg)
+        if update_time:
             with self.input_lock:
-                remote_node = self.remote_nodes[source_node]
-                remote_node.native_functions.append(msg.fun_name)
-                remote_node.native_functions_arg_sizes[msg.fun_name] = msg.param_sizes
-            if len(remote_node.native_functions) >= remote_node.num_native_fun:
-                # all messages sent as reply to GET_NODE_DESCRIPTION received
-                self.remote_nodes[source_node].handshake_done = True
-                if source_node not in self.remote_node_set:
-                    self.remote_node_set.add(source_node)
-                    if self.on_connection_changed:
-                        await self.on_connection_changed(source_node, True)
-        elif msg.id == Message.ID_LOCAL_EVENT_DESCRIPTION:
+                self.remote_nodes[msg.source_node].last_msg_time = time.time()
+
+    async def handle_node_present(self, msg: Message) -> None:
+        source_node = msg.source_node
+        will_do_handshake = False
+        with self.input_lock:
+            if source_node not in self.remote_nodes:
+                self.remote_nodes[source_node] = RemoteNode(source_node,
+                                                            msg.version)
+                will_do_handshake = self.auto_handshake
+        self.set_ready(self.remote_nodes[source_node], Connection.READY_PRESENT)
+        if will_do_handshake:
+            remote_node = self.remote_nodes[source_node]
+            if msg.version >= 6:
+                self.get_device_info(source_node)
+                if self.description_cache is not None:
+                    # wait for the device uuid to look for the description in the cache
+                    self.tasks.add(self.loop.create_task(self.description_cache_fallback(remote_node)))
+                    return
+            self.request_description(remote_node)
+
+    def request_description(self, remote_node: RemoteNode) -> None:
+        """Send GET_NODE_DESCRIPTION to a node, or request its description
+        fragments if description_window is set and the node supports them.
+        """
+        remote_node.description_requested = True
+        if self.description_window and remote_node.version >= 8:
+            remote_node.fragmented_description = FragmentedDescription(self.description_window)
+            self.tasks.add(self.loop.create_task(self.request_description_fragments(remote_node)))
+        else:
+            self.get_node_description(remote_node.node_id)
+
+    async def request_description_fragments(self, remote_node: RemoteNode) -> None:
+        """Request the description fragments of a node in rounds until all
+        have been received, then complete the handshake.
+        """
+        fragmented_description = remote_node.fragmented_description
+        while not fragmented_description.complete:
+            if self.shutting_down or self.remote_nodes.get(remote_node.node_id) is not remote_node:
+                return
+            for fragment in fragmented_description.start_round():
+                self.get_node_description_fragment(remote_node.node_id, fragment)
+            try:
+                await asyncio.wait_for(fragmented_description.round_done.wait(),
+                                       fragmented_description.timeout(self.description_fragment_timeout))
+            except asyncio.TimeoutError:
+                pass
+            fragmented_description.end_round()
+        with self.input_lock:
+            # kept to ignore late replies
+            fragmented_description.apply(remote_node)
+            self.start_refreshing(remote_node)
+        await self.description_done(remote_node)
+
+    def handle_description_fragment(self, msg: Message) -> bool:
+        """Pass a description message to the FragmentedDescription of its
+        node, if any, and return True (late replies once it is complete are
+        ignored).
+        """
+        remote_node = self.remote_nodes[msg.source_node]
+        if remote_node.fragmented_description is None:
+            return False
+        if not remote_node.fragmented_description.complete:
+            remote_node.fragmented_description.received(msg)
+        return True
+
+    async def description_cache_fallback(self, remote_node: RemoteNode) -> None:
+        """Request the description of a node whose uuid hasn't been received
+        in time, unless its name is in the cache.
+        """
+        await asyncio.sleep(self.description_cache_timeout)
+        if (remote_node.description_requested or self.shutting_down
+                or self.remote_nodes.get(remote_node.node_id) is not remote_node):
+            return
+        if not await self.describe_from_cache(remote_node):
+            self.request_description(remote_node)
+
+    async def describe_from_cache(self, remote_node: RemoteNode) -> bool:
+        """Set the description of a node from the cache, if found, and
+        complete the handshake once its firmware version has been checked.
+        """
+        key = DescriptionCache.key(remote_node)
+        entry = self.description_cache.load(key) if key is not None else None
+        if entry is None:
+            return False
+        checked = "_fwversion" in (name for name, _ in entry["variables"])
+        if checked and entry["fwversion"] is None:
+            # firmware version not recorded yet: cannot be trusted
+            return False
+        with self.input_lock:
+            DescriptionCache.apply(entry, remote_node)
+            remote_node.description_requested = True
+            remote_node.description_from_cache = True
+            if not checked:
+                self.start_refreshing(remote_node)
+        if checked:
+            remote_node.description_cache_key = key
+            self.tasks.add(self.loop.create_task(self.check_cached_description(remote_node, entry["fwversion"])))
+        else:
+            await self.description_done(remote_node)
+        return True
+
+    def get_fwversion(self, remote_node: RemoteNode) -> None:
+        """Request the variable _fwversion of a node.
+        """
+        self.get_variables(remote_node.node_id,
+                           remote_node.var_offset["_fwversion"],
+                           remote_node.var_size["_fwversion"])
+
+    async def check_cached_description(self, remote_node: RemoteNode, fwversion: List[int]) -> None:
+        """Request the firmware version of a node whose description comes
+        from the cache, then complete the handshake if it is the cached one,
+        or describe the node again.
+        """
+        remote_node.reset_var_data()
+        for _ in range(3):
+            if self.shutting_down or self.remote_nodes.get(remote_node.node_id) is not remote_node:
+                return
+            remote_node.fwversion_check = self.loop.create_future()
+            self.get_fwversion(remote_node)
+            try:
+                actual_fwversion = await asyncio.wait_for(remote_node.fwversion_check,
+                                                          self.description_cache_timeout)
+                break
+            except asyncio.TimeoutError:
+                pass
+        else:
+            actual_fwversion = None
+        key = remote_node.description_cache_key
+        remote_node.fwversion_check = None
+        remote_node.description_cache_key = None
+        if actual_fwversion != fwversion:
+            if actual_fwversion is not None:
+                # firmware changed
+                self.description_cache.remove(key)
+            # get the actual description
+            await self.reset_description(remote_node)
+            return
+        with self.input_lock:
+            self.start_refreshing(remote_node)
+        await self.description_done(remote_node)
+
+    def received_fwversion(self, remote_node: RemoteNode, offset: int, count: int) -> None:
+        """Pass the firmware version of a node to its pending check, or
+        record it with a new description in the cache, when it is received.
+        """
+        fw_offset = remote_node.var_offset["_fwversion"]
+        if offset > fw_offset or fw_offset + remote_node.var_size["_fwversion"] > offset + count:
+            return
+        fwversion = remote_node.get_var_array("_fwversion")
+        if remote_node.description_from_cache:
+            if remote_node.fwversion_check is not None and not remote_node.fwversion_check.done():
+                remote_node.fwversion_check.set_result(fwversion)
+            return
+        self.description_cache.store(remote_node.description_cache_key, remote_node, fwversion)
+        remote_node.description_cache_key = None
+
+    async def reset_description(self, remote_node: RemoteNode) -> None:
+        """Forget the description of a node and request it again.
+        """
+        source_node = remote_node.node_id
+        new_node = RemoteNode(source_node, remote_node.version)
+        new_node.device_name = remote_node.device_name
+        new_node.device_uuid = remote_node.device_uuid
+        new_node.rf_network_id = remote_node.rf_network_id
+        new_node.rf_node_id = remote_node.rf_node_id
+        new_node.rf_channel = remote_node.rf_channel
+        new_node.last_msg_time = remote_node.last_msg_time
+        new_node.ready = Connection.READY_PRESENT
+        with self.input_lock:
+            self.close_shared_mirror(remote_node)
+            self.remote_nodes[source_node] = new_node
+        if source_node in self.remote_node_set:
+            self.remote_node_set.remove(source_node)
+            if self.on_connection_changed:
+                await self.on_connection_changed(source_node, False)
+        self.request_description(new_node)
+
+    def start_refreshing(self, remote_node: RemoteNode) -> None:
+        """Allocate the variable data of a node whose variables are all
+        known and start refreshing them.
+        """
+        remote_node.reset_var_data()
+        remote_node.refreshing = True
+        if self.refresh_supervisor is not None:
+            self.refresh_supervisor()
+        else:
+            self.tasks.add(self.loop.create_task(self.refresh_node(remote_node)))
+
+    async def description_done(self, remote_node: RemoteNode) -> None:
+        """Complete the handshake of a node whose description is known.
+        """
+        source_node = remote_node.node_id
+        remote_node.handshake_done = True
+        if self.description_cache is not None and not remote_node.description_from_cache:
+            key = DescriptionCache.key(remote_node)
+            if key is not None:
+                self.description_cache.store(key, remote_node)
+                if "_fwversion" in remote_node.var_offset:
+                    # recorded when received, whatever the refreshed variables
+                    remote_node.description_cache_key = key
+                    self.get_fwversion(remote_node)
+        if self.shared_mirror_prefix is not None and remote_node.shared_mirror is None:
             with self.input_lock:
-                remote_node = self.remote_nodes[source_node]
-                remote_node.local_events.append(msg.event_name)
-        elif msg.id == Message.ID_EXECUTION_STATE_CHANGED:
-            if self.on_execution_state_changed:
-                await self.on_execution_state_changed(source_node, msg.pc, msg.flags)
-        elif msg.id < Message.ID_FIRST_ASEBA_ID:
-            # user event sent by emit
-            if self.on_user_event:
-                await self.on_user_event(source_node, msg.id, msg.user_event_arg)
+                remote_node.shared_mirror = SharedMirror(self.shared_mirror_name(source_node), remote_node)
+        if source_node not in self.remote_node_set:
+            self.remote_node_set.add(source_node)
+            if self.on_connection_changed:
+                await self.on_connection_changed(source_node, True)
+        self.set_ready(remote_node, Connection.READY_DESCRIBED)
+
+    async def handle_device_info(self, msg: Message) -> None:
+        with self.input_lock:
+            remote_node = self.remote_nodes[msg.source_node]
+            if msg.device_info == Message.DEVICE_INFO_NAME:
+                remote_node.device_name = msg.device_name
+            elif msg.device_info == Message.DEVICE_INFO_UUID:
+                remote_node.device_uuid = msg.device_uuid
+            elif msg.device_info == Message.DEVICE_INFO_THYMIO2_RF_SETTINGS:
+                remote_node.rf_network_id = msg.network_id
+                remote_node.rf_node_id = msg.node_id
+                remote_node.rf_channel = msg.channel
+        if (self.description_cache is not None and msg.device_info == Message.DEVICE_INFO_UUID
+                and not remote_node.description_requested):
+            if not await self.describe_from_cache(remote_node):
+                self.request_description(remote_node)
+
+    async def handle_description(self, msg: Message) -> None:
+        if self.handle_description_fragment(msg):
+            return
+        with self.input_lock:
+            remote_node = self.remote_nodes[msg.source_node]
+            remote_node.name = msg.node_name
+            remote_node.bytecode_size = msg.bytecode_size
+            remote_node.stack_size = msg.stack_size
+            remote_node.max_var_size = msg.max_var_size
+            remote_node.num_named_var = msg.num_named_var
+            remote_node.num_local_events = msg.num_local_events
+            remote_node.num_native_fun = msg.num_native_fun
+
+    async def handle_named_variable_description(self, msg: Message) -> None:
+        if self.handle_description_fragment(msg):
+            return
+        with self.input_lock:
+            remote_node = self.remote_nodes[msg.source_node]
+            remote_node.add_var(msg.var_name, msg.var_size)
+            if len(remote_node.named_variables) >= remote_node.num_named_var:
+                # all variables are known, can start refreshing
+                self.start_refreshing(remote_node)
+
+    async def handle_variables(self, msg: Message) -> None:
+        with self.input_lock:
+            notification = self.store_variables(msg)
+        if notification is not None:
+            await notification
+
+    def store_variables(self, msg: Message) -> Optional[Awaitable[None]]:
+        """Store the variable data of a VARIABLES message (input_lock held)
+        and get its notification.
+        """
+        var_offset, data = msg.get_variables_view()
+        remote_node = self.remote_nodes[msg.source_node]
+        remote_node.set_var_bytes(var_offset, data)
+        remote_node.update_baseline(var_offset, len(data) // 2)
+        # a reply can be split into several messages
+        remote_node.refresh_pacer.received(time.monotonic(), var_offset + len(data) // 2)
+        if remote_node.description_cache_key is not None:
+            self.received_fwversion(remote_node, var_offset, len(data) // 2)
+        if remote_node.fwversion_check is not None:
+            # cached description not confirmed yet
+            return None
+        for listener in self.variable_listeners:
+            listener(remote_node, var_offset, len(data) // 2)
+        if not remote_node.var_received:
+            return None
+        return self.variables_received(remote_node, True)
+
+    async def handle_changed_variables(self, msg: Message) -> None:
+        with self.input_lock:
+            notification = self.store_changed_variables(msg)
+        await notification
+
+    def store_changed_variables(self, msg: Message) -> Awaitable[None]:
+        """Store the variable data of a CHANGED_VARIABLES message (input_lock
+        held) and get its notification.
+        """
+        remote_node = self.remote_nodes[msg.source_node]
+        remote_node.set_changed_var_data(msg.var_areas)
+        remote_node.refresh_pacer.received(time.monotonic(), None)
+        for listener in self.variable_listeners:
+            for var_offset, var_data in msg.var_areas:
+                listener(remote_node, var_offset, len(var_data))
+        return self.variables_received(remote_node, remote_node.baseline_time is not None)
+
+    async def variables_received(self, remote_node: RemoteNode, complete: bool) -> None:
+        """Notify that variable data has been received, complete if all the
+        variables are known.
+        """
+        if complete and remote_node.ready == Connection.READY_DESCRIBED:
+            self.set_ready(remote_node, Connection.READY_VARIABLES)
+        if self.on_variables_received:
+            await self.on_variables_received(remote_node.node_id)
+
+    async def handle_native_function_description(self, msg: Message) -> None:
+        if self.handle_description_fragment(msg):
+            return
+        source_node = msg.source_node
+        with self.input_lock:
+            remote_node = self.remote_nodes[source_node]
+            remote_node.native_functions.append(msg.fun_name)
+            remote_node.native_functions_arg_sizes[msg.fun_name] = msg.param_sizes
+        if len(remote_node.native_functions) >= remote_node.num_native_fun:
+            # all messages sent as reply to GET_NODE_DESCRIPTION received
+            await self.description_done(remote_node)
+
+    async def handle_local_event_description(self, msg: Message) -> None:
+        if self.handle_description_fragment(msg):
+            return
         with self.input_lock:
-            self.remote_nodes[source_node].last_msg_time = time.time()
+            remote_node = self.remote_nodes[msg.source_node]
+            remote_node.local_events.append(msg.event_name)
+
+    async def handle_execution_state_changed(self, msg: Message) -> None:
+        if self.on_execution_state_changed:
+            await self.on_execution_state_changed(msg.source_node, msg.pc, msg.flags)
+
+    async def handle_user_event(self, msg: Message) -> None:
+        # user event sent by emit
+        if self.on_user_event:
+            await self.on_user_event(msg.source_node, msg.id, msg.user_event_arg)
+
+    def add_variable_listener(self, listener: Callable[[RemoteNode, int, int], None]) -> None:
+        """Add a function called with arguments (remote_node, offset, count)
+        each time variable data has been received and stored in
+        remote_node.var_data, with input_lock held (it should be fast and
+        should not call methods of the connection).
+        """
+        self.variable_listeners.append(listener)
+
+    def remove_variable_listener(self, listener: Callable[[RemoteNode, int, int], None]) -> None:
+        """Remove a function added with add_variable_listener.
+        """
+        self.variable_listeners.remove(listener)
+
+    def shared_mirror_name(self, target_node_id: int) -> str:
+        """Get the name of the shared memory block which mirrors the
+        variables of a node (see shared_mirror.py).
+        """
+        return f"{self.shared_mirror_prefix}-{target_node_id}"
+
+    def update_shared_mirror(self, remote_node: RemoteNode, offset: int, count: int) -> None:
+        """Variable listener which copies the data received to the shared
+        memory block of the node.
+        """
+        if remote_node.shared_mirror is not None:
+            remote_node.shared_mirror.update(remote_node, offset, count)
+
+    def close_shared_mirror(self, remote_node: RemoteNode) -> None:
+        """Close and unlink the shared memory block of a node, if any.
+        """
+        if remote_node.shared_mirror is not None:
+            remote_node.shared_mirror.close()
+            remote_node.shared_mirror = None
 
     def uuid_to_node_id(self, uuid: str) -> int:
         """Get node id from device uuid.
@@ -569,6 +1539,9 @@ class Connection:
         with self.output_lock:
             if self.debug:
                 print(">", msg)
+            capture_writer = self.capture  # read once, stop_capture may be called from another thread
+            if capture_writer is not None:
+                capture_writer.write(capture.OUTPUT, msg)
             try:
                 self.io.write(msg.serialize())
             except Exception as error:
@@ -627,13 +1600,19 @@ class Connection:
             self.remote_nodes[target_node_id].expected_var_end = chunk_offset + chunk_length
             self.send(msg)
 
+    def get_changed_variables(self, target_node_id):
+        """Send a GET_CHANGED_VARIABLES message (protocol version 7).
+        """
+        payload = Message.uint16array_to_bytes([
+            target_node_id
+        ])
+        msg = Message(Message.ID_GET_CHANGED_VARIABLES, self.host_node_id, payload)
+        self.send(msg)
+
     def set_variables(self, target_node_id, chunk_offset, chunk):
         """Send a SET_VARIABLES message.
         """
-        payload = Message.uint16array_to_bytes([
-                                                   target_node_id,
-                                                   chunk_offset
-                                               ] + chunk)
+        payload = Message.uint16array_to_bytes([target_node_id, chunk_offset], chunk)
         msg = Message(Message.ID_SET_VARIABLES, self.host_node_id, payload)
         self.send(msg)
 
@@ -655,19 +1634,57 @@ class Connection:
         """Get the value of a scalar variable from the local copy.
         """
         node = self.remote_nodes[target_node_id]
-        with self.input_lock:
-            return node.get_var(name, index)
+        return node.get_var(name, index)
 
     def get_var_array(self, target_node_id, name):
         """Get the value of an array variable from the local copy.
         """
         node = self.remote_nodes[target_node_id]
         try:
-            with self.input_lock:
-                return node.get_var_array(name)
+            return node.get_var_array(name)
         except KeyError:
             raise KeyError(name)
 
+    def get_vars(self, target_node_id, names):
+        """Get the values of several variables from the same state of the
+        local copy, as a dict of lists, and the generation of that state
+        (see changed_since).
+        """
+        node = self.remote_nodes[target_node_id]
+        for name in names:
+            if name not in node.var_offset:
+                raise KeyError(name)
+
+        def read():
+            return {
+                name: node.var_data[node.var_offset[name]:node.var_offset[name] + node.var_size[name]].tolist()
+                for name in names
+            }
+
+        return node.read(read)
+
+    def changed_since(self, target_node_id, generation):
+        """Check whether the local copy of the variables has changed since
+        the generation returned by get_vars.
+        """
+        return self.remote_nodes[target_node_id].changed_since(generation)
+
+    def get_var_view(self, target_node_id, name):
+        """Get a view of an array variable in the local copy, without copy.
+        The view reflects subsequent refreshes.
+        """
+        node = self.remote_nodes[target_node_id]
+        return node.get_var_view(name)
+
+    def snapshot(self, target_node_id, variables=None):
+        """Get a VariableSnapshot with a NumPy copy of all the variables of
+        a node, or of the specified ones, and the time they were received
+        (requires numpy).
+        """
+        from .snapshot import take_snapshot
+        node = self.remote_nodes[target_node_id]
+        return node.read(lambda: take_snapshot(node, variables))[0]
+
     def set_var(self, target_node_id, name, val, index=0):
         """Set the value of a scalar variable in the local copy and send it.
         """
@@ -700,7 +1717,7 @@ class Connection:
 
             def __setitem__(self_node, name, val):
                 try:
-                    if isinstance(val, list):
+                    if is_array_value(val):
                         self_node.connection.set_var_array(self_node.node_id, name, val)
                     else:
                         self_node.connection.set_var(self_node.node_id, name, val)
@@ -716,10 +1733,8 @@ class Connection:
         i = 0
         while i < size:
             size_chunk = min(size - i, 256)
-            payload = Message.uint16array_to_bytes([
-                                                       target_node_id,
-                                                       address + i
-                                                   ] + bytecode[i:i + size_chunk])
+            payload = Message.uint16array_to_bytes([target_node_id, address + i],
+                                                   bytecode[i:i + size_chunk])
             msg = Message(Message.ID_SET_BYTECODE, self.host_node_id, payload)
             self.send(msg)
             i += size_chunk
@@ -0,0 +1,118 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+On-disk cache of node descriptions, to skip the description part of the
+handshake when a known device reconnects
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import List, Optional
+
+
+class DescriptionCache:
+    """Directory of JSON files, one per node description, keyed by device
+    uuid (or name if the device has no uuid) and protocol version. The
+    firmware version (variable _fwversion) is recorded with the description
+    when it is first received, to detect firmware updates.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Construct a new DescriptionCache object.
+
+        Args:
+            path: directory of the cache (default: thymiodirect in the user cache directory).
+        """
+        if path is None:
+            path = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                                "thymiodirect")
+        self.path = path
+
+    @staticmethod
+    def key(remote_node) -> Optional[str]:
+        """Get the key of the description of a node, or None if it cannot
+        be identified.
+        """
+        if remote_node.device_uuid is not None:
+            device = "uuid:" + remote_node.device_uuid
+        elif remote_node.device_name is not None:
+            device = "name:" + remote_node.device_name
+        else:
+            return None
+        return f"{device}/v{remote_node.version}"
+
+    def filename(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def load(self, key: str) -> Optional[dict]:
+        """Get a cached description, or None.
+        """
+        try:
+            with open(self.filename(key)) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("key") == key else None
+
+    def store(self, key: str, remote_node, fwversion: Optional[List[int]] = None) -> None:
+        """Store the description of a node, replacing it atomically.
+        """
+        entry = {
+            "key": key,
+            "name": remote_node.name,
+            "protocol_version": remote_node.version,
+            "fwversion": fwversion,
+            "bytecode_size": remote_node.bytecode_size,
+            "stack_size": remote_node.stack_size,
+            "max_var_size": remote_node.max_var_size,
+            "variables": [[name, remote_node.var_size[name]] for name in remote_node.named_variables],
+            "local_events": remote_node.local_events,
+            "native_functions": [
+                [name, remote_node.native_functions_arg_sizes[name]]
+                for name in remote_node.native_functions
+            ],
+        }
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "w") as file:
+                json.dump(entry, file)
+            os.replace(temp_path, self.filename(key))
+        except OSError:
+            # the cache is an optimization
+            pass
+
+    def remove(self, key: str) -> None:
+        """Forget a description.
+        """
+        try:
+            os.remove(self.filename(key))
+        except OSError:
+            pass
+
+    @staticmethod
+    def apply(entry: dict, remote_node) -> None:
+        """Set the description of a node from a cache entry.
+        """
+        remote_node.name = entry["name"]
+        remote_node.bytecode_size = entry["bytecode_size"]
+        remote_node.stack_size = entry["stack_size"]
+        remote_node.max_var_size = entry["max_var_size"]
+        remote_node.num_named_var = len(entry["variables"])
+        remote_node.num_local_events = len(entry["local_events"])
+        remote_node.num_native_fun = len(entry["native_functions"])
+        for name, size in entry["variables"]:
+            remote_node.add_var(name, size)
+        remote_node.local_events = list(entry["local_events"])
+        for name, sizes in entry["native_functions"]:
+            remote_node.native_functions.append(name)
+            remote_node.native_functions_arg_sizes[name] = sizes
@@ -0,0 +1,266 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Node description requested fragment by fragment (protocol version 8)
+
+Fragment 0 is the DESCRIPTION message, followed by one fragment per named
+variable, local event and native function, in this order. Replies don't
+contain the fragment index, but fragments have distinct contents (names are
+unique): a fragment already received is recognized by its content. Since
+frames are delivered in order, the replies received in a round of requests
+are a subsequence of the requests. A reply is attributed to a request only
+if it is the same in all the ways to match the replies with the requests
+(the leftmost and rightmost matches agree), where a reply with a known
+content matches only the request of that fragment and another reply only
+the requests of missing fragments of its type; the other fragments are
+requested again in the next round. Requests of missing fragments are
+interleaved by type, with known fragments inserted as anchors between
+requests of the same type, or between all the requests after losses, to
+keep most replies unambiguous. Each round ends with known fragments: once
+the reply to one of them has been received, the replies to the missing
+fragments have been received or lost, and the next round starts without
+waiting for a timeout, which adapts to the longest duration of the rounds
+when the last replies are lost. After a round which has timed out, the next
+one starts with fragment 0 as a barrier: replies received before its
+DESCRIPTION are stale.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from .message import Message
+
+
+class FragmentedDescription:
+    """Progress of the description of a node with pipelined
+    GET_NODE_DESCRIPTION_FRAGMENT requests.
+    """
+
+    END_ANCHORS = 2  # known fragments requested at the end of each round
+
+    def __init__(self, window: int = 16):
+        self.window = window
+        self.description = None  # DESCRIPTION message (fragment 0)
+        self.fragments: Dict[int, Message] = {}  # received messages, key: fragment index
+        self.known: Dict[Tuple[int, bytes], int] = {}  # fragment index, key: content (see content)
+        self.pending: List[int] = [0]  # fragments to request, sorted
+        self.round: List[int] = []  # fragments requested in the current round, in order
+        self.replies: List[Message] = []  # replies received in the current round, in order
+        self.barrier = False  # True if the current round starts with fragment 0 as a barrier
+        self.resync = False  # True to start next round with fragment 0
+        self.round_done = asyncio.Event()
+        self.round_ended = False  # True once all the replies of the current round have been received or lost
+        self.end_labels = set()  # labels of the known fragments after the last missing one in the current round
+        self.lossy = False  # True if replies were lost in the last round
+        self.round_start = None  # time.monotonic() at the start of the current round
+        self.round_time = None  # longest duration of the rounds which have ended before the timeout
+        self.rounds = 0
+        self.retries = 0  # number of fragments requested again
+
+    @property
+    def count(self) -> int:
+        """Total number of fragments, or 1 if the description hasn't been
+        received yet.
+        """
+        if self.description is None:
+            return 1
+        return 1 + self.description.num_named_var + self.description.num_local_events + self.description.num_native_fun
+
+    @property
+    def complete(self) -> bool:
+        return self.description is not None and len(self.fragments) == self.count
+
+    @staticmethod
+    def content(msg: Message) -> Tuple[int, bytes]:
+        return msg.id, bytes(msg.payload)
+
+    def fragment_type(self, index: int) -> int:
+        """Get the id of the message sent in reply to a fragment request.
+        """
+        if index == 0 or self.description is None:
+            return Message.ID_DESCRIPTION
+        index -= 1
+        if index < self.description.num_named_var:
+            return Message.ID_NAMED_VARIABLE_DESCRIPTION
+        index -= self.description.num_named_var
+        if index < self.description.num_local_events:
+            return Message.ID_LOCAL_EVENT_DESCRIPTION
+        return Message.ID_NATIVE_FUNCTION_DESCRIPTION
+
+    def request_label(self, index: int) -> Hashable:
+        """Get what a reply to a fragment request must match: its content if
+        known, else its type.
+        """
+        msg = self.fragments.get(index)
+        return ("known", self.content(msg)) if msg is not None else ("missing", self.fragment_type(index))
+
+    def reply_label(self, msg: Message) -> Hashable:
+        content = self.content(msg)
+        return ("known", content) if content in self.known else ("missing", msg.id)
+
+    def timeout(self, max_timeout: float) -> float:
+        """Get the time to wait for the end of a round, from the duration of
+        the previous rounds (at most max_timeout).
+        """
+        if self.round_time is None:
+            return max_timeout
+        return min(max_timeout, max(3 * self.round_time, 0.05))
+
+    def start_round(self) -> List[int]:
+        """Get the fragments to request in a new round, at most window.
+        """
+        queues: Dict[int, List[int]] = {}  # pending fragments by type
+        for index in self.pending:
+            queues.setdefault(self.fragment_type(index), []).append(index)
+        anchors = [index for index in self.fragments if index != 0]  # known fragments with distinct contents
+        anchors.reverse()
+
+        def anchor() -> int:
+            return anchors.pop() if anchors else 0
+
+        def separator_needed(index: int) -> bool:
+            if not self.round or self.description is None or self.round[-1] in self.fragments:
+                return False
+            # after losses, anchor each request if possible
+            return self.lossy and bool(anchors) or self.request_label(self.round[-1]) == self.request_label(index)
+
+        self.barrier = self.resync and self.description is not None
+        self.round = [0] if self.barrier else []
+        # keep slots for the last anchors
+        size = self.window - self.END_ANCHORS if self.description is not None else self.window
+        while len(self.round) < size and any(queues.values()):
+            for queue in queues.values():
+                if queue and len(self.round) < size:
+                    if separator_needed(queue[0]):
+                        self.round.append(anchor())
+                        if len(self.round) >= size:
+                            break
+                    self.round.append(queue.pop(0))
+        if self.description is not None:
+            # last requests, whose replies can be recognized
+            for _ in range(self.END_ANCHORS):
+                if anchors or 0 not in self.round:
+                    self.round.append(anchor())
+        self.end_labels = set()
+        for index in reversed(self.round):
+            if index not in self.fragments:
+                break
+            if self.round.count(index) == 1:
+                self.end_labels.add(self.request_label(index))
+        requested = set(self.round)
+        self.pending = [index for index in self.pending if index not in requested]
+        self.replies = []
+        self.resync = False
+        self.round_done.clear()
+        self.round_ended = False
+        self.round_start = time.monotonic()
+        self.rounds += 1
+        return self.round
+
+    def received(self, msg: Message) -> None:
+        """Add a reply to the current round.
+        """
+        if self.barrier and msg.id != Message.ID_DESCRIPTION and not self.replies:
+            # stale reply received before the barrier
+            return
+        self.replies.append(msg)
+        if len(self.replies) >= len(self.round) or self.reply_label(msg) in self.end_labels:
+            # all the replies have been received, or one after the last missing fragment
+            self.round_ended = True
+            round_time = time.monotonic() - self.round_start
+            self.round_time = round_time if self.round_time is None else max(round_time, self.round_time)
+            self.round_done.set()
+
+    @staticmethod
+    def match(request_labels: List[Hashable], reply_labels: List[Hashable],
+              reverse: bool = False) -> Optional[List[int]]:
+        """Match each reply with the earliest (or latest if reverse) possible
+        request, or return None if replies can't be matched in order.
+        """
+        positions = []
+        if not reverse:
+            j = 0
+            for reply_label in reply_labels:
+                while j < len(request_labels) and request_labels[j] != reply_label:
+                    j += 1
+                if j >= len(request_labels):
+                    return None
+                positions.append(j)
+                j += 1
+        else:
+            j = len(request_labels) - 1
+            for reply_label in reversed(reply_labels):
+                while j >= 0 and request_labels[j] != reply_label:
+                    j -= 1
+                if j < 0:
+                    return None
+                positions.append(j)
+                j -= 1
+            positions.reverse()
+        return positions
+
+    def end_round(self) -> None:
+        """Keep the replies of the round which can be attributed to their
+        request without ambiguity and queue the other fragments again.
+        """
+        request_labels = [self.request_label(index) for index in self.round]
+        reply_labels = [self.reply_label(msg) for msg in self.replies]
+        earliest = self.match(request_labels, reply_labels)
+        latest = self.match(request_labels, reply_labels, reverse=True)
+        attributed = {}  # key: position in round
+        if earliest is not None and latest is not None:
+            for i, msg in enumerate(self.replies):
+                if earliest[i] == latest[i]:
+                    attributed[earliest[i]] = msg
+        for position, index in enumerate(self.round):
+            if index in self.fragments:
+                # anchor or barrier
+                continue
+            msg = attributed.get(position)
+            if index == 0:
+                if msg is not None:
+                    self.description = msg
+                    self.fragments[0] = msg
+                    self.known[self.content(msg)] = 0
+                    self.pending = list(range(1, self.count))
+            elif msg is not None:
+                self.fragments[index] = msg
+                self.known[self.content(msg)] = index
+            else:
+                self.pending.append(index)
+                self.retries += 1
+        if self.description is None:
+            self.pending = [0]
+        self.pending.sort()
+        if not self.round_ended or earliest is None:
+            self.resync = True
+        self.lossy = len(self.replies) < len(self.round)
+        self.round = []
+
+    def apply(self, remote_node) -> None:
+        """Set the description of a node from the fragments (when complete).
+        """
+        description = self.description
+        remote_node.name = description.node_name
+        remote_node.bytecode_size = description.bytecode_size
+        remote_node.stack_size = description.stack_size
+        remote_node.max_var_size = description.max_var_size
+        remote_node.num_named_var = description.num_named_var
+        remote_node.num_local_events = description.num_local_events
+        remote_node.num_native_fun = description.num_native_fun
+        for index in range(1, self.count):
+            msg = self.fragments[index]
+            if msg.id == Message.ID_NAMED_VARIABLE_DESCRIPTION:
+                remote_node.add_var(msg.var_name, msg.var_size)
+            elif msg.id == Message.ID_LOCAL_EVENT_DESCRIPTION:
+                remote_node.local_events.append(msg.event_name)
+            else:
+                remote_node.native_functions.append(msg.fun_name)
+                remote_node.native_functions_arg_sizes[msg.fun_name] = msg.param_sizes
@@ -0,0 +1,389 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Several dongles (serial ports or TCP servers) handled in a single event loop
+
+Usage
+-----
+
+from thymiodirect.fleet import FleetManager
+fleet = FleetManager(refreshing_rate=0.1)
+fleet.add_serial("/dev/ttyACM0")
+fleet.add_serial("/dev/ttyACM1")
+fleet.start_in_thread()
+keys = fleet.wait_ready(4)  # [(dongle, node_id), ...]
+fleet[keys[0]]["motor.left.target"] = 100
+...
+fleet.shutdown()
+"""
+
+from __future__ import annotations
+
+import asyncio
+import sys
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from .connection import Connection, RemoteNode
+
+NodeKey = Tuple[Hashable, int]  # (dongle, node_id)
+
+
+class FleetManager:
+    """Connections sharing one asyncio event loop, with their input read
+    by the loop (no thread per connection except for serial ports on
+    Windows) and nodes identified by (dongle, node_id). Discovery, refresh
+    and liveness checks are done by a single task for all the connections.
+    """
+
+    def __init__(self,
+                 loop: Optional[asyncio.AbstractEventLoop] = None,
+                 discover_rate: Optional[float] = 1,
+                 liveness_period: float = 0.5,
+                 **connection_kwargs):
+        """
+        Construct a new FleetManager object.
+
+        Args:
+            loop: event loop (default: new loop owned by the manager).
+            discover_rate: period of LIST_NODES on all the connections in seconds, or None.
+            liveness_period: period of the check of silent nodes in seconds.
+            connection_kwargs: arguments of the Connection objects (refreshing_rate etc.).
+        """
+        self.has_own_loop = loop is None
+        self.loop = asyncio.new_event_loop() if loop is None else loop
+        self.discover_rate = discover_rate
+        self.liveness_period = liveness_period
+        self.connection_kwargs = connection_kwargs
+        self.connections: Dict[Hashable, Connection] = {}  # key: dongle
+        self.ready_condition = threading.Condition()  # shared by all the connections
+        self.thread = None
+        self.shutting_down = False
+        self.supervisor = None
+        self.wakeup = None  # asyncio.Event set to reschedule the supervisor, created in the loop
+        self.stopped = None  # future set by shutdown while run() is running
+
+        # callback for (dis)connection
+        # async fun((dongle, node_id), connect)
+        self.on_connection_changed: Optional[Callable] = None
+
+        # callback for notification that variables have been received
+        # async fun((dongle, node_id))
+        self.on_variables_received: Optional[Callable] = None
+
+        # callback for notification that an event has been emitted
+        # async fun((dongle, node_id), event_id, event_args)
+        self.on_user_event: Optional[Callable] = None
+
+        # callback for communication error notification
+        # fun(dongle, error)
+        self.on_comm_error: Optional[Callable] = None
+
+    def add(self, dongle: Hashable, connection: Connection) -> Connection:
+        """Add a connection created with the loop of the manager.
+        """
+        if dongle in self.connections:
+            raise KeyError(f"dongle {dongle} already added")
+        if connection.loop is not self.loop:
+            raise ValueError("connection with another event loop")
+        connection.ready_condition = self.ready_condition
+
+        async def on_connection_changed(node_id, connect):
+            if self.on_connection_changed:
+                await self.on_connection_changed((dongle, node_id), connect)
+
+        async def on_variables_received(node_id):
+            if self.on_variables_received:
+                await self.on_variables_received((dongle, node_id))
+
+        async def on_user_event(node_id, event_id, event_args):
+            if self.on_user_event:
+                await self.on_user_event((dongle, node_id), event_id, event_args)
+
+        def on_comm_error(error):
+            if self.on_comm_error:
+                self.on_comm_error(dongle, error)
+
+        connection.on_connection_changed = on_connection_changed
+        connection.on_variables_received = on_variables_received
+        connection.on_user_event = on_user_event
+        connection.on_comm_error = on_comm_error
+        # refresh and liveness checks by the supervisor instead of a task per node
+        connection.refresh_supervisor = self.reschedule
+        self.connections[dongle] = connection
+        if self.supervisor is not None:
+            connection.handshake()
+        return connection
+
+    def call_in_loop(self, fun: Callable, *args, **kwargs):
+        """Call a function in the loop thread and get its result, waiting
+        for it if the loop is running in another thread.
+        """
+        if self.loop.is_running():
+            try:
+                in_loop = asyncio.get_running_loop() is self.loop
+            except RuntimeError:
+                in_loop = False
+            if not in_loop:
+                async def call():
+                    return fun(*args, **kwargs)
+
+                return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+        return fun(*args, **kwargs)
+
+    def add_serial(self, port: str, dongle: Optional[Hashable] = None, **kwargs) -> Connection:
+        """Add a connection to a serial port, identified by the port name
+        by default, with Connection arguments which override those of the
+        manager (from any thread).
+        """
+        def add_serial():
+            connection = Connection.serial(port, asyncio_input=sys.platform != "win32", loop=self.loop,
+                                           **{**self.connection_kwargs, **kwargs})
+            return self.add(port if dongle is None else dongle, connection)
+
+        return self.call_in_loop(add_serial)
+
+    def add_tcp(self, host: str = "127.0.0.1", port: int = 33333, dongle: Optional[Hashable] = None,
+                **kwargs) -> Connection:
+        """Add a TCP connection, identified by "host:port" by default, with
+        Connection arguments which override those of the manager (from any
+        thread).
+        """
+        def add_tcp():
+            connection = Connection.tcp(host, port, asyncio_input=True, loop=self.loop,
+                                        **{**self.connection_kwargs, **kwargs})
+            return self.add(f"{host}:{port}" if dongle is None else dongle, connection)
+
+        return self.call_in_loop(add_tcp)
+
+    def remove(self, dongle: Hashable) -> None:
+        """Shut down and forget a connection (from any thread).
+        """
+        def remove():
+            connection = self.connections.pop(dongle)
+            connection.shutdown()
+
+        self.call_in_loop(remove)
+
+    def reschedule(self) -> None:
+        """Wake up the supervisor to schedule refresh again (from any
+        thread).
+        """
+        wakeup = self.wakeup
+        if wakeup is None:
+            # supervisor not started yet
+            return
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            wakeup.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(wakeup.set)
+
+    async def supervise(self) -> None:
+        """Discover nodes, refresh their variables and check liveness on all
+        the connections.
+        """
+        self.wakeup = asyncio.Event()
+        next_discover = 0
+        next_liveness = 0
+        reported = set()  # dongles whose input error has been reported
+        while not self.shutting_down:
+            try:
+                self.wakeup.clear()
+                now = time.monotonic()
+                discover = self.discover_rate is not None and now >= next_discover
+                if discover:
+                    next_discover = now + self.discover_rate
+                liveness = now >= next_liveness
+                if liveness:
+                    next_liveness = now + self.liveness_period
+                next_time = next_liveness if self.discover_rate is None else min(next_liveness, next_discover)
+                for dongle, connection in list(self.connections.items()):
+                    if connection.shutting_down:
+                        continue
+                    try:
+                        if discover:
+                            connection.handshake()
+                        for remote_node in list(connection.remote_nodes.values()):
+                            if remote_node.refreshing:
+                                next_time = min(next_time, connection.refresh_step(remote_node, now))
+                        if liveness:
+                            await connection.check_liveness()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        # write errors are reported by Connection.send
+                        pass
+                    input = connection.input_thread or connection.loop_input
+                    if input.comm_error is not None and dongle not in reported:
+                        reported.add(dongle)
+                        connection.on_comm_error(input.comm_error)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), max(next_time - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                break
+
+    def start(self) -> None:
+        """Start discovery, refresh and liveness checks (in the loop thread).
+        """
+        if self.supervisor is None:
+            for connection in self.connections.values():
+                connection.handshake()
+            self.supervisor = self.loop.create_task(self.supervise())
+
+    def run(self) -> None:
+        """Run the event loop until shutdown() is called.
+        """
+        self.stopped = self.loop.create_future()
+        self.start()
+        self.loop.run_until_complete(self.stopped)
+        self.run_tasks()
+
+    def start_in_thread(self) -> None:
+        """Run the event loop in a new thread until shutdown() is called.
+        """
+        started = threading.Event()
+        self.loop.call_soon(started.set)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        started.wait()
+
+    def shutdown(self) -> None:
+        """Shut down all the connections, from any thread.
+        """
+        def shutdown():
+            self.shutting_down = True
+            if self.supervisor is not None:
+                self.supervisor.cancel()
+            for connection in self.connections.values():
+                connection.shutdown()
+            if self.stopped is not None and not self.stopped.done():
+                self.stopped.set_result(None)
+
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(shutdown)
+            if self.thread is not None and self.thread is not threading.current_thread():
+                self.thread.join()
+        else:
+            shutdown()
+            self.run_tasks()
+
+    def run_tasks(self) -> None:
+        """Run the loop until the tasks of all the connections have finished.
+        """
+        tasks = [self.supervisor] if self.supervisor is not None else []
+        for connection in self.connections.values():
+            tasks += connection.tasks
+
+        async def all_tasks():
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.loop.run_until_complete(all_tasks())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.shutdown()
+
+    def nodes(self) -> List[NodeKey]:
+        """Get the key (dongle, node_id) of the nodes whose handshake is done.
+        """
+        return [
+            (dongle, node_id)
+            for dongle, connection in list(self.connections.items())
+            for node_id in list(connection.remote_node_set)
+        ]
+
+    def ready_nodes(self, stage: int = Connection.READY_DESCRIBED) -> List[NodeKey]:
+        """Get the key of the nodes which have reached a readiness stage.
+        """
+        return [
+            (dongle, node_id)
+            for dongle, connection in list(self.connections.items())
+            for node_id in connection.ready_nodes(stage)
+        ]
+
+    async def ready(self, n: int = 1, stage: int = Connection.READY_DESCRIBED) -> List[NodeKey]:
+        """Wait until n nodes of any dongle have reached a readiness stage
+        and get their key.
+        """
+        while True:
+            nodes = self.ready_nodes(stage)
+            if len(nodes) >= n:
+                return nodes
+            # until any connection has one more node ready
+            waiters = [
+                self.loop.create_task(connection.ready(len(connection.ready_nodes(stage)) + 1, stage))
+                for connection in self.connections.values()
+            ]
+            _, pending = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in pending:
+                waiter.cancel()
+
+    def wait_ready(self, n: int = 1, stage: int = Connection.READY_DESCRIBED,
+                   timeout: Optional[float] = 5) -> List[NodeKey]:
+        """Wait until n nodes have reached a readiness stage and get their key,
+        running the event loop if it isn't running yet or blocking until it
+        reaches it in its own thread.
+        """
+        if not self.loop.is_running():
+            self.start()
+            try:
+                return self.loop.run_until_complete(asyncio.wait_for(self.ready(n, stage), timeout))
+            except asyncio.TimeoutError:
+                raise TimeoutError()
+        with self.ready_condition:
+            if not self.ready_condition.wait_for(lambda: len(self.ready_nodes(stage)) >= n, timeout):
+                raise TimeoutError()
+        return self.ready_nodes(stage)
+
+    def remote_node(self, key: NodeKey) -> RemoteNode:
+        dongle, node_id = key
+        return self.connections[dongle].remote_nodes[node_id]
+
+    def set_refreshing_rate(self, rate: float) -> None:
+        """Change the refreshing rate of all the connections.
+        """
+        for connection in self.connections.values():
+            connection.set_refreshing_rate(rate)
+
+    def set_refreshing_coverage(self, variables=None) -> None:
+        """Change the variables refreshed on all the connections.
+        """
+        for connection in self.connections.values():
+            connection.set_refreshing_coverage(variables)
+
+    def set_node_refreshing(self, key: NodeKey, **settings) -> None:
+        dongle, node_id = key
+        self.connections[dongle].set_node_refreshing(node_id, **settings)
+
+    def get_var(self, key: NodeKey, name: str, index: int = 0) -> int:
+        dongle, node_id = key
+        return self.connections[dongle].get_var(node_id, name, index)
+
+    def get_var_array(self, key: NodeKey, name: str) -> List[int]:
+        dongle, node_id = key
+        return self.connections[dongle].get_var_array(node_id, name)
+
+    def set_var(self, key: NodeKey, name: str, val: int, index: int = 0) -> None:
+        dongle, node_id = key
+        self.connections[dongle].set_var(node_id, name, val, index)
+
+    def set_var_array(self, key: NodeKey, name: str, val: List[int]) -> None:
+        dongle, node_id = key
+        self.connections[dongle].set_var_array(node_id, name, val)
+
+    def __getitem__(self, key: NodeKey):
+        dongle, node_id = key
+        return self.connections[dongle][node_id]
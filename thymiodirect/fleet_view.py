@@ -0,0 +1,147 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Fleet-wide matrices of variables (requires numpy)
+
+Usage
+-----
+
+from thymiodirect.fleet_view import FleetView
+view = FleetView({"prox.horizontal", "motor.left.speed"})
+view.attach(connection)
+...
+with view.lock:
+    prox = view.matrix("prox.horizontal")  # one row per node
+    age = time.time() - view.timestamps()  # seconds since each row was updated
+    nodes = view.keys()  # node of each row
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Hashable, Iterable, List, Optional
+
+
+class FleetView:
+    """Preallocated matrices with a row per node for each watched variable,
+    updated as soon as variable data is received by the connections the
+    view is attached to.
+    """
+
+    def __init__(self, variables: Iterable[str], max_nodes: int = 64):
+        """
+        Construct a new FleetView object.
+
+        Args:
+            variables: names of the watched variables.
+            max_nodes: initial number of rows (doubled when needed).
+        """
+        import numpy as np  # pip3 install numpy
+        self.names = list(variables)
+        self.capacity = max_nodes
+        self.row_count = 0
+        self.rows: Dict[Hashable, int] = {}  # row index, key: node key
+        self.row_keys: List[Hashable] = []
+        self.matrices = {}  # numpy array (capacity, size), key: variable name (allocated with first node)
+        self.row_times = np.full(max_nodes, np.nan)  # time.time() of last update of each row
+        self.lock = threading.Lock()  # for consistent reads from other threads
+        self.listeners = []  # (connection, listener)
+
+    def attach(self, connection, name: Optional[Hashable] = None) -> None:
+        """Update the view with the variables received by a connection. Rows
+        are identified by node_id, or by (name, node_id) if name is specified
+        (to attach multiple connections).
+        """
+        def listener(remote_node, offset, count):
+            key = remote_node.node_id if name is None else (name, remote_node.node_id)
+            self.update(key, remote_node, offset, count)
+
+        connection.add_variable_listener(listener)
+        self.listeners.append((connection, listener))
+
+    def detach(self) -> None:
+        """Stop updating the view.
+        """
+        for connection, listener in self.listeners:
+            connection.remove_variable_listener(listener)
+        self.listeners = []
+
+    def row(self, key: Hashable, remote_node=None) -> int:
+        """Get the row index of a node, allocating it if needed.
+        """
+        if key in self.rows:
+            return self.rows[key]
+        import numpy as np
+        if self.row_count >= self.capacity:
+            # grow: views of previous matrices are not updated anymore
+            self.capacity *= 2
+            for name, matrix in self.matrices.items():
+                grown = np.zeros((self.capacity, matrix.shape[1]), dtype=np.int16)
+                grown[:self.row_count] = matrix[:self.row_count]
+                self.matrices[name] = grown
+            row_times = np.full(self.capacity, np.nan)
+            row_times[:self.row_count] = self.row_times[:self.row_count]
+            self.row_times = row_times
+        if remote_node is not None:
+            for name in self.names:
+                if name not in self.matrices and name in remote_node.var_size:
+                    self.matrices[name] = np.zeros((self.capacity, remote_node.var_size[name]), dtype=np.int16)
+        row = self.row_count
+        self.rows[key] = row
+        self.row_keys.append(key)
+        self.row_count += 1
+        return row
+
+    def update(self, key: Hashable, remote_node, offset: int, count: int) -> None:
+        """Copy the watched variables in the span of variable data
+        [offset, offset + count) of a node to its row.
+        """
+        import numpy as np
+        with self.lock:
+            row = self.row(key, remote_node)
+            end = offset + count
+            var_data = memoryview(remote_node.var_data)
+            copied = False
+            for name in self.names:
+                var_offset = remote_node.var_offset.get(name)
+                matrix = self.matrices.get(name)
+                if var_offset is None or matrix is None:
+                    continue
+                var_end = var_offset + min(remote_node.var_size[name], matrix.shape[1])
+                low = max(offset, var_offset)
+                high = min(end, var_end)
+                if low < high:
+                    matrix[row, low - var_offset:high - var_offset] = np.frombuffer(var_data[low:high],
+                                                                                    dtype=np.int16)
+                    copied = True
+            if copied:
+                # fresh only if watched variables have been received
+                self.row_times[row] = time.time()
+
+    def keys(self) -> List[Hashable]:
+        """Get the key of each row.
+        """
+        return self.row_keys[:self.row_count]
+
+    def matrix(self, name: str):
+        """Get the matrix of a variable, with a row per node (a view which
+        is updated in place; copy it or hold lock for a consistent state).
+        """
+        return self.matrices[name][:self.row_count]
+
+    def timestamps(self):
+        """Get the time.time() of the last update of each row (nan if never).
+        """
+        return self.row_times[:self.row_count]
+
+    def fresh(self, max_age: float, now: Optional[float] = None):
+        """Get a boolean vector of the rows updated within max_age seconds.
+        """
+        if now is None:
+            now = time.time()
+        return now - self.timestamps() <= max_age
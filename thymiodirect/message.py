@@ -7,7 +7,28 @@
 
 # Messages defined for Aseba communication protocol
 
+import operator
+import struct
+import sys
+import time
 import uuid
+from array import array
+from typing import List, Optional
+
+_uint16 = struct.Struct("<H")
+_uint16x2 = struct.Struct("<HH")
+_uint16x3 = struct.Struct("<HHH")
+_byteswap = sys.byteorder == "big"  # arrays of words have the native byte order
+_frame_structs = {}  # struct of header and payload, key: payload size
+
+
+def _frame_struct(payload_size: int) -> struct.Struct:
+    """Compile the struct of a frame with a payload of payload_size bytes
+    (header and payload packed at once) and add it to _frame_structs.
+    """
+    frame_struct = struct.Struct(f"<HHH{payload_size}s")
+    _frame_structs[payload_size] = frame_struct
+    return frame_struct
 
 
 class Message:
@@ -61,10 +82,13 @@ class Message:
     DEVICE_INFO_NAME = 2
     DEVICE_INFO_THYMIO2_RF_SETTINGS = 3
 
+    HEADER_SIZE = 6  # payload length, source node and message id
+
     def __init__(self, id, source_node, payload):
         self.id = id
         self.source_node = source_node
         self.payload = payload
+        self.decoded = False
 
     def get_uint8(self, offset):
         """Get an unsigned 8-bit integer in the payload.
@@ -74,7 +98,34 @@ class Message:
     def get_uint16(self, offset):
         """Get an unsigned 16-bit integer in the payload.
         """
-        return self.payload[offset] + 256 * self.payload[offset + 1], offset + 2
+        return _uint16.unpack_from(self.payload, offset)[0], offset + 2
+
+    def get_uint16_array(self, offset, end=None):
+        """Get an array('H') of unsigned 16-bit integers in the payload
+        from offset to end (default: end of payload), without intermediate
+        list.
+        """
+        return self.get_word_array("H", offset, end)
+
+    def get_int16_array(self, offset, end=None):
+        """Get an array('h') of signed 16-bit integers in the payload from
+        offset to end (default: end of payload), without intermediate list.
+        """
+        return self.get_word_array("h", offset, end)
+
+    def get_word_array(self, typecode, offset, end=None):
+        view = memoryview(self.payload)[offset:end]
+        a = array(typecode)
+        a.frombytes(view[:len(view) & ~1])
+        if _byteswap:
+            a.byteswap()
+        return a
+
+    def get_variables_view(self):
+        """Get the offset and a memoryview of the raw data (little-endian
+        16-bit words) of an ID_VARIABLES message, without decoding it.
+        """
+        return _uint16.unpack_from(self.payload, 0)[0], memoryview(self.payload)[2:]
 
     def get_string(self, offset):
         """Get a string in the payload.
@@ -90,157 +141,204 @@ class Message:
         return bytes([word & 0xff, (word & 0xff00) // 256])
 
     @staticmethod
-    def uint16array_to_bytes(a):
-        """Convert an array of unsigned 16-bit integer to bytes.
+    def uint16_array(*arrays):
+        """Concatenate arrays of 16-bit integers into an array('H'), with
+        negative numbers in two's complement.
+        """
+        words = array("H")
+        for a in arrays:
+            n = len(words)
+            try:
+                words.extend(a)
+            except (OverflowError, TypeError):
+                # negative values or array with another type
+                del words[n:]
+                words.extend([operator.index(w) & 0xffff for w in a])
+        return words
+
+    @staticmethod
+    def uint16array_to_bytes(*arrays):
+        """Convert one or more arrays of unsigned 16-bit integers to bytes.
         """
-        bytes = b""
-        for word in a:
-            bytes += Message.uint16_to_bytes(word)
-        return bytes
+        words = Message.uint16_array(*arrays)
+        if _byteswap:
+            words.byteswap()
+        return words.tobytes()
+
+    @staticmethod
+    def pack_uint16array_into(buffer, offset, a):
+        """Write an array of unsigned 16-bit integers into a bytearray at
+        offset and return the offset past the end.
+        """
+        words = Message.uint16_array(a)
+        if _byteswap:
+            words.byteswap()
+        end = offset + 2 * len(words)
+        memoryview(buffer)[offset:end] = memoryview(words).cast("B")
+        return end
 
     def decode(self):
-        """Decode message properties from its payload.
+        """Decode message properties from its payload with the decoder
+        registered for its id (done implicitly upon first access to a
+        property).
         """
-        if self.id == Message.ID_DESCRIPTION:
-            self.node_name, offset = self.get_string(0)
-            self.protocol_version, offset = self.get_uint16(offset)
-            self.bytecode_size, offset = self.get_uint16(offset)
-            self.stack_size, offset = self.get_uint16(offset)
-            self.max_var_size, offset = self.get_uint16(offset)
-            self.num_named_var, offset = self.get_uint16(offset)
-            self.num_local_events, offset = self.get_uint16(offset)
-            self.num_native_fun, offset = self.get_uint16(offset)
-        elif self.id == Message.ID_NAMED_VARIABLE_DESCRIPTION:
-            self.var_size, offset = self.get_uint16(0)
-            self.var_name, offset = self.get_string(offset)
-        elif self.id == Message.ID_LOCAL_EVENT_DESCRIPTION:
-            self.event_name, offset = self.get_string(0)
-            self.description, offset = self.get_string(offset)
-        elif self.id == Message.ID_NATIVE_FUNCTION_DESCRIPTION:
-            self.fun_name, offset = self.get_string(0)
-            self.description, offset = self.get_string(offset)
-            num_params, offset = self.get_uint16(offset)
-            self.param_names = []
-            self.param_sizes = []
-            for i in range(num_params):
-                size, offset = self.get_uint16(offset)
-                name, offset = self.get_string(offset)
-                self.param_names.append(name)
-                self.param_sizes.append(size)
-        elif self.id == Message.ID_VARIABLES:
-            self.var_offset, offset = self.get_uint16(0)
-            self.var_data = []
-            for i in range(len(self.payload) // 2 - 1):
-                word, offset = self.get_uint16(offset)
-                self.var_data.append(word)
-        elif self.id == Message.ID_EXECUTION_STATE_CHANGED:
-            self.pc, offset = self.get_uint16(0)
-            self.flags, offset = self.get_uint16(offset)
-            self.event_active = (self.flags & 1) != 0
-            self.step_by_step = (self.flags & 2) != 0
-            self.event_running = (self.flags & 4) != 0
-        elif self.id == Message.ID_NODE_PRESENT:
-            self.version, offset = self.get_uint16(0)
-        elif self.id == Message.ID_DEVICE_INFO:
-            self.device_info, offset = self.get_uint8(0)
-            if self.device_info == Message.DEVICE_INFO_NAME:
-                self.device_name, offset = self.get_string(offset)
-            elif self.device_info == Message.DEVICE_INFO_UUID:
-                data_len, offset = self.get_uint8(offset)
-                data = self.payload[offset:offset + data_len]
-                self.device_uuid = str(uuid.UUID(bytes=data))
-            elif self.device_info == Message.DEVICE_INFO_THYMIO2_RF_SETTINGS:
-                data_len, offset = self.get_uint8(offset)
-                if data_len == 6:
-                    self.network_id, offset = self.get_uint16(offset)
-                    self.node_id, offset = self.get_uint16(offset)
-                    self.channel, offset = self.get_uint16(offset)
-        elif self.id == Message.ID_SET_BYTECODE:
-            self.target_node_id, offset = self.get_uint16(0)
-            self.bc_offset, offset = self.get_uint16(offset)
-            val = []
-            for i in range(4, len(self.payload), 2):
-                instr, offset = self.get_uint16(offset)
-                val.append(instr)
-            self.bc = val
-        elif (self.id == Message.ID_BREAKPOINT_CLEAR_ALL
-              or self.id == Message.ID_RESET
-              or self.id == Message.ID_RUN
-              or self.id == Message.ID_PAUSE
-              or self.id == Message.ID_STEP
-              or self.id == Message.ID_STOP
-              or self.id == Message.ID_GET_EXECUTION_STATE):
-            self.target_node_id, offset = self.get_uint16(0)
-        elif (self.id == Message.ID_BREAKPOINT_SET
-              or self.id == Message.ID_BREAKPOINT_CLEAR):
-            self.target_node_id, offset = self.get_uint16(0)
-            self.pc, offset = self.get_uint16(offset)
-        elif self.id == Message.ID_GET_VARIABLES:
-            self.target_node_id, offset = self.get_uint16(0)
-            self.var_offset, offset = self.get_uint16(offset)
-            self.var_count, offset = self.get_uint16(offset)
-        elif self.id == Message.ID_SET_VARIABLES:
-            self.target_node_id, offset = self.get_uint16(0)
-            self.var_offset, offset = self.get_uint16(offset)
-            val = []
-            for i in range(4, len(self.payload), 2):
-                v, offset = self.get_uint16(offset)
-                val.append(v)
-            self.var_val = val
-        elif self.id == Message.ID_LIST_NODES:
-            self.version, offset = self.get_uint16(0)
-        elif self.id == Message.ID_GET_NODE_DESCRIPTION_FRAGMENT:
-            self.version, offset = self.get_uint16(0)
-            self.fragment, offset = self.get_uint16(offset)
-        elif self.id < Message.ID_FIRST_ASEBA_ID:
-            val = []
-            offset = 0
-            for i in range(0, len(self.payload), 2):
-                v, offset = self.get_uint16(offset)
-                val.append(v)
-            self.user_event_arg = val
+        self.decoded = True
+        decoder = Message.decoders.get(self.id)
+        if decoder is None and self.id < Message.ID_FIRST_ASEBA_ID:
+            decoder = Message.decode_user_event
+        if decoder is not None:
+            decoder(self)
+
+    def __getattr__(self, name):
+        # called only for missing attributes: decode lazily
+        if name.startswith("__") or self.__dict__.get("decoded", True):
+            raise AttributeError(name)
+        self.decode()
+        return getattr(self, name)
+
+    @staticmethod
+    def register_decoder(id, decoder=None, name=None):
+        """Register a function which decodes the properties of messages with
+        the specified id from their payload, e.g. for custom messages, or
+        return a decorator which registers it. Its optional name is used by
+        id_to_str.
+        """
+        if decoder is None:
+            return lambda fun: Message.register_decoder(id, fun, name) or fun
+        Message.decoders[id] = decoder
+        if name is not None:
+            Message.id_names[id] = name
+
+    def decode_description(self):
+        self.node_name, offset = self.get_string(0)
+        (self.protocol_version,
+         self.bytecode_size,
+         self.stack_size,
+         self.max_var_size,
+         self.num_named_var,
+         self.num_local_events,
+         self.num_native_fun) = struct.unpack_from("<7H", self.payload, offset)
+
+    def decode_named_variable_description(self):
+        self.var_size, offset = self.get_uint16(0)
+        self.var_name, offset = self.get_string(offset)
+
+    def decode_local_event_description(self):
+        self.event_name, offset = self.get_string(0)
+        self.description, offset = self.get_string(offset)
+
+    def decode_native_function_description(self):
+        self.fun_name, offset = self.get_string(0)
+        self.description, offset = self.get_string(offset)
+        num_params, offset = self.get_uint16(offset)
+        self.param_names = []
+        self.param_sizes = []
+        for i in range(num_params):
+            size, offset = self.get_uint16(offset)
+            name, offset = self.get_string(offset)
+            self.param_names.append(name)
+            self.param_sizes.append(size)
+
+    def decode_variables(self):
+        self.var_offset, = _uint16.unpack_from(self.payload, 0)
+        self.var_data = self.get_int16_array(2)
+
+    def decode_changed_variables(self):
+        # sequence of areas, each with offset, count and data
+        self.var_areas = []
+        offset = 0
+        while offset + 4 <= len(self.payload):
+            var_offset, count = _uint16x2.unpack_from(self.payload, offset)
+            offset += 4
+            self.var_areas.append((var_offset, self.get_int16_array(offset, offset + 2 * count)))
+            offset += 2 * count
+
+    def decode_execution_state_changed(self):
+        self.pc, self.flags = _uint16x2.unpack_from(self.payload, 0)
+        self.event_active = (self.flags & 1) != 0
+        self.step_by_step = (self.flags & 2) != 0
+        self.event_running = (self.flags & 4) != 0
+
+    def decode_version(self):
+        self.version, = _uint16.unpack_from(self.payload, 0)
+
+    def decode_device_info(self):
+        self.device_info, offset = self.get_uint8(0)
+        if self.device_info == Message.DEVICE_INFO_NAME:
+            self.device_name, offset = self.get_string(offset)
+        elif self.device_info == Message.DEVICE_INFO_UUID:
+            data_len, offset = self.get_uint8(offset)
+            data = self.payload[offset:offset + data_len]
+            self.device_uuid = str(uuid.UUID(bytes=data))
+        elif self.device_info == Message.DEVICE_INFO_THYMIO2_RF_SETTINGS:
+            data_len, offset = self.get_uint8(offset)
+            if data_len == 6:
+                self.network_id, self.node_id, self.channel = _uint16x3.unpack_from(self.payload, offset)
+
+    def decode_set_bytecode(self):
+        self.target_node_id, self.bc_offset = _uint16x2.unpack_from(self.payload, 0)
+        self.bc = self.get_uint16_array(4)
+
+    def decode_target(self):
+        self.target_node_id, = _uint16.unpack_from(self.payload, 0)
+
+    def decode_breakpoint(self):
+        self.target_node_id, self.pc = _uint16x2.unpack_from(self.payload, 0)
+
+    def decode_get_variables(self):
+        self.target_node_id, self.var_offset, self.var_count = _uint16x3.unpack_from(self.payload, 0)
+
+    def decode_set_variables(self):
+        self.target_node_id, self.var_offset = _uint16x2.unpack_from(self.payload, 0)
+        self.var_val = self.get_int16_array(4)
+
+    def decode_get_device_info(self):
+        self.target_node_id, self.device_info = _uint16x2.unpack_from(self.payload, 0)
+
+    def decode_get_node_description(self):
+        self.target_node_id, self.version = _uint16x2.unpack_from(self.payload, 0)
+
+    def decode_get_node_description_fragment(self):
+        self.target_node_id, self.version, self.fragment = _uint16x3.unpack_from(self.payload, 0)
+
+    def decode_user_event(self):
+        self.user_event_arg = self.get_int16_array(0)
+
+    def serialized_size(self):
+        """Size of the serialized message in bytes.
+        """
+        return Message.HEADER_SIZE + len(self.payload)
 
     def serialize(self):
         """Serialize message to bytes.
         """
-        return (self.uint16_to_bytes(len(self.payload))
-                + self.uint16_to_bytes(self.source_node)
-                + self.uint16_to_bytes(self.id)
-                + self.payload)
+        payload = self.payload
+        size = len(payload)
+        try:
+            frame_struct = _frame_structs[size]
+        except KeyError:
+            frame_struct = _frame_struct(size)
+        return frame_struct.pack(size, self.source_node, self.id, payload)
+
+    def serialize_into(self, buffer, offset=0):
+        """Serialize message into a bytearray at offset (the bytearray must
+        be large enough) and return the offset past the end.
+        """
+        payload = self.payload
+        size = len(payload)
+        try:
+            frame_struct = _frame_structs[size]
+        except KeyError:
+            frame_struct = _frame_struct(size)
+        frame_struct.pack_into(buffer, offset, size, self.source_node, self.id, payload)
+        return offset + frame_struct.size
 
     @staticmethod
     def id_to_str(id):
         """Convert message id to its name string.
         """
         try:
-            return {
-                Message.ID_DESCRIPTION: "DESCRIPTION",
-                Message.ID_NAMED_VARIABLE_DESCRIPTION: "ID_NAMED_VARIABLE_DESCRIPTION",
-                Message.ID_LOCAL_EVENT_DESCRIPTION: "ID_LOCAL_EVENT_DESCRIPTION",
-                Message.ID_NATIVE_FUNCTION_DESCRIPTION: "ID_NATIVE_FUNCTION_DESCRIPTION",
-                Message.ID_VARIABLES: "ID_VARIABLES",
-                Message.ID_EXECUTION_STATE_CHANGED: "ID_EXECUTION_STATE_CHANGED",
-                Message.ID_NODE_PRESENT: "ID_NODE_PRESENT",
-                Message.ID_GET_DESCRIPTION: "ID_GET_DESCRIPTION",
-                Message.ID_SET_BYTECODE: "ID_SET_BYTECODE",
-                Message.ID_RESET: "ID_RESET",
-                Message.ID_RUN: "ID_RUN",
-                Message.ID_PAUSE: "ID_PAUSE",
-                Message.ID_STEP: "ID_STEP",
-                Message.ID_STOP: "ID_STOP",
-                Message.ID_GET_EXECUTION_STATE: "ID_GET_EXECUTION_STATE",
-                Message.ID_BREAKPOINT_SET: "ID_BREAKPOINT_SET",
-                Message.ID_BREAKPOINT_CLEAR: "ID_BREAKPOINT_CLEAR",
-                Message.ID_BREAKPOINT_CLEAR_ALL: "ID_BREAKPOINT_CLEAR_ALL",
-                Message.ID_GET_VARIABLES: "ID_GET_VARIABLES",
-                Message.ID_SET_VARIABLES: "ID_SET_VARIABLES",
-                Message.ID_GET_NODE_DESCRIPTION: "ID_GET_NODE_DESCRIPTION",
-                Message.ID_LIST_NODES: "ID_LIST_NODES",
-                Message.ID_GET_DEVICE_INFO: "ID_GET_DEVICE_INFO",
-                Message.ID_SET_DEVICE_INFO: "ID_SET_DEVICE_INFO",
-                Message.ID_GET_CHANGED_VARIABLES: "ID_GET_CHANGED_VARIABLES",
-                Message.ID_GET_NODE_DESCRIPTION_FRAGMENT: "ID_GET_NODE_DESCRIPTION_FRAGMENT",
-            }[id]
+            return Message.id_names[id]
         except KeyError:
             return f"ID {id}"
 
@@ -269,9 +367,196 @@ class Message:
             for word in self.var_data:
                 str += f"{word},"
             str += ")"
+        elif self.id == Message.ID_CHANGED_VARIABLES:
+            for var_offset, var_data in self.var_areas:
+                str += f" offset={var_offset} data=("
+                for word in var_data:
+                    str += f"{word},"
+                str += ")"
         elif self.id == Message.ID_EXECUTION_STATE_CHANGED:
             str += f" pc={self.pc} event_active={self.event_active} step_by_step={self.step_by_step} event_running={self.event_running}"
 
         elif self.id == Message.ID_NODE_PRESENT:
             str += f" version={self.version}"
         return str
+
+
+# names of message ids, used by Message.id_to_str
+Message.id_names = {
+    Message.ID_DESCRIPTION: "DESCRIPTION",
+    Message.ID_NAMED_VARIABLE_DESCRIPTION: "ID_NAMED_VARIABLE_DESCRIPTION",
+    Message.ID_LOCAL_EVENT_DESCRIPTION: "ID_LOCAL_EVENT_DESCRIPTION",
+    Message.ID_NATIVE_FUNCTION_DESCRIPTION: "ID_NATIVE_FUNCTION_DESCRIPTION",
+    Message.ID_VARIABLES: "ID_VARIABLES",
+    Message.ID_EXECUTION_STATE_CHANGED: "ID_EXECUTION_STATE_CHANGED",
+    Message.ID_NODE_PRESENT: "ID_NODE_PRESENT",
+    Message.ID_CHANGED_VARIABLES: "ID_CHANGED_VARIABLES",
+    Message.ID_GET_DESCRIPTION: "ID_GET_DESCRIPTION",
+    Message.ID_SET_BYTECODE: "ID_SET_BYTECODE",
+    Message.ID_RESET: "ID_RESET",
+    Message.ID_RUN: "ID_RUN",
+    Message.ID_PAUSE: "ID_PAUSE",
+    Message.ID_STEP: "ID_STEP",
+    Message.ID_STOP: "ID_STOP",
+    Message.ID_GET_EXECUTION_STATE: "ID_GET_EXECUTION_STATE",
+    Message.ID_BREAKPOINT_SET: "ID_BREAKPOINT_SET",
+    Message.ID_BREAKPOINT_CLEAR: "ID_BREAKPOINT_CLEAR",
+    Message.ID_BREAKPOINT_CLEAR_ALL: "ID_BREAKPOINT_CLEAR_ALL",
+    Message.ID_GET_VARIABLES: "ID_GET_VARIABLES",
+    Message.ID_SET_VARIABLES: "ID_SET_VARIABLES",
+    Message.ID_GET_NODE_DESCRIPTION: "ID_GET_NODE_DESCRIPTION",
+    Message.ID_LIST_NODES: "ID_LIST_NODES",
+    Message.ID_GET_DEVICE_INFO: "ID_GET_DEVICE_INFO",
+    Message.ID_SET_DEVICE_INFO: "ID_SET_DEVICE_INFO",
+    Message.ID_GET_CHANGED_VARIABLES: "ID_GET_CHANGED_VARIABLES",
+    Message.ID_GET_NODE_DESCRIPTION_FRAGMENT: "ID_GET_NODE_DESCRIPTION_FRAGMENT",
+}
+
+# decoders of message properties, indexed by message id
+Message.decoders = {
+    Message.ID_DESCRIPTION: Message.decode_description,
+    Message.ID_NAMED_VARIABLE_DESCRIPTION: Message.decode_named_variable_description,
+    Message.ID_LOCAL_EVENT_DESCRIPTION: Message.decode_local_event_description,
+    Message.ID_NATIVE_FUNCTION_DESCRIPTION: Message.decode_native_function_description,
+    Message.ID_VARIABLES: Message.decode_variables,
+    Message.ID_CHANGED_VARIABLES: Message.decode_changed_variables,
+    Message.ID_EXECUTION_STATE_CHANGED: Message.decode_execution_state_changed,
+    Message.ID_NODE_PRESENT: Message.decode_version,
+    Message.ID_DEVICE_INFO: Message.decode_device_info,
+    Message.ID_SET_BYTECODE: Message.decode_set_bytecode,
+    Message.ID_BREAKPOINT_CLEAR_ALL: Message.decode_target,
+    Message.ID_RESET: Message.decode_target,
+    Message.ID_RUN: Message.decode_target,
+    Message.ID_PAUSE: Message.decode_target,
+    Message.ID_STEP: Message.decode_target,
+    Message.ID_STOP: Message.decode_target,
+    Message.ID_GET_EXECUTION_STATE: Message.decode_target,
+    Message.ID_GET_CHANGED_VARIABLES: Message.decode_target,
+    Message.ID_BREAKPOINT_SET: Message.decode_breakpoint,
+    Message.ID_BREAKPOINT_CLEAR: Message.decode_breakpoint,
+    Message.ID_GET_VARIABLES: Message.decode_get_variables,
+    Message.ID_SET_VARIABLES: Message.decode_set_variables,
+    Message.ID_GET_NODE_DESCRIPTION: Message.decode_get_node_description,
+    Message.ID_LIST_NODES: Message.decode_version,
+    Message.ID_GET_DEVICE_INFO: Message.decode_get_device_info,
+    Message.ID_GET_NODE_DESCRIPTION_FRAGMENT: Message.decode_get_node_description_fragment,
+}
+
+
+class FrameReader:
+    """Incremental splitter of a byte stream into Aseba messages.
+
+    Input bytes are accumulated in a reusable buffer and all the complete
+    frames it contains are extracted at once. Since Aseba frames have no
+    synchronization marker, a header which cannot be valid (unknown message
+    id, excessive payload length or payload length impossible for the
+    message id) is skipped byte by byte until framing is recovered. A frame
+    followed by bytes which cannot be a header is assumed to have been
+    completed with the bytes of the next frame after a truncation, and is
+    skipped too. An incomplete frame is dropped when the next bytes arrive
+    after more than partial_timeout. If sources is set (container of node
+    ids, e.g. Connection.remote_nodes), complete frames from other nodes are
+    dropped except NODE_PRESENT; the source is not used to recover framing,
+    since other nodes and other clients of a switch send valid frames too.
+    """
+
+    MAX_PAYLOAD_SIZE = 1024  # larger than any message sent by Aseba nodes
+    PARTIAL_TIMEOUT = 0.2  # max time between the bytes of a frame in seconds
+
+    # payload size of messages sent by nodes, as (min, max or None, even)
+    PAYLOAD_SIZES = {
+        Message.ID_NODE_PRESENT: (2, 2, True),
+        Message.ID_EXECUTION_STATE_CHANGED: (4, 4, True),
+        Message.ID_VARIABLES: (2, None, True),
+        Message.ID_CHANGED_VARIABLES: (0, None, True),
+        Message.ID_DESCRIPTION: (15, None, False),
+        Message.ID_NAMED_VARIABLE_DESCRIPTION: (3, None, False),
+        Message.ID_LOCAL_EVENT_DESCRIPTION: (2, None, False),
+        Message.ID_NATIVE_FUNCTION_DESCRIPTION: (4, None, False),
+        Message.ID_DEVICE_INFO: (1, None, False),
+    }
+
+    _header = struct.Struct("<HHH")
+
+    def __init__(self, max_payload_size: int = MAX_PAYLOAD_SIZE, partial_timeout: Optional[float] = PARTIAL_TIMEOUT):
+        self.buffer = bytearray()
+        self.max_payload_size = max_payload_size
+        self.partial_timeout = partial_timeout  # or None to keep incomplete frames
+        self.last_feed_time = None  # time.monotonic() of the last bytes received
+        self.discarded_bytes = 0  # total count of bytes dropped to resynchronize
+        self.sources = None  # node ids of frames kept except NODE_PRESENT, or None for any
+        self.filtered_count = 0  # total count of valid frames dropped because of sources
+        self.known_ids = {
+            value
+            for key, value in vars(Message).items()
+            if key.startswith("ID_") and key != "ID_FIRST_ASEBA_ID"
+        }
+
+    def is_plausible_header(self, payload_len: int, id: int) -> bool:
+        """Check whether a frame header could have been sent by a node.
+        """
+        if payload_len > self.max_payload_size:
+            return False
+        if id < Message.ID_FIRST_ASEBA_ID:
+            # user event, with 16-bit arguments
+            return payload_len % 2 == 0
+        sizes = self.PAYLOAD_SIZES.get(id)
+        if sizes is not None:
+            min_len, max_len, even = sizes
+            return (payload_len >= min_len and (max_len is None or payload_len <= max_len)
+                    and (not even or payload_len % 2 == 0))
+        return id in self.known_ids or id in Message.decoders
+
+    def feed(self, data: bytes) -> List[Message]:
+        """Append bytes to the buffer and return the complete messages.
+        """
+        if data:
+            if self.partial_timeout is not None:
+                now = time.monotonic()
+                if self.buffer and now - self.last_feed_time > self.partial_timeout:
+                    # the pending frame has been truncated
+                    self.discard_partial()
+                self.last_feed_time = now
+            self.buffer += data
+        return self.split()
+
+    def split(self) -> List[Message]:
+        """Extract all the complete messages from the buffer.
+        """
+        buffer = self.buffer
+        size = len(buffer)
+        messages = []
+        pos = 0
+        while size - pos >= Message.HEADER_SIZE:
+            payload_len, source_node, id = self._header.unpack_from(buffer, pos)
+            if not self.is_plausible_header(payload_len, id):
+                # garbled frame: skip one byte and try again
+                pos += 1
+                self.discarded_bytes += 1
+                continue
+            end = pos + Message.HEADER_SIZE + payload_len
+            if end > size:
+                break
+            if end + Message.HEADER_SIZE <= size:
+                next_payload_len, _, next_id = self._header.unpack_from(buffer, end)
+                if not self.is_plausible_header(next_payload_len, next_id):
+                    # truncated frame completed with the bytes of the next one
+                    pos += 1
+                    self.discarded_bytes += 1
+                    continue
+            if (self.sources is None or id == Message.ID_NODE_PRESENT
+                    or source_node in self.sources):
+                messages.append(Message(id, source_node, bytes(buffer[pos + Message.HEADER_SIZE:end])))
+            else:
+                self.filtered_count += 1
+            pos = end
+        if pos > 0:
+            del buffer[:pos]
+        return messages
+
+    def discard_partial(self) -> None:
+        """Drop an incomplete frame, e.g. when the input stream has been idle
+        and the frame is known to be truncated.
+        """
+        self.discarded_bytes += len(self.buffer)
+        self.buffer.clear()
@@ -0,0 +1,188 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Bounded time series of variables (requires numpy)
+
+Usage
+-----
+
+from thymiodirect.recorder import VariableRecorder
+recorder = VariableRecorder(["prox.horizontal", "motor.left.speed"], capacity=10000)
+recorder.attach(thymio)  # or a Connection
+...
+times, values = recorder.last(node_id, "prox.horizontal", 10)
+times, values = recorder.since(node_id, "motor.left.speed", time.monotonic() - 5)
+low, high, mean = recorder.stats(node_id, "motor.left.speed", 5)
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class TimeSeries:
+    """Circular buffer of the last samples of a variable of a node, with
+    their time.monotonic() receive time.
+    """
+
+    def __init__(self, offset: int, size: int, capacity: int):
+        import numpy as np  # pip3 install numpy
+        self.offset = offset  # in var_data
+        self.size = size
+        self.capacity = capacity
+        self.count = 0  # total number of samples recorded
+        self.times = np.zeros(capacity)
+        self.data = np.zeros((capacity, size), dtype=np.int16)
+
+    def __len__(self) -> int:
+        return min(self.count, self.capacity)
+
+    def covers(self, offset: int, count: int) -> bool:
+        """Check whether the span [offset, offset + count) of variable data
+        overlaps the variable.
+        """
+        return offset < self.offset + self.size and self.offset < offset + count
+
+    def append(self, var_data: memoryview, timestamp: float) -> None:
+        """Record a sample of the variable, overwriting the oldest one if
+        full.
+        """
+        import numpy as np
+        row = self.count % self.capacity
+        self.data[row] = np.frombuffer(var_data[self.offset:self.offset + self.size], dtype=np.int16)
+        self.times[row] = timestamp
+        self.count += 1
+
+    def take(self, first: int) -> Tuple:
+        """Get copies of the times and values from the first-th oldest
+        sample to the newest one.
+        """
+        import numpy as np
+        length = len(self)
+        first = min(max(first, 0), length)
+        begin = (self.count - length + first) % self.capacity
+        stop = self.count % self.capacity
+        if first == length or begin < stop:
+            return self.times[begin:stop].copy(), self.data[begin:stop].copy()
+        # wraps around
+        return (np.concatenate((self.times[begin:], self.times[:stop])),
+                np.concatenate((self.data[begin:], self.data[:stop])))
+
+    def index_since(self, t: float) -> int:
+        """Get the rank, from the oldest sample, of the first sample received
+        at time t or later (binary search).
+        """
+        import numpy as np
+        length = len(self)
+        oldest = (self.count - length) % self.capacity
+        if oldest + length <= self.capacity:
+            return int(np.searchsorted(self.times[oldest:oldest + length], t))
+        older = self.times[oldest:]
+        if len(older) > 0 and older[-1] >= t:
+            return int(np.searchsorted(older, t))
+        return len(older) + int(np.searchsorted(self.times[:self.count % self.capacity], t))
+
+
+class VariableRecorder:
+    """Recorder of the last samples of selected variables of each node, in
+    preallocated circular buffers whose size doesn't change over time. A
+    variable is sampled only when its own value has been received.
+    """
+
+    def __init__(self, variables: Iterable[str], capacity: int = 1000):
+        """
+        Construct a new VariableRecorder object.
+
+        Args:
+            variables: names of the recorded variables.
+            capacity: number of samples kept per variable and node.
+        """
+        self.names = list(variables)
+        self.capacity = capacity
+        self.series: Dict[int, Dict[str, TimeSeries]] = {}  # key: node_id, variable name
+        self.lock = threading.Lock()
+        self.listeners = []  # (connection, listener)
+
+    def attach(self, source) -> None:
+        """Record the variables received by a Connection or a connected
+        Thymio.
+        """
+        connection = source.thymio_proxy.connection if hasattr(source, "thymio_proxy") else source
+
+        def listener(remote_node, offset, count):
+            self.record(remote_node, offset, count)
+
+        connection.add_variable_listener(listener)
+        self.listeners.append((connection, listener))
+
+    def detach(self) -> None:
+        """Stop recording.
+        """
+        for connection, listener in self.listeners:
+            connection.remove_variable_listener(listener)
+        self.listeners = []
+
+    def record(self, remote_node, offset: int, count: int) -> None:
+        """Record a sample of the recorded variables which overlap the span
+        of variable data [offset, offset + count) which has just been
+        received.
+        """
+        timestamp = time.monotonic()
+        with self.lock:
+            node_series = self.series.get(remote_node.node_id)
+            if node_series is None:
+                node_series = {
+                    name: TimeSeries(remote_node.var_offset[name], remote_node.var_size[name], self.capacity)
+                    for name in self.names
+                    if name in remote_node.var_offset
+                }
+                self.series[remote_node.node_id] = node_series
+            var_data = None
+            for series in node_series.values():
+                if series.covers(offset, count):
+                    if var_data is None:
+                        var_data = memoryview(remote_node.var_data)
+                    series.append(var_data, timestamp)
+
+    def clear(self, node_id: Optional[int] = None) -> None:
+        """Forget the samples of a node, or of all nodes.
+        """
+        with self.lock:
+            if node_id is None:
+                self.series.clear()
+            else:
+                self.series.pop(node_id, None)
+
+    def last(self, node_id: int, name: str, k: int) -> Tuple:
+        """Get the times and values (array with a row per sample) of the
+        last k samples of a variable, oldest first.
+        """
+        with self.lock:
+            series = self.series[node_id][name]
+            return series.take(len(series) - k)
+
+    def since(self, node_id: int, name: str, t: float) -> Tuple:
+        """Get the times and values of the samples of a variable received
+        at time.monotonic() t or later, oldest first.
+        """
+        with self.lock:
+            series = self.series[node_id][name]
+            return series.take(series.index_since(t))
+
+    def stats(self, node_id: int, name: str, window: float,
+              now: Optional[float] = None) -> Tuple:
+        """Get the min, max and mean of each element of a variable over the
+        samples of the last window seconds (None if there is none).
+        """
+        if now is None:
+            now = time.monotonic()
+        _, values = self.since(node_id, name, now - window)
+        if len(values) == 0:
+            return None
+        return values.min(axis=0), values.max(axis=0), values.mean(axis=0)
@@ -0,0 +1,305 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Planning of the refresh of variable data
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import math
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from .message import Message
+
+# bytes of a GET_VARIABLES message (target node, offset and count)
+GET_VARIABLES_BYTES = Message.HEADER_SIZE + 6
+# bytes of a VARIABLES message besides the variable data (offset)
+VARIABLES_OVERHEAD_BYTES = Message.HEADER_SIZE + 2
+
+
+def span_cost(length: int) -> int:
+    """Number of bytes exchanged to fetch a span of variable data with a
+    GET_VARIABLES request and its reply.
+    """
+    return GET_VARIABLES_BYTES + VARIABLES_OVERHEAD_BYTES + 2 * length
+
+
+class RefreshPlan:
+    """Spans of variable data fetched in each refresh cycle, each with its
+    own GET_VARIABLES message.
+    """
+
+    def __init__(self, spans: List[Tuple[int, int]]):
+        self.spans = spans  # list of (offset, length) sorted by offset
+
+    def __iter__(self):
+        return iter(self.spans)
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def __repr__(self) -> str:
+        return f"RefreshPlan(spans={self.spans}, bytes_per_cycle={self.bytes_per_cycle})"
+
+    @property
+    def length(self) -> int:
+        """Total number of words fetched per cycle.
+        """
+        return sum(length for _, length in self.spans)
+
+    @property
+    def bytes_per_cycle(self) -> int:
+        """Number of bytes exchanged per cycle, requests and replies.
+        """
+        return sum(span_cost(length) for _, length in self.spans)
+
+    @staticmethod
+    def for_intervals(intervals: Iterable[Tuple[int, int]]) -> RefreshPlan:
+        """Plan the spans covering a collection of (offset, length) intervals.
+        The gap between two intervals is fetched only if it costs less than a
+        separate request.
+        """
+        spans = []
+        request_overhead = span_cost(0)
+        for offset, length in sorted(intervals):
+            if length <= 0:
+                continue
+            if spans:
+                prev_offset, prev_length = spans[-1]
+                gap = offset - (prev_offset + prev_length)
+                if 2 * gap <= request_overhead:
+                    # cheaper (or overlapping): extend previous span
+                    spans[-1] = (prev_offset, max(prev_length, offset + length - prev_offset))
+                    continue
+            spans.append((offset, length))
+        return RefreshPlan(spans)
+
+
+def variable_periods(names: Iterable[str],
+                     rates: Optional[Dict[str, float]] = None,
+                     coverage: Optional[Set[str]] = None,
+                     default_period: Optional[float] = None) -> Dict[str, float]:
+    """Get the refresh period of each variable. Keys of rates are variable
+    names or patterns with wildcards (e.g. "motor.*.speed"); an exact name
+    takes precedence over patterns. Variables not in rates are refreshed
+    with default_period if they are in coverage (default: all), or never.
+    """
+    names = list(names)
+    if coverage is not None:
+        for name in coverage:
+            if name not in names:
+                raise KeyError(name)
+    periods = {}
+    for name in names:
+        if rates is not None and name in rates:
+            period = rates[name]
+        else:
+            period = None
+            if rates is not None:
+                for pattern, pattern_period in rates.items():
+                    if fnmatch.fnmatchcase(name, pattern):
+                        period = pattern_period
+                        break
+            if period is None and (coverage is None or name in coverage):
+                period = default_period
+        if period is not None:
+            periods[name] = period
+    return periods
+
+
+class RefreshScheduler:
+    """Multi-rate refresh scheduler. Variables are grouped by period; the
+    groups due at the same tick are fetched together with the spans planned
+    for their union.
+    """
+
+    def __init__(self, remote_node, periods: Dict[str, float], start_time: float):
+        """
+        Construct a new RefreshScheduler object.
+
+        Args:
+            remote_node: RemoteNode whose variables are refreshed.
+            periods: refresh period of each variable, in seconds.
+            start_time: time of the first tick (all groups are due).
+        """
+        self.remote_node = remote_node
+        self.start_time = start_time
+        self.groups: Dict[float, Set[str]] = {}  # key: period
+        for name, period in periods.items():
+            self.groups.setdefault(period, set()).add(name)
+        self.tick_count = {period: 0 for period in self.groups}  # index of next tick
+        # groups due within this delay are fetched together
+        self.tolerance = 0.1 * min(self.groups) if self.groups else 0
+        self.plans: Dict[frozenset, RefreshPlan] = {}  # cache, key: set of periods
+
+    def next_time(self, period: float) -> float:
+        return self.start_time + self.tick_count[period] * period
+
+    def time_to_next(self, now: float) -> Optional[float]:
+        """Get the delay until the next tick, or None if nothing is refreshed.
+        """
+        if not self.groups:
+            return None
+        return max(min(self.next_time(period) for period in self.groups) - now, 0)
+
+    def plan(self, periods: Iterable[float]) -> RefreshPlan:
+        """Get the plan to fetch the variables of the groups with the given
+        periods.
+        """
+        key = frozenset(periods)
+        if key not in self.plans:
+            intervals = [
+                (self.remote_node.var_offset[name], self.remote_node.var_size[name])
+                for period in key
+                for name in self.groups[period]
+            ]
+            self.plans[key] = RefreshPlan.for_intervals(intervals)
+        return self.plans[key]
+
+    def pop_due(self, now: float) -> RefreshPlan:
+        """Get the plan for all the groups due at time now and advance them
+        to their next tick (skipping missed ticks).
+        """
+        due = [
+            period
+            for period in self.groups
+            if self.next_time(period) <= now + self.tolerance
+        ]
+        for period in due:
+            self.tick_count[period] = max(self.tick_count[period] + 1,
+                                          math.floor((now - self.start_time) / period) + 1)
+        return self.plan(due)
+
+    @property
+    def bytes_per_second(self) -> float:
+        """Estimated number of bytes exchanged per second if each group was
+        fetched on its own (upper bound).
+        """
+        return sum(self.plan([period]).bytes_per_cycle / period for period in self.groups)
+
+
+class RefreshPacer:
+    """Tracking of the refresh requests in flight and of their round-trip
+    time. When pacing is enabled, the refresh period is adapted AIMD-style
+    between a floor and a ceiling: a cycle is postponed and the rate halved
+    while the previous one has not been answered, and the rate is increased
+    by a constant step after each answered cycle.
+    """
+
+    RTT_SMOOTHING = 0.125  # weight of new samples (as for TCP's smoothed RTT)
+    RATE_STEPS = 20  # number of answered cycles from min rate to max rate
+    LOSS_TIMEOUT = 1.0  # min delay after which the requests in flight are considered lost
+
+    def __init__(self):
+        self.pending = []  # keys of the requests sent and not answered yet
+        self.cycle_time = None  # time when the oldest cycle in flight was sent
+        self.last_send_time = None
+        self.rtt = None  # smoothed round-trip time of refresh cycles
+        self.interval = None  # smoothed interval between refresh cycles
+        self.floor = None  # min period, or None if not paced
+        self.ceiling = None  # max period
+        self.period = None  # adapted period
+        self.skipped_cycles = 0
+        self.lost_cycles = 0
+
+    def configure(self, pacing: Optional[Tuple[float, float]]) -> None:
+        """Enable pacing between periods (floor, ceiling), or disable it
+        with None.
+        """
+        if pacing is None:
+            self.floor = self.ceiling = self.period = None
+        else:
+            self.floor, self.ceiling = pacing
+            if self.period is None:
+                self.period = self.floor
+            self.period = min(max(self.period, self.floor), self.ceiling)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of requests sent and not answered yet.
+        """
+        return len(self.pending)
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Effective number of refresh cycles per second.
+        """
+        return 1 / self.interval if self.interval else None
+
+    @property
+    def loss_timeout(self) -> float:
+        """Delay after which the requests in flight are considered lost.
+        """
+        return max(self.LOSS_TIMEOUT, 4 * (self.rtt or 0))
+
+    def delay(self, now: float) -> float:
+        """Get the delay before the next cycle is allowed by pacing. It is 0
+        only if may_send would accept a new cycle.
+        """
+        if self.period is None or self.last_send_time is None:
+            return 0
+        delay = self.last_send_time + self.period - now
+        if delay <= 0 and self.in_flight > 0:
+            # previous cycle unanswered: wait for another period, at most
+            # until it is considered lost
+            delay = min(self.period, self.cycle_time + self.loss_timeout - now)
+        return max(delay, 0)
+
+    def may_send(self, now: float) -> bool:
+        """Check whether a new cycle can be sent, backing off if the previous
+        one is still in flight.
+        """
+        if self.in_flight == 0:
+            return True
+        if now - self.cycle_time >= self.loss_timeout:
+            # replies lost
+            self.lost_cycles += 1
+            self.pending.clear()
+            self.back_off()
+            return True
+        if self.period is None:
+            return True
+        self.skipped_cycles += 1
+        self.back_off()
+        return False
+
+    def back_off(self) -> None:
+        """Halve the refresh rate (multiplicative decrease).
+        """
+        if self.period is not None:
+            self.period = min(2 * self.period, self.ceiling)
+
+    def sent(self, now: float, requests: List[Hashable]) -> None:
+        """Record that a cycle of requests has been sent, identified by keys
+        matched by received (e.g. the end of the span of GET_VARIABLES).
+        """
+        if not requests:
+            return
+        if self.last_send_time is not None:
+            interval = now - self.last_send_time
+            self.interval = (interval if self.interval is None
+                             else self.interval + self.RTT_SMOOTHING * (interval - self.interval))
+        self.last_send_time = now
+        if not self.pending:
+            self.cycle_time = now
+        self.pending += requests
+
+    def received(self, now: float, request: Hashable) -> None:
+        """Record that the reply to a request has been received completely,
+        which completes the cycle if it was the last one in flight.
+        """
+        if request not in self.pending:
+            return
+        self.pending.remove(request)
+        if not self.pending:
+            rtt = now - self.cycle_time
+            self.rtt = rtt if self.rtt is None else self.rtt + self.RTT_SMOOTHING * (rtt - self.rtt)
+            if self.period is not None:
+                # additive increase of the rate
+                rate = 1 / self.period + (1 / self.floor - 1 / self.ceiling) / self.RATE_STEPS
+                self.period = max(1 / rate, self.floor)
@@ -0,0 +1,273 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Dongles shared among worker processes, with variables in shared memory
+(requires Python 3.8)
+
+Each worker process runs a FleetManager for a group of dongles whose
+connections mirror the variables of each node in a shared memory block
+(see shared_mirror.py). Variables are read directly in the blocks by the
+parent process; changes are sent to the worker which owns the node.
+
+Usage
+-----
+
+from thymiodirect.sharding import ShardedFleet
+fleet = ShardedFleet([["/dev/ttyACM0", "/dev/ttyACM1"], [("127.0.0.1", 33333)]],
+                     refreshing_rate=0.02)
+keys = fleet.wait_ready(3)  # [(dongle, node_id), ...]
+prox = fleet[keys[0]]["prox.horizontal"]
+fleet[keys[0]]["motor.left.target"] = 100
+...
+fleet.shutdown()
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import threading
+from typing import Dict, Hashable, List, Optional, Tuple, Union
+
+from .connection import is_array_value
+from .shared_mirror import SharedMirrorReader
+
+NodeKey = Tuple[Hashable, int]  # (dongle, node_id)
+DongleSpec = Union[str, Tuple[str, int]]  # serial port or (host, tcp port)
+
+# commands which can be sent to the worker owning a node, as FleetManager methods
+NODE_COMMANDS = {"set_var", "set_var_array", "set_node_refreshing"}
+
+
+def run_worker(dongles: List[Tuple[DongleSpec, str]], connection_kwargs: dict, pipe) -> None:
+    """Worker process: handle a group of dongles, given with the prefix of
+    the names of their shared memory blocks, announce their nodes and
+    execute the commands received on the pipe until shutdown.
+    """
+    from .fleet import FleetManager
+
+    fleet = FleetManager(**connection_kwargs)
+
+    async def on_connection_changed(key, connect):
+        if connect:
+            dongle, node_id = key
+            pipe.send(("connected", key, fleet.connections[dongle].shared_mirror_name(node_id)))
+        else:
+            pipe.send(("disconnected", key))
+
+    def on_comm_error(dongle, error):
+        pipe.send(("comm_error", dongle, str(error)))
+
+    fleet.on_connection_changed = on_connection_changed
+    fleet.on_comm_error = on_comm_error
+    for dongle, prefix in dongles:
+        if isinstance(dongle, str):
+            fleet.add_serial(dongle, shared_mirror=prefix)
+        else:
+            fleet.add_tcp(*dongle, shared_mirror=prefix)
+
+    def execute(command):
+        if command[0] == "shutdown":
+            fleet.shutdown()
+        elif command[0] in NODE_COMMANDS:
+            _, key, args, kwargs = command
+            try:
+                getattr(fleet, command[0])(tuple(key), *args, **kwargs)
+            except KeyError:
+                # node disconnected meanwhile
+                pass
+
+    def read_commands():
+        while True:
+            try:
+                command = pipe.recv()
+            except (EOFError, OSError):
+                command = ("shutdown",)
+            fleet.loop.call_soon_threadsafe(execute, command)
+            if command[0] == "shutdown":
+                break
+
+    threading.Thread(target=read_commands, daemon=True).start()
+    try:
+        fleet.run()
+    finally:
+        pipe.send(("stopped",))
+
+
+class ShardedNode:
+    """Variables of a node read in its shared memory block, with changes
+    routed to the worker which owns the node.
+    """
+
+    def __init__(self, fleet: ShardedFleet, key: NodeKey, mirror_name: str):
+        self.fleet = fleet
+        self.key = key
+        self.mirror = SharedMirrorReader(mirror_name)
+        self.events: List[str] = self.mirror.layout["events"]
+        self.native_functions: List[str] = self.mirror.layout["native_functions"]
+
+    def close(self) -> None:
+        self.mirror.close()
+
+    def variables(self) -> List[str]:
+        return self.mirror.variables()
+
+    def get_var_array(self, name: str) -> List[int]:
+        return self.mirror.get_var_array(name)
+
+    def get_vars(self, names: List[str]) -> Tuple[Dict[str, List[int]], int]:
+        return self.mirror.get_vars(names)
+
+    def __getitem__(self, name):
+        val = self.get_var_array(name)
+        return val if len(val) != 1 else val[0]
+
+    def __setitem__(self, name, val):
+        if name not in self.mirror.var_offset:
+            raise KeyError(name)
+        if is_array_value(val):
+            self.fleet.command(self.key, "set_var_array", name, val)
+        else:
+            self.fleet.command(self.key, "set_var", name, val)
+
+
+class ShardedFleet:
+    """Groups of dongles handled by worker processes, one per group, with
+    the nodes identified by (dongle, node_id) like in FleetManager.
+    """
+
+    def __init__(self, groups: List[List[DongleSpec]], mp_context: Optional[str] = None, **connection_kwargs):
+        """
+        Construct a new ShardedFleet object and start the workers.
+
+        Args:
+            groups: dongles of each worker, as serial port names or (host, port) tuples.
+            mp_context: multiprocessing start method (default: platform default).
+            connection_kwargs: arguments of the FleetManager of each worker.
+        """
+        context = multiprocessing.get_context(mp_context)
+        self.pipes = []
+        self.pipe_locks = []
+        self.workers = []
+        self.owner = {}  # index of worker, key: (dongle, node_id)
+        self.nodes_by_key: Dict[NodeKey, ShardedNode] = {}
+        self.condition = threading.Condition()
+        self.comm_errors = []  # (dongle, error message)
+        dongle_index = 0
+        for dongles in groups:
+            # unique prefix of shared memory block names for each dongle
+            prefixed = []
+            for dongle in dongles:
+                prefixed.append((dongle, f"thymio-{os.getpid()}-{dongle_index}"))
+                dongle_index += 1
+            pipe, worker_pipe = context.Pipe()
+            worker = context.Process(target=run_worker, args=(prefixed, connection_kwargs, worker_pipe), daemon=True)
+            worker.start()
+            worker_pipe.close()
+            self.pipes.append(pipe)
+            self.pipe_locks.append(threading.Lock())
+            self.workers.append(worker)
+        self.reader = threading.Thread(target=self.read_workers, daemon=True)
+        self.reader.start()
+
+    def read_workers(self) -> None:
+        """Handle the notifications of the workers until they have all stopped.
+        """
+        from multiprocessing.connection import wait
+        running = {pipe: i for i, pipe in enumerate(self.pipes)}
+        while running:
+            for pipe in wait(list(running)):
+                try:
+                    msg = pipe.recv()
+                except (EOFError, OSError):
+                    msg = ("stopped",)
+                with self.condition:
+                    if msg[0] == "connected":
+                        _, key, mirror_name = msg
+                        self.forget(key)
+                        try:
+                            self.nodes_by_key[key] = ShardedNode(self, key, mirror_name)
+                            self.owner[key] = running[pipe]
+                        except (FileNotFoundError, ValueError):
+                            # disconnected (block unlinked) before being attached
+                            pass
+                    elif msg[0] == "disconnected":
+                        self.forget(msg[1])
+                    elif msg[0] == "comm_error":
+                        self.comm_errors.append(msg[1:])
+                    elif msg[0] == "stopped":
+                        worker = running.pop(pipe)
+                        for key in [key for key, i in self.owner.items() if i == worker]:
+                            self.forget(key)
+                    self.condition.notify_all()
+        with self.condition:
+            for key in list(self.nodes_by_key):
+                self.forget(key)
+
+    def forget(self, key: NodeKey) -> None:
+        node = self.nodes_by_key.pop(key, None)
+        self.owner.pop(key, None)
+        if node is not None:
+            node.close()
+
+    def command(self, key: NodeKey, method: str, *args, **kwargs) -> None:
+        """Send a command (see NODE_COMMANDS) to the worker owning a node.
+        """
+        i = self.owner[key]
+        with self.pipe_locks[i]:
+            self.pipes[i].send((method, key, args, kwargs))
+
+    def nodes(self) -> List[NodeKey]:
+        """Get the key (dongle, node_id) of the connected nodes.
+        """
+        with self.condition:
+            return list(self.nodes_by_key)
+
+    def first_node(self) -> NodeKey:
+        return self.nodes()[0]
+
+    def wait_ready(self, n: int = 1, timeout: Optional[float] = 5) -> List[NodeKey]:
+        """Wait until n nodes are connected and get their key.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: len(self.nodes_by_key) >= n, timeout):
+                raise TimeoutError()
+            return list(self.nodes_by_key)
+
+    def variables(self, key: NodeKey) -> List[str]:
+        return self.nodes_by_key[key].variables()
+
+    def events(self, key: NodeKey) -> List[str]:
+        return self.nodes_by_key[key].events
+
+    def native_functions(self, key: NodeKey) -> List[str]:
+        return self.nodes_by_key[key].native_functions
+
+    def set_node_refreshing(self, key: NodeKey, **settings) -> None:
+        self.command(key, "set_node_refreshing", **settings)
+
+    def __getitem__(self, key: NodeKey) -> ShardedNode:
+        return self.nodes_by_key[key]
+
+    def shutdown(self, timeout: Optional[float] = 5) -> None:
+        """Stop the workers and wait for them.
+        """
+        for pipe, lock in zip(self.pipes, self.pipe_locks):
+            with lock:
+                try:
+                    pipe.send(("shutdown",))
+                except OSError:
+                    pass
+        for worker in self.workers:
+            worker.join(timeout)
+        self.reader.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.shutdown()
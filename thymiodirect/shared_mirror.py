@@ -0,0 +1,323 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Variables of a node mirrored in a named shared memory block, for readers
+in other processes (requires Python 3.8)
+
+Block layout (little-endian):
+    magic        8s   b"THYMSHM1"
+    version      H    format version (2)
+    state        H    1 while the node is mirrored, 0 once closed
+    data_offset  I    offset of the variable data in the block
+    generation   Q    sequence lock, odd while the data is being changed
+    timestamp    d    time.time() of the last change
+    word_count   I    size of the variable data in 16-bit words
+    layout_size  I    size of the layout descriptor
+    owner_pid    I    id of the process of the writer
+    layout            JSON: node_id, name, variables (as Connection.variable_description),
+                      events, native_functions
+    data              int16 words, as RemoteNode.var_data, at data_offset (8-byte aligned)
+
+Usage
+-----
+
+connection = Connection.serial(shared_mirror="robots", refreshing_rate=0.1)
+...
+# in another process
+from thymiodirect.shared_mirror import SharedMirrorReader
+mirror = SharedMirrorReader("robots-2")  # Connection.shared_mirror_name(node_id)
+prox = mirror.get_var_array("prox.horizontal")
+values, generation = mirror.get_vars(["prox.horizontal", "motor.left.speed"])
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+MAGIC = b"THYMSHM1"
+VERSION = 2
+HEADER = struct.Struct("<8sHHIQdIII")
+STATE_OFFSET = 10
+GENERATION_OFFSET = 16
+TIMESTAMP_OFFSET = 24
+OWNER_PID_OFFSET = 40
+
+STATE_CLOSED = 0
+STATE_ACTIVE = 1
+
+attach_lock = threading.Lock()
+untracked = threading.local()  # untracked.active is True in a thread attaching a block without tracking it
+
+
+def attach_shared_memory(name: str):
+    """Attach to an existing shared memory segment without registering it
+    with the resource tracker, which would unlink it when this process
+    exits (the process which has created it is responsible for it).
+    """
+    from multiprocessing import resource_tracker, shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: no track argument
+        pass
+    with attach_lock:
+        if not hasattr(resource_tracker.register, "untracked"):
+            # wrapper installed once, which registers as usual in the other threads
+            register = resource_tracker.register
+
+            def register_unless_untracked(name, rtype):
+                if not getattr(untracked, "active", False):
+                    register(name, rtype)
+
+            register_unless_untracked.untracked = True
+            resource_tracker.register = register_unless_untracked
+    untracked.active = True
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        untracked.active = False
+
+
+def unlink_shared_memory(name: str) -> None:
+    """Unlink a segment which hasn't been created by this process, without
+    unregistering it from the resource tracker which doesn't know it.
+    """
+    try:
+        import _posixshmem
+    except ImportError:
+        # Windows: freed once all the handles have been closed
+        return
+    try:
+        _posixshmem.shm_unlink("/" + name)
+    except FileNotFoundError:
+        # unlinked meanwhile
+        pass
+
+
+def is_process_alive(pid: int) -> bool:
+    """Check whether a process exists (assumed on Windows, where blocks
+    disappear with the processes which use them).
+    """
+    if pid == 0 or sys.platform == "win32":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_stale(name: str) -> bool:
+    """Check whether an existing block was left by a process which has
+    exited without unlinking it.
+    """
+    try:
+        shm = attach_shared_memory(name)
+    except FileNotFoundError:
+        return False
+    except ValueError:
+        # being created
+        return False
+    try:
+        if shm.size < HEADER.size:
+            return False
+        magic, version = struct.unpack_from("<8sH", shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            # owner unknown
+            return False
+        owner_pid, = struct.unpack_from("<I", shm.buf, OWNER_PID_OFFSET)
+        if is_process_alive(owner_pid):
+            return False
+        struct.pack_into("<H", shm.buf, STATE_OFFSET, STATE_CLOSED)
+        return True
+    finally:
+        shm.close()
+
+
+class SharedMirror:
+    """Writer of the shared memory block of a node, owned by the process of
+    its Connection. Writes must be serialized (e.g. with
+    Connection.input_lock).
+    """
+
+    def __init__(self, name: str, remote_node):
+        from multiprocessing import shared_memory
+        layout = json.dumps({
+            "node_id": remote_node.node_id,
+            "name": remote_node.name,
+            "variables": [
+                {"name": name, "offset": remote_node.var_offset[name], "size": remote_node.var_size[name]}
+                for name in remote_node.named_variables
+            ],
+            "events": remote_node.local_events,
+            "native_functions": remote_node.native_functions,
+        }).encode()
+        data_offset = (HEADER.size + len(layout) + 7) & ~7
+        word_count = remote_node.var_total_size
+        size = data_offset + 2 * max(word_count, 1)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not is_stale(name):
+                raise FileExistsError(f"Shared memory block {name} is used by another connection "
+                                      "(pass a distinct shared_mirror prefix)")
+            # left by a process which has exited without closing it
+            unlink_shared_memory(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+        buf = self.shm.buf
+        HEADER.pack_into(buf, 0, MAGIC, VERSION, STATE_ACTIVE, data_offset, 0, time.time(), word_count, len(layout),
+                         os.getpid())
+        buf[HEADER.size:HEADER.size + len(layout)] = layout
+        self.generation_view = buf[GENERATION_OFFSET:GENERATION_OFFSET + 8].cast("Q")
+        self.words = buf[data_offset:data_offset + 2 * word_count].cast("h")
+        self.generation = 0
+        self.write(0, remote_node.var_data, remote_node.var_time)
+
+    def write(self, offset: int, data, timestamp: Optional[float] = None) -> None:
+        """Copy variable data (int16 array, from offset) to the block.
+        """
+        end = min(offset + len(data), len(self.words))
+        if offset >= end:
+            return
+        self.generation += 1
+        self.generation_view[0] = self.generation
+        self.words[offset:end] = data[:end - offset]
+        struct.pack_into("<d", self.shm.buf, TIMESTAMP_OFFSET, timestamp or time.time())
+        self.generation += 1
+        self.generation_view[0] = self.generation
+
+    def update(self, remote_node, offset: int, count: int) -> None:
+        """Copy the variables of a node which have been received (variable
+        listener signature).
+        """
+        self.write(offset, remote_node.var_data[offset:offset + count], remote_node.var_time)
+
+    def close(self) -> None:
+        """Mark the block as closed for readers and unlink it.
+        """
+        if self.shm is None:
+            return
+        struct.pack_into("<H", self.shm.buf, STATE_OFFSET, STATE_CLOSED)
+        self.generation_view.release()
+        self.words.release()
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class SharedMirrorReader:
+    """Read-only access to the shared memory block of a node, without
+    copying the data until values are requested.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shm = attach_shared_memory(name)
+        buf = self.shm.buf
+        magic, version, _, data_offset, _, _, word_count, layout_size, _ = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"{name} is not a thymiodirect shared mirror")
+        self.layout = json.loads(bytes(buf[HEADER.size:HEADER.size + layout_size]))
+        self.node_id: int = self.layout["node_id"]
+        self.var_offset: Dict[str, int] = {var["name"]: var["offset"] for var in self.layout["variables"]}
+        self.var_size: Dict[str, int] = {var["name"]: var["size"] for var in self.layout["variables"]}
+        self.generation_view = buf[GENERATION_OFFSET:GENERATION_OFFSET + 8].cast("Q")
+        self.words = buf[data_offset:data_offset + 2 * word_count].toreadonly().cast("h")
+
+    def close(self) -> None:
+        """Detach from the block. If views returned by view() or numpy() are
+        still referenced, the block stays mapped until they're freed.
+        """
+        self.generation_view.release()
+        self.words.release()
+        try:
+            self.shm.close()
+        except BufferError:
+            # exported views: the mapping is closed once they're freed, not by SharedMemory
+            self.shm._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback) -> None:
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        """True once the writer has closed the block (node disconnected).
+        """
+        return struct.unpack_from("<H", self.shm.buf, STATE_OFFSET)[0] != STATE_ACTIVE
+
+    @property
+    def generation(self) -> int:
+        return self.generation_view[0]
+
+    @property
+    def timestamp(self) -> float:
+        return self.read(lambda: struct.unpack_from("<d", self.shm.buf, TIMESTAMP_OFFSET)[0])[0]
+
+    def variables(self) -> List[str]:
+        return [var["name"] for var in self.layout["variables"]]
+
+    def read(self, fun: Callable[[], T]) -> Tuple[T, int]:
+        """Call fun until it has run without any concurrent change of the
+        data (sequence lock). Return its result and the generation of the
+        data it has read.
+        """
+        retries = 0
+        while True:
+            generation = self.generation_view[0]
+            if generation & 1 == 0:
+                result = fun()
+                if self.generation_view[0] == generation:
+                    return result, generation
+            retries += 1
+            if retries % 4 == 0:
+                # let the writer finish
+                time.sleep(0)
+
+    def changed_since(self, generation: int) -> bool:
+        return self.generation_view[0] != generation
+
+    def view(self, name: str) -> memoryview:
+        """Get a read-only view of a variable in the block (not protected
+        against concurrent changes, valid until close()).
+        """
+        offset = self.var_offset[name]
+        return self.words[offset:offset + self.var_size[name]]
+
+    def get_var(self, name: str, index: int = 0) -> int:
+        offset = self.var_offset[name] + index
+        return self.read(lambda: self.words[offset])[0]
+
+    def get_var_array(self, name: str) -> List[int]:
+        return self.read(lambda: self.view(name).tolist())[0]
+
+    def get_vars(self, names: List[str]) -> Tuple[Dict[str, List[int]], int]:
+        """Get the values of several variables read at once, and their
+        generation.
+        """
+        return self.read(lambda: {name: self.view(name).tolist() for name in names})
+
+    def numpy(self):
+        """Get the variable data as a read-only NumPy int16 array (zero
+        copy, not protected against concurrent changes, valid until close()).
+        """
+        import numpy as np  # pip3 install numpy
+        return np.frombuffer(self.words, dtype=np.int16)
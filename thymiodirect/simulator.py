@@ -0,0 +1,596 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Simulated Aseba nodes behind a switch, for tests without robots
+
+The simulator answers LIST_NODES, GET_NODE_DESCRIPTION (and
+GET_NODE_DESCRIPTION_FRAGMENT for protocol version 8), GET_DEVICE_INFO,
+GET_VARIABLES, GET_CHANGED_VARIABLES, SET_VARIABLES, SET_BYTECODE and the
+execution commands (RUN, STOP etc.) of any number of nodes with the
+variables, local events and native functions of a Thymio II, over TCP or a
+pseudo-terminal, with optional latency, jitter and loss of the replies.
+
+Usage
+-----
+
+From the command line:
+python3 -m thymiodirect.simulator --nodes 100 --port 33333 --latency 0.005
+
+From Python:
+simulator = Simulator(node_count=100, latency=0.005, jitter=0.002, loss=0.01)
+host, port = simulator.start_in_thread()
+connection = Connection.tcp(host, port)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from array import array
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .message import FrameReader, Message
+
+# variables of the Thymio II firmware, (name, size)
+THYMIO_VARIABLES = [
+    ("_id", 1),
+    ("event.source", 1),
+    ("event.args", 32),
+    ("_fwversion", 2),
+    ("_productId", 1),
+    ("buttons._raw", 5),
+    ("button.backward", 1),
+    ("button.left", 1),
+    ("button.center", 1),
+    ("button.forward", 1),
+    ("button.right", 1),
+    ("buttons._mean", 5),
+    ("buttons._noise", 5),
+    ("prox.horizontal", 7),
+    ("prox.comm.rx._payloads", 7),
+    ("prox.comm.rx._intensities", 7),
+    ("prox.comm.rx", 1),
+    ("prox.comm.tx", 1),
+    ("prox.ground.ambiant", 2),
+    ("prox.ground.reflected", 2),
+    ("prox.ground.delta", 2),
+    ("motor.left.target", 1),
+    ("motor.right.target", 1),
+    ("_vbat", 2),
+    ("_imot", 2),
+    ("motor.left.speed", 1),
+    ("motor.right.speed", 1),
+    ("motor.left.pwm", 1),
+    ("motor.right.pwm", 1),
+    ("_integrator", 2),
+    ("acc", 3),
+    ("leds.top", 3),
+    ("leds.bottom.left", 3),
+    ("leds.bottom.right", 3),
+    ("leds.circle", 8),
+    ("temperature", 1),
+    ("rc5.address", 1),
+    ("rc5.command", 1),
+    ("mic.intensity", 1),
+    ("mic.threshold", 1),
+    ("mic._mean", 1),
+    ("timer.period", 2),
+    ("acc._tap", 1),
+    ("sd.present", 1),
+]
+
+# local events of the Thymio II firmware, (name, description)
+THYMIO_LOCAL_EVENTS = [
+    ("button.backward", "Backward button status changed"),
+    ("button.left", "Left button status changed"),
+    ("button.center", "Center button status changed"),
+    ("button.forward", "Forward button status changed"),
+    ("button.right", "Right button status changed"),
+    ("buttons", "Buttons values updated"),
+    ("prox", "Proximity values updated"),
+    ("prox.comm", "Data received on the proximity communication"),
+    ("tap", "A tap is detected"),
+    ("acc", "Accelerometer values updated"),
+    ("mic", "Fired when microphone intensity is above threshold"),
+    ("sound.finished", "Fired when the playback of a user initiated sound is finished"),
+    ("temperature", "Temperature value updated"),
+    ("rc5", "RC5 message received"),
+    ("motor", "Motor timer"),
+    ("timer0", "Timer 0"),
+    ("timer1", "Timer 1"),
+]
+
+# native functions of the Thymio II firmware, (name, description, [(size, name)])
+# where size -1 stands for an array of any size (template parameter)
+THYMIO_NATIVE_FUNCTIONS = [
+    ("_system.reboot", "Reboot the microcontroller", []),
+    ("_system.settings.read", "Read a setting", [(1, "address"), (1, "value")]),
+    ("_system.settings.write", "Write a setting", [(1, "address"), (1, "value")]),
+    ("_system.settings.flash", "Write the settings into flash", []),
+    ("math.copy", "Copy an array", [(-1, "dest"), (-1, "src")]),
+    ("math.fill", "Fill an array with a value", [(-1, "dest"), (1, "value")]),
+    ("math.addscalar", "Add a scalar to an array", [(-1, "dest"), (-1, "src"), (1, "scalar")]),
+    ("math.add", "Add two arrays", [(-1, "dest"), (-1, "src1"), (-1, "src2")]),
+    ("math.sub", "Subtract two arrays", [(-1, "dest"), (-1, "src1"), (-1, "src2")]),
+    ("math.mul", "Multiply two arrays", [(-1, "dest"), (-1, "src1"), (-1, "src2")]),
+    ("math.div", "Divide two arrays", [(-1, "dest"), (-1, "src1"), (-1, "src2")]),
+    ("math.min", "Minimum of two arrays", [(-1, "dest"), (-1, "src1"), (-1, "src2")]),
+    ("math.max", "Maximum of two arrays", [(-1, "dest"), (-1, "src1"), (-1, "src2")]),
+    ("math.clamp", "Clamp an array", [(-1, "dest"), (-1, "src"), (-1, "low"), (-1, "high")]),
+    ("math.dot", "Scalar product", [(1, "dest"), (-1, "src1"), (-1, "src2"), (1, "shift")]),
+    ("math.stat", "Statistics of an array", [(-1, "src"), (1, "min"), (1, "max"), (1, "mean")]),
+    ("math.argbounds", "Indices of the min and max", [(-1, "src"), (2, "argbounds")]),
+    ("math.sort", "Sort an array", [(-1, "array")]),
+    ("math.muldiv", "Multiply and divide arrays", [(-1, "dest"), (-1, "a"), (-1, "b"), (-1, "c")]),
+    ("math.atan2", "Arc tangent", [(-1, "dest"), (-1, "y"), (-1, "x")]),
+    ("math.sin", "Sine", [(-1, "dest"), (-1, "src")]),
+    ("math.cos", "Cosine", [(-1, "dest"), (-1, "src")]),
+    ("math.rot2", "Rotation of a 2D vector", [(2, "dest"), (2, "src"), (1, "angle")]),
+    ("math.sqrt", "Square root", [(-1, "dest"), (-1, "src")]),
+    ("math.rand", "Random numbers", [(-1, "dest")]),
+    ("_leds.set", "Set a LED", [(1, "led"), (1, "br")]),
+    ("sound.record", "Start recording a sound", [(1, "N")]),
+    ("sound.play", "Play a recorded sound", [(1, "N")]),
+    ("sound.replay", "Replay a recorded sound", [(1, "N")]),
+    ("sound.system", "Play a system sound", [(1, "N")]),
+    ("leds.circle", "Set the LEDs of the circle",
+     [(1, "l0"), (1, "l1"), (1, "l2"), (1, "l3"), (1, "l4"), (1, "l5"), (1, "l6"), (1, "l7")]),
+    ("leds.top", "Set the top RGB LED", [(1, "r"), (1, "g"), (1, "b")]),
+    ("leds.bottom.right", "Set the bottom right RGB LED", [(1, "r"), (1, "g"), (1, "b")]),
+    ("leds.bottom.left", "Set the bottom left RGB LED", [(1, "r"), (1, "g"), (1, "b")]),
+    ("leds.buttons", "Set the LEDs of the buttons", [(1, "l0"), (1, "l1"), (1, "l2"), (1, "l3")]),
+    ("leds.prox.h", "Set the LEDs of the horizontal proximity sensors",
+     [(1, "l0"), (1, "l1"), (1, "l2"), (1, "l3"), (1, "l4"), (1, "l5"), (1, "l6"), (1, "l7")]),
+    ("leds.prox.v", "Set the LEDs of the ground proximity sensors", [(1, "l0"), (1, "l1")]),
+    ("leds.rc", "Set the LED of the RC receiver", [(1, "led")]),
+    ("leds.sound", "Set the LED of the microphone", [(1, "led")]),
+    ("leds.temperature", "Set the LEDs of the temperature sensor", [(1, "r"), (1, "b")]),
+    ("sound.freq", "Play a tone", [(1, "Hz"), (1, "ds")]),
+    ("sound.wave", "Set the wave of the tone generator", [(142, "wave")]),
+    ("prox.comm.enable", "Enable the proximity communication", [(1, "state")]),
+    ("sd.open", "Open a file on the SD card", [(1, "N"), (1, "status")]),
+    ("sd.write", "Write data to the file on the SD card", [(-1, "data"), (1, "written")]),
+    ("sd.read", "Read data from the file on the SD card", [(-1, "data"), (1, "read")]),
+    ("sd.seek", "Seek in the file on the SD card", [(1, "position"), (1, "status")]),
+    ("_rf.nodeid", "Set the wireless node id", [(1, "nodeID")]),
+    ("_poweroff", "Power off", []),
+]
+
+THYMIO_BYTECODE_SIZE = 1534
+THYMIO_STACK_SIZE = 32
+THYMIO_VARIABLES_SIZE = 620
+MAX_REPLY_SIZE = 64  # max number of words of variable data in a VARIABLES message
+
+# execution state flags
+EVENT_ACTIVE = 1
+STEP_BY_STEP = 2
+EVENT_RUNNING = 4
+
+
+def _string(s: str) -> bytes:
+    b = s.encode("utf-8")
+    return bytes([len(b)]) + b
+
+
+class SimulatedNode:
+    """Aseba node with the description of a Thymio II, whose sensor
+    variables change randomly over time. Replies to GET_VARIABLES are split
+    into VARIABLES messages of at most max_reply_size words.
+    """
+
+    def __init__(self, node_id: int, version: int = 7, name: str = "thymio-II",
+                 rng: Optional[random.Random] = None, max_reply_size: int = MAX_REPLY_SIZE):
+        self.node_id = node_id
+        self.version = version
+        self.name = name
+        self.max_reply_size = max_reply_size
+        self.rng = rng or random.Random(node_id)
+        self.device_name = f"{name} {node_id}"
+        self.device_uuid = uuid.UUID(int=self.rng.getrandbits(128), version=4)
+        self.rf_settings = (0x4f51, node_id, 1)  # network id, node id, channel
+        self.var_offset = {}  # indexed by name
+        offset = 0
+        for var_name, size in THYMIO_VARIABLES:
+            self.var_offset[var_name] = offset
+            offset += size
+        self.var_data = array("h", bytes(2 * offset))
+        self.reported_data = array("h", self.var_data)  # as of last GET_CHANGED_VARIABLES
+        self.bytecode = array("H", bytes(2 * THYMIO_BYTECODE_SIZE))
+        self.flags = STEP_BY_STEP
+        self.fragments = None  # description messages, built upon first GET_NODE_DESCRIPTION_FRAGMENT
+        self.last_update = None
+        self.set_var("_id", [node_id])
+        self.set_var("_fwversion", [14, 0])
+        self.set_var("_productId", [8])
+        self.set_var("temperature", [250])
+        self.set_var("acc", [0, 0, 22])
+        self.set_var("timer.period", [0, 0])
+
+    def set_var(self, name: str, values: List[int]) -> None:
+        offset = self.var_offset[name]
+        self.var_data[offset:offset + len(values)] = array("h", values)
+
+    def get_var(self, name: str, index: int = 0) -> int:
+        return self.var_data[self.var_offset[name] + index]
+
+    def update(self, now: float) -> None:
+        """Update the sensor variables.
+        """
+        if self.last_update is not None and now - self.last_update < 0.01:
+            return
+        self.last_update = now
+        rng = self.rng
+        for side in ("left", "right"):
+            target = self.get_var(f"motor.{side}.target")
+            self.set_var(f"motor.{side}.speed", [target + rng.randint(-5, 5) if target else 0])
+        self.set_var("prox.horizontal", [max(0, rng.randint(-2000, 4500)) for _ in range(7)])
+        self.set_var("prox.ground.delta", [rng.randint(700, 900) for _ in range(2)])
+        self.set_var("acc", [rng.randint(-1, 1), rng.randint(-1, 1), 22 + rng.randint(-1, 1)])
+        self.set_var("mic.intensity", [rng.randint(0, 20)])
+
+    def description_messages(self) -> List[Message]:
+        """Get the messages sent in reply to GET_NODE_DESCRIPTION.
+        """
+        messages = [self.message(Message.ID_DESCRIPTION,
+                                 _string(self.name) + Message.uint16array_to_bytes([
+                                     self.version,
+                                     THYMIO_BYTECODE_SIZE,
+                                     THYMIO_STACK_SIZE,
+                                     THYMIO_VARIABLES_SIZE,
+                                     len(THYMIO_VARIABLES),
+                                     len(THYMIO_LOCAL_EVENTS),
+                                     len(THYMIO_NATIVE_FUNCTIONS),
+                                 ]))]
+        for var_name, size in THYMIO_VARIABLES:
+            messages.append(self.message(Message.ID_NAMED_VARIABLE_DESCRIPTION,
+                                         Message.uint16_to_bytes(size) + _string(var_name)))
+        for event_name, description in THYMIO_LOCAL_EVENTS:
+            messages.append(self.message(Message.ID_LOCAL_EVENT_DESCRIPTION,
+                                         _string(event_name) + _string(description)))
+        for fun_name, description, params in THYMIO_NATIVE_FUNCTIONS:
+            payload = _string(fun_name) + _string(description) + Message.uint16_to_bytes(len(params))
+            for size, param_name in params:
+                payload += Message.uint16_to_bytes(size) + _string(param_name)
+            messages.append(self.message(Message.ID_NATIVE_FUNCTION_DESCRIPTION, payload))
+        return messages
+
+    def device_info_message(self, info: int) -> Optional[Message]:
+        if info == Message.DEVICE_INFO_NAME:
+            payload = bytes([info]) + _string(self.device_name)
+        elif info == Message.DEVICE_INFO_UUID:
+            payload = bytes([info, 16]) + self.device_uuid.bytes
+        elif info == Message.DEVICE_INFO_THYMIO2_RF_SETTINGS:
+            payload = bytes([info, 6]) + Message.uint16array_to_bytes(self.rf_settings)
+        else:
+            return None
+        return self.message(Message.ID_DEVICE_INFO, payload)
+
+    def changed_variables_message(self) -> Message:
+        """Get a CHANGED_VARIABLES message with the areas which have
+        changed since the previous one.
+        """
+        areas = []
+        start = None
+        for i, (value, reported) in enumerate(zip(self.var_data, self.reported_data)):
+            if value != reported:
+                if start is None:
+                    start = i
+            elif start is not None:
+                areas += [start, i - start] + self.var_data[start:i].tolist()
+                start = None
+        if start is not None:
+            areas += [start, len(self.var_data) - start] + self.var_data[start:].tolist()
+        self.reported_data = array("h", self.var_data)
+        return self.message(Message.ID_CHANGED_VARIABLES, Message.uint16array_to_bytes(areas))
+
+    def execution_state_message(self) -> Message:
+        return self.message(Message.ID_EXECUTION_STATE_CHANGED,
+                            Message.uint16array_to_bytes([0, self.flags]))
+
+    def message(self, id: int, payload: bytes) -> Message:
+        return Message(id, self.node_id, payload)
+
+    def handle(self, msg: Message, now: float) -> List[Message]:
+        """Handle a message sent to the node and get the replies.
+        """
+        if msg.id == Message.ID_LIST_NODES:
+            return [self.message(Message.ID_NODE_PRESENT, Message.uint16_to_bytes(self.version))]
+        if msg.id == Message.ID_GET_VARIABLES:
+            self.update(now)
+            end = min(msg.var_offset + msg.var_count, len(self.var_data))
+            return [
+                self.message(Message.ID_VARIABLES,
+                             Message.uint16array_to_bytes([offset],
+                                                          self.var_data[offset:min(offset + self.max_reply_size, end)]))
+                for offset in range(msg.var_offset, end, self.max_reply_size)
+            ]
+        if msg.id == Message.ID_GET_CHANGED_VARIABLES:
+            if self.version < 7:
+                return []
+            self.update(now)
+            return [self.changed_variables_message()]
+        if msg.id == Message.ID_SET_VARIABLES:
+            end = min(msg.var_offset + len(msg.var_val), len(self.var_data))
+            self.var_data[msg.var_offset:end] = msg.var_val[:end - msg.var_offset]
+        elif msg.id == Message.ID_GET_NODE_DESCRIPTION:
+            return self.description_messages()
+        elif msg.id == Message.ID_GET_NODE_DESCRIPTION_FRAGMENT:
+            if self.version < 8:
+                return []
+            if self.fragments is None:
+                self.fragments = self.description_messages()
+            return [self.fragments[msg.fragment]] if msg.fragment < len(self.fragments) else []
+        elif msg.id == Message.ID_GET_DEVICE_INFO:
+            reply = self.device_info_message(msg.device_info)
+            return [reply] if reply is not None else []
+        elif msg.id == Message.ID_SET_BYTECODE:
+            end = min(msg.bc_offset + len(msg.bc), len(self.bytecode))
+            self.bytecode[msg.bc_offset:end] = msg.bc[:end - msg.bc_offset]
+        elif msg.id == Message.ID_RUN:
+            self.flags = 0
+            return [self.execution_state_message()]
+        elif msg.id in (Message.ID_STOP, Message.ID_PAUSE, Message.ID_RESET):
+            self.flags = STEP_BY_STEP
+            return [self.execution_state_message()]
+        elif msg.id == Message.ID_GET_EXECUTION_STATE:
+            return [self.execution_state_message()]
+        return []
+
+
+class Simulator:
+    """Switch with simulated nodes, whose replies are delayed by latency
+    plus or minus a uniformly distributed jitter and lost with probability
+    loss. Replies to each client keep their order.
+    """
+
+    MAX_PENDING_OUTPUT = 1 << 20  # max bytes waiting to be written to a pty before it is closed
+
+    def __init__(self, node_count: int = 1, first_node_id: int = 2, version: int = 7,
+                 latency: float = 0, jitter: float = 0, loss: float = 0,
+                 seed: Optional[int] = None, max_reply_size: int = MAX_REPLY_SIZE):
+        self.rng = random.Random(seed)
+        self.nodes: Dict[int, SimulatedNode] = {
+            node_id: SimulatedNode(node_id, version, rng=random.Random(self.rng.getrandbits(32)),
+                                   max_reply_size=max_reply_size)
+            for node_id in range(first_node_id, first_node_id + node_count)
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.loop = None
+        self.servers = []
+        self.message_count = 0  # number of messages received
+        self.lost_count = 0  # number of replies dropped
+
+    def handle(self, msg: Message) -> List[Message]:
+        """Handle a message from a client and get the replies of all nodes.
+        """
+        self.message_count += 1
+        now = time.monotonic()
+        if msg.id == Message.ID_LIST_NODES:
+            replies = []
+            for node in self.nodes.values():
+                replies += node.handle(msg, now)
+            return replies
+        if msg.id < Message.ID_FIRST_ASEBA_ID or msg.id not in Message.decoders:
+            # user events and messages without a target node
+            return []
+        node = self.nodes.get(getattr(msg, "target_node_id", None))
+        return node.handle(msg, now) if node is not None else []
+
+    def delay(self) -> float:
+        if self.jitter:
+            return max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0)
+        return self.latency
+
+    def connect_client(self, write: Callable[[bytes], None]) -> Callable[[bytes], None]:
+        """Connect a client which sends data with write(bytes) and get the
+        function to call with the data it receives.
+        """
+        frame_reader = FrameReader()
+        queue = deque()  # (loop time, data) of delayed replies, in order
+        timer = None  # handle of the call of flush for the first reply in queue
+
+        def flush() -> None:
+            nonlocal timer
+            timer = None
+            now = self.loop.time()
+            while queue and queue[0][0] <= now:
+                write(queue.popleft()[1])
+            if queue:
+                timer = self.loop.call_at(queue[0][0], flush)
+
+        def send(data: bytes) -> None:
+            nonlocal timer
+            due = self.loop.time() + self.delay()
+            if not queue and due <= self.loop.time():
+                write(data)
+                return
+            # no reordering: not before the previous reply
+            queue.append((max(due, queue[-1][0]) if queue else due, data))
+            if timer is None:
+                timer = self.loop.call_at(queue[0][0], flush)
+
+        def data_received(data: bytes) -> None:
+            replies = []
+            for msg in frame_reader.feed(data):
+                replies += self.handle(msg)
+            if self.loss:
+                kept = [reply for reply in replies if self.rng.random() >= self.loss]
+                self.lost_count += len(replies) - len(kept)
+                replies = kept
+            if replies:
+                send(b"".join(reply.serialize() for reply in replies))
+
+        return data_received
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 33333) -> Tuple[str, int]:
+        """Start serving clients over TCP in the running loop. Return the
+        actual address (port 0 picks a free port).
+        """
+        self.loop = asyncio.get_running_loop()
+
+        async def client(reader, writer):
+            data_received = self.connect_client(writer.write)
+            try:
+                while True:
+                    data = await reader.read(4096)
+                    if not data:
+                        break
+                    data_received(data)
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(client, host, port)
+        self.servers.append(server)
+        return server.sockets[0].getsockname()[:2]
+
+    async def start_pty(self) -> str:
+        """Start serving a client over a pseudo-terminal in the running loop
+        (not on Windows). Return the name of the device to open as a serial
+        port.
+        """
+        import pty
+        import tty
+        self.loop = asyncio.get_running_loop()
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+
+        pending = bytearray()  # output not accepted yet by the pty
+        closed = False
+
+        def close():
+            nonlocal closed
+            closed = True
+            self.loop.remove_reader(master)
+            self.loop.remove_writer(master)
+            pending.clear()
+            os.close(master)
+
+        def flush():
+            try:
+                count = os.write(master, pending)
+            except BlockingIOError:
+                return
+            except OSError:
+                close()
+                return
+            del pending[:count]
+            if not pending:
+                self.loop.remove_writer(master)
+
+        def write(data):
+            if closed:
+                return
+            if not pending:
+                try:
+                    count = os.write(master, data)
+                except BlockingIOError:
+                    count = 0
+                except OSError:
+                    close()
+                    return
+                data = data[count:]
+                if not data:
+                    return
+                self.loop.add_writer(master, flush)
+            pending.extend(data)
+            if len(pending) > self.MAX_PENDING_OUTPUT:
+                # client not reading: close rather than corrupt the stream
+                close()
+
+        data_received = self.connect_client(write)
+
+        def read_ready():
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                close()
+                return
+            data_received(data)
+
+        self.loop.add_reader(master, read_ready)
+        self.servers.append((master, slave))
+        return os.ttyname(slave)
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> Tuple[str, int]:
+        """Serve over TCP in a new daemon thread with its own loop. Return
+        the actual address.
+        """
+        loop = asyncio.new_event_loop()
+        address = []
+        ready = threading.Event()
+
+        async def start():
+            address.extend(await self.start_tcp(host, port))
+            ready.set()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.create_task(start())
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return address[0], address[1]
+
+
+if __name__ == "__main__":
+
+    node_count = 1
+    host = "127.0.0.1"
+    port = 33333
+    options = {}
+    use_pty = False
+    args = sys.argv[1:]
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--nodes":
+                node_count = int(args.pop(0))
+            elif arg == "--host":
+                host = args.pop(0)
+            elif arg == "--port":
+                port = int(args.pop(0))
+            elif arg == "--pty":
+                use_pty = True
+            elif arg in ("--latency", "--jitter", "--loss"):
+                options[arg[2:]] = float(args.pop(0))
+            elif arg == "--version":
+                options["version"] = int(args.pop(0))
+            elif arg == "--reply-size":
+                options["max_reply_size"] = int(args.pop(0))
+            else:
+                raise ValueError(arg)
+    except (IndexError, ValueError):
+        print("Usage: python3 -m thymiodirect.simulator [--nodes n] [--host h] [--port p] [--pty] "
+              "[--latency s] [--jitter s] [--loss p] [--version v] [--reply-size words]")
+        exit(1)
+
+    simulator = Simulator(node_count, **options)
+
+    async def main():
+        if use_pty:
+            print(f"Serving {node_count} node(s) on {await simulator.start_pty()}")
+        else:
+            address = await simulator.start_tcp(host, port)
+            print(f"Serving {node_count} node(s) on {address[0]}:{address[1]}")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
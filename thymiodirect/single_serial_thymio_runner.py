@@ -7,6 +7,7 @@
 import time
 from typing import Optional
 
+from .connection import Connection
 from .thymio import Thymio
 from .thymio_observer import ThymioObserver
 
@@ -27,7 +28,8 @@ class SingleSerialThymioRunner:
                  observer: ThymioObserver,
                  refreshing_rate=0.1,
                  serial_port: Optional[str] = None,
-                 connection_delay=1.5
+                 connection_delay=None,
+                 ready_timeout: Optional[float] = 10
                  ):
         self.thymio = Thymio(refreshing_coverage=refreshing_coverage,
                              refreshing_rate=refreshing_rate,
@@ -36,6 +38,9 @@ class SingleSerialThymioRunner:
                              discover_rate=1)
         self.observer = observer
         self._connection_delay = connection_delay
+        self._ready_timeout = ready_timeout
+        # variables are received only if they're refreshed
+        self._ready_stage = Connection.READY_DESCRIBED if refreshing_rate is None else Connection.READY_VARIABLES
 
     def _on_error(self, error):
         print(error)
@@ -45,11 +50,17 @@ class SingleSerialThymioRunner:
         """
         Runs the specified observer on the first (and only) thymio node connected via serial until the observer is
         stopped or interrupted. Designed to run only once per thymio and observer even though it might work multiple times.
+        Raises TimeoutError if the node isn't ready (described, and with its first variable values if they're
+        refreshed) after ready_timeout seconds.
         """
         with self.thymio, self.observer:
             self.thymio.connect()
 
-            time.sleep(self._connection_delay)
+            if self._connection_delay is not None:
+                time.sleep(self._connection_delay)
+            else:
+                # until the first variable values have been received, if refreshed
+                self.thymio.wait_ready(stage=self._ready_stage, timeout=self._ready_timeout)
 
             id = self.thymio.first_node()
             print_thymio_functions_events(self.thymio, id)
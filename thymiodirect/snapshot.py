@@ -0,0 +1,79 @@
+# This file is part of thymiodirect.
+# Copyright 2020 ECOLE POLYTECHNIQUE FEDERALE DE LAUSANNE,
+# Miniature Mobile Robots group, Switzerland
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+"""
+Snapshots of the variables of a node as NumPy arrays (requires numpy)
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+
+class VariableSnapshot:
+    """Copy of the variables of a node, as a flat NumPy array of int16 and as
+    a structured record whose fields are the variables.
+    """
+
+    def __init__(self, node_id: int, offset: int, data, record, timestamp: Optional[float]):
+        self.node_id = node_id
+        self.offset = offset  # offset of data[0] in the variable space of the node
+        self.data = data  # numpy int16 array
+        self.record = record  # view of data with one field per variable
+        self.timestamp = timestamp  # time.time() when the variables were received
+
+    def __getitem__(self, name: str):
+        return self.record[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.record.dtype.names
+
+    def names(self):
+        """Get the names of the variables in the snapshot.
+        """
+        return self.record.dtype.names
+
+    def __repr__(self) -> str:
+        return f"VariableSnapshot(node_id={self.node_id}, timestamp={self.timestamp}, names={self.names()})"
+
+
+def variables_dtype(remote_node, names: Iterable[str], offset: int = 0):
+    """Get the NumPy structured dtype of the variables of a node, with
+    offsets relative to the specified variable offset.
+    """
+    import numpy as np  # pip3 install numpy
+    names = list(names)
+    formats = [
+        np.int16 if remote_node.var_size[name] == 1 else (np.int16, (remote_node.var_size[name],))
+        for name in names
+    ]
+    offsets = [2 * (remote_node.var_offset[name] - offset) for name in names]
+    end = max((remote_node.var_offset[name] + remote_node.var_size[name] for name in names), default=offset)
+    return np.dtype({
+        "names": names,
+        "formats": formats,
+        "offsets": offsets,
+        "itemsize": 2 * (end - offset),
+    })
+
+
+def take_snapshot(remote_node, variables: Optional[Iterable[str]] = None) -> VariableSnapshot:
+    """Copy all the variables of a node, or the specified ones, with a single
+    copy of the span which covers them.
+    """
+    import numpy as np  # pip3 install numpy
+    if variables is None:
+        names = list(remote_node.named_variables)
+    else:
+        names = list(variables)
+        for name in names:
+            if name not in remote_node.var_offset:
+                raise KeyError(name)
+    start = min((remote_node.var_offset[name] for name in names), default=0)
+    end = max((remote_node.var_offset[name] + remote_node.var_size[name] for name in names), default=0)
+    data = np.frombuffer(memoryview(remote_node.var_data)[start:end], dtype=np.int16).copy()
+    record = data.view(variables_dtype(remote_node, names, start))[0] if end > start else None
+    return VariableSnapshot(remote_node.node_id, start, data, record, remote_node.var_time)
@@ -17,7 +17,7 @@ import threading
 import time
 from typing import List, Callable
 
-from .connection import Connection
+from .connection import Connection, is_array_value
 from .assembler import Assembler
 
 
@@ -44,6 +44,7 @@ class Thymio:
             self.connection = None
             self.loop = asyncio.new_event_loop()
             self.nodes = set()
+            self.opened = threading.Event()  # set once the connection has been opened or has failed
 
         def run(self):
             """
@@ -95,17 +96,32 @@ class Thymio:
                                                          discover_rate=self.thymio.discover_rate,
                                                          refreshing_rate=self.thymio.refreshing_rate,
                                                          refreshing_coverage=self.thymio.refreshing_coverage,
+                                                         refreshing_changed_only=self.thymio.refreshing_changed_only,
+                                                         refreshing_rates=self.thymio.refreshing_rates,
+                                                         refreshing_pacing=self.thymio.refreshing_pacing,
+                                                         asyncio_input=self.thymio.asyncio_input,
+                                                         description_cache=self.thymio.description_cache,
+                                                         description_window=self.thymio.description_window,
+                                                         shared_mirror=self.thymio.shared_mirror,
                                                          loop=self.loop)
                     else:
                         self.connection = Connection.serial(port=self.thymio.serial_port,
                                                             discover_rate=self.thymio.discover_rate,
                                                             refreshing_rate=self.thymio.refreshing_rate,
                                                             refreshing_coverage=self.thymio.refreshing_coverage,
+                                                            refreshing_changed_only=self.thymio.refreshing_changed_only,
+                                                            refreshing_rates=self.thymio.refreshing_rates,
+                                                            refreshing_pacing=self.thymio.refreshing_pacing,
+                                                            asyncio_input=self.thymio.asyncio_input,
+                                                            description_cache=self.thymio.description_cache,
+                                                            description_window=self.thymio.description_window,
+                                                            shared_mirror=self.thymio.shared_mirror,
                                                             loop=self.loop)
                     break
                 except Exception as error:
                     if iter > 0:
                         on_comm_error("open: " + str(error))
+                        self.opened.set()
                         return
                     else:
                         # give some time if the connection was closed immediately before
@@ -115,6 +131,8 @@ class Thymio:
             self.connection.on_variables_received = on_variables_received
             self.connection.on_user_event = on_user_event
             self.connection.on_comm_error = on_comm_error
+            # once the loop runs, for Connection.wait_ready in other threads
+            self.loop.call_soon(self.opened.set)
 
             self.connection.run_tasks()
 
@@ -122,7 +140,8 @@ class Thymio:
             """
             Shut down the event loop.
             """
-            self.connection.shutdown()
+            if self.connection is not None:
+                self.connection.shutdown()
 
     class Node:
         def __init__(self, node_id: int, thymio_proxy: Thymio._ThymioProxy):
@@ -138,7 +157,7 @@ class Thymio:
 
         def __setitem__(self, name, val):
             try:
-                if isinstance(val, list):
+                if is_array_value(val):
                     self._thymio_proxy.connection.set_var_array(self.node_id, name, val)
                 else:
                     self._thymio_proxy.connection.set_var(self.node_id, name, val)
@@ -155,7 +174,14 @@ class Thymio:
                  on_comm_error: Callable[[str], None] = None,
                  refreshing_rate=0.1,
                  refreshing_coverage=None,
+                 refreshing_changed_only=False,
+                 refreshing_rates=None,
+                 refreshing_pacing=None,
                  discover_rate=2,
+                 asyncio_input=False,
+                 description_cache=None,
+                 description_window=None,
+                 shared_mirror=None,
                  loop=None):
         self.use_tcp = use_tcp
         self.serial_port = serial_port
@@ -166,7 +192,14 @@ class Thymio:
         self.on_comm_error = on_comm_error
         self.refreshing_rate = refreshing_rate
         self.refreshing_coverage: dict = refreshing_coverage
+        self.refreshing_changed_only = refreshing_changed_only
+        self.refreshing_rates = refreshing_rates
+        self.refreshing_pacing = refreshing_pacing
         self.discover_rate = discover_rate
+        self.asyncio_input = asyncio_input
+        self.description_cache = description_cache
+        self.description_window = description_window
+        self.shared_mirror = shared_mirror
         self.loop = loop or asyncio.get_event_loop()
         self.thymio_proxy = None
         self.variable_observers: dict[int, Callable[[int], None]] = {}
@@ -178,16 +211,34 @@ class Thymio:
 
         def thymio_thread():
             asyncio.set_event_loop(asyncio.new_event_loop())
-            self.thymio_proxy = self._ThymioProxy(self)
             self.thymio_proxy.run()
 
+        self.thymio_proxy = self._ThymioProxy(self)
         self.thread = threading.Thread(target=thymio_thread)
         self.thread.start()
         if progress is None:
             progress = lambda: None
-        while self.thymio_proxy is None or len(self.thymio_proxy.nodes) == 0:
+        while True:
             progress()
-            time.sleep(delay)
+            try:
+                self.wait_ready(timeout=delay)
+                break
+            except TimeoutError:
+                pass
+
+    def wait_ready(self, n: int = 1, stage: int = Connection.READY_DESCRIBED, timeout=None) -> List[int]:
+        """Wait until n nodes have reached a readiness stage (Connection.READY_PRESENT,
+        READY_DESCRIBED or READY_VARIABLES) and get their id. Raise TimeoutError
+        if the timeout elapses first, or Connection.ThymioConnectionError if the
+        connection couldn't be opened.
+        """
+        t_end = None if timeout is None else time.monotonic() + timeout
+        if self.thymio_proxy is None or not self.thymio_proxy.opened.wait(timeout):
+            raise TimeoutError()
+        if self.thymio_proxy.connection is None:
+            raise Connection.ThymioConnectionError("connection not opened")
+        return self.thymio_proxy.connection.wait_ready(n, stage,
+                                                       None if t_end is None else max(t_end - time.monotonic(), 0))
 
     def disconnect(self):
         self.thymio_proxy.shutdown()
@@ -229,6 +280,29 @@ class Thymio:
     def __getitem__(self, key):
         return Thymio.Node(key, self.thymio_proxy)
 
+    def snapshot(self, node_id: int, variables=None):
+        """Get a VariableSnapshot with a NumPy copy of all the variables of a
+        node, or of the specified ones, and the time they were received.
+        """
+        return self.thymio_proxy.connection.snapshot(node_id, variables)
+
+    def get_vars(self, node_id: int, names):
+        """Get the values of several variables from the same refresh, as a
+        dict of lists, and a generation number to check with changed_since.
+        """
+        return self.thymio_proxy.connection.get_vars(node_id, names)
+
+    def changed_since(self, node_id: int, generation: int) -> bool:
+        """Check whether the variables have changed since get_vars.
+        """
+        return self.thymio_proxy.connection.changed_since(node_id, generation)
+
+    def set_refreshing(self, node_id: int, **settings) -> None:
+        """Change the refresh settings of a node with keyword arguments
+        rate, coverage, rates, changed_only or pacing.
+        """
+        self.thymio_proxy.connection.set_node_refreshing(node_id, **settings)
+
     def set_variable_observer(self, node_id: int, observer: Callable[[int], None]):
         self.variable_observers[node_id] = observer
 